@@ -1,7 +1,13 @@
-from fastapi import APIRouter, HTTPException
+from typing import Any
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from backend.api import deps
+from backend.api.v1.endpoints.projects import get_owned_project
+from backend.db.session import get_db
 from backend.inference.rag_flow import rag_query_stream
+from backend.rag.chunks import get_snippet
+import uuid
 
 router = APIRouter()
 
@@ -18,3 +24,24 @@ async def chat_endpoint(request: ChatRequest):
         rag_query_stream(request.message, request.project_id),
         media_type="text/event-stream"
     )
+
+@router.get("/snippets/{chunk_id}")
+async def snippet_endpoint(
+    chunk_id: str,
+    project_id: str,
+    current_user: Any = Depends(deps.get_current_user),
+):
+    """
+    Text of a cited chunk; the citations event only carries pointers.
+    """
+    try:
+        cid = uuid.UUID(chunk_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Snippet not found")
+    SessionLocal = await get_db()
+    async with SessionLocal() as session:
+        proj = await get_owned_project(session, project_id, current_user)
+        snippet = await get_snippet(session, proj.id, cid)
+    if snippet is None:
+        raise HTTPException(status_code=404, detail="Snippet not found")
+    return snippet
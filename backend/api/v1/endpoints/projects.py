@@ -1,11 +1,18 @@
 from typing import Any, List
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import or_, select
 from backend.db.session import get_db
 from backend.models.models import Project
 from backend.models.document import Document
 from backend.api import deps
+from backend.core.config import settings
+from backend.ingestion.jobs import (
+    TERMINAL_STATUSES, create_job, get_latest_job, job_to_dict, start_ingestion_job
+)
+import asyncio
+import json
 import uuid
 
 router = APIRouter()
@@ -80,91 +87,106 @@ async def create_project(
             await session.commit()
             await session.refresh(new_project)
             
-            # 2. Trigger Ingestion SYNCHRONOUSLY (Await it) to avoid Cloud Run CPU throttling
-            # We accept this might block for 10-20s, but it guarantees completion.
-            await run_ingestion(repo_url, str(new_project.id))
+            # 2. Queue Ingestion as a tracked job; progress via GET /{id}/ingestion(/stream)
+            job = await create_job(session, new_project.id)
+            start_ingestion_job(job.id)
             
-            return {"id": str(new_project.id), "name": new_project.name, "repo_url": new_project.repo_url}
+            return {
+                "id": str(new_project.id),
+                "name": new_project.name,
+                "repo_url": new_project.repo_url,
+                "job_id": str(job.id),
+                "status": job.status
+            }
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-async def run_ingestion(repo_url: str, project_id: str):
+async def get_owned_project(session, project_id: str, current_user: Any) -> Project:
     """
-    Async ingestion function awaiting all steps.
+    Loads a project, raising 404/403 unless it belongs to the current user.
+    """
+    try:
+        pid = uuid.UUID(project_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    proj = await session.get(Project, pid)
+    if not proj:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if str(proj.owner_id) != str(current_user.id):
+        raise HTTPException(status_code=403, detail="Not authorized to access this project")
+    return proj
+
+@router.post("/{project_id}/sync", response_model=Any)
+async def sync_project(
+    project_id: str,
+    current_user: Any = Depends(deps.get_current_user),
+):
+    """
+    Queue a re-ingestion that only processes files changed since the last one.
     """
-    from backend.ingestion.repo_loader import repo_loader
-    from backend.ingestion.parser import code_parser
-    from backend.rag.embeddings import embedding_service
-    from backend.models.analytics import Embedding
-    import logging
-    
-    logger = logging.getLogger("ingestion")
-    logger.setLevel(logging.INFO)
-    
-    print(f"[INGEST] Starting ingestion for {repo_url} (Project: {project_id})")
-    
-    # 1. Clone
     try:
-        # Clone is synchronous (uses gitpython blocking), run in threadpool if needed, 
-        # but for now direct call is fine if simple.
-        repo_path = repo_loader.clone_repo(repo_url, repo_id=project_id)
-        print(f"[INGEST] Cloned to {repo_path}")
+        SessionLocal = await get_db()
+        async with SessionLocal() as session:
+            proj = await get_owned_project(session, project_id, current_user)
+            job = await create_job(session, proj.id, incremental=True)
+            start_ingestion_job(job.id)
+            return job_to_dict(job)
+    except HTTPException as he:
+        raise he
     except Exception as e:
-        print(f"[INGEST] Clone failed: {e}")
-        # We don't raise here to avoid crashing the whole request response, 
-        # but in a perfect world we would update Project status to 'failed'
-        return
-    
-    # 2. Walk and Parse
-    files = repo_loader.get_file_list(repo_path)
-    print(f"[INGEST] Found {len(files)} files")
-    
-    parsed_count = 0
-    total_chunks = 0
-    
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{project_id}/ingestion", response_model=Any)
+async def get_ingestion_status(
+    project_id: str,
+    current_user: Any = Depends(deps.get_current_user),
+):
+    """
+    Status and progress counters of the project's latest ingestion job.
+    """
     SessionLocal = await get_db()
     async with SessionLocal() as session:
-        for file_path in files:
-            try:
-                # Parse
-                root_node, content = code_parser.parse_file(file_path)
-                chunks = []
-                if root_node:
-                    chunks = code_parser.extract_definitions(root_node, content)
-                
-                # Fallback
-                if not chunks:
-                    chunks = code_parser.chunk_file_generic(content, file_path)
-                
-                if chunks:
-                    # Create Document
-                    doc = Document(project_id=project_id, type="code", path=file_path, metadata_={"language": "unknown"})
-                    session.add(doc)
-                    await session.flush() # Get ID
-                    
-                    for chunk in chunks:
-                        # Embed
-                        vector = embedding_service.embed_text(chunk['content'])
-                        
-                        # Create Embedding
-                        emb = Embedding(
-                            document_id=doc.id,
-                            vector=vector,
-                            chunk_metadata=chunk
-                        )
-                        session.add(emb)
-                        total_chunks += 1
-                    
-                    parsed_count += 1
-            except Exception as e:
-                print(f"[INGEST] Error processing {file_path}: {e}")
-        
-        await session.commit()
-    
-    print(f"[INGEST] Completed. Parsed {parsed_count}/{len(files)} files. Total chunks: {total_chunks}")
+        proj = await get_owned_project(session, project_id, current_user)
+        job = await get_latest_job(session, proj.id)
+        if not job:
+            raise HTTPException(status_code=404, detail="No ingestion job for this project")
+        return job_to_dict(job)
+
+@router.get("/{project_id}/ingestion/stream")
+async def stream_ingestion_status(
+    project_id: str,
+    current_user: Any = Depends(deps.get_current_user),
+):
+    """
+    SSE stream of the latest ingestion job's progress until it finishes.
+    """
+    SessionLocal = await get_db()
+    async with SessionLocal() as session:
+        proj = await get_owned_project(session, project_id, current_user)
+
+    async def events():
+        last = None
+        while True:
+            async with SessionLocal() as session:
+                job = await get_latest_job(session, proj.id)
+            if not job:
+                yield f"data: {json.dumps({'type': 'error', 'data': 'No ingestion job for this project'})}\n\n"
+                break
+            current = job_to_dict(job)
+            if current != last:
+                yield f"data: {json.dumps({'type': 'progress', 'data': current})}\n\n"
+                last = current
+            if job.status in TERMINAL_STATUSES:
+                break
+            await asyncio.sleep(settings.INGEST_PROGRESS_INTERVAL)
+        yield "data: [DONE]\n\n"
 
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 @router.get("/{project_id}/structure", response_model=Any)
 async def get_project_structure(
@@ -192,8 +214,13 @@ async def get_project_structure(
                  # For now, simplistic privacy. In real app, might allow shared.
                  raise HTTPException(status_code=403, detail="Not authorized to view this project")
 
-            # Fetch all documents for this project
-            result = await session.execute(select(Document).filter(Document.project_id == pid))
+            # Fetch the documents of the live index generation
+            generation = proj.active_generation or 0
+            result = await session.execute(select(Document).filter(
+                Document.project_id == pid,
+                Document.generation <= generation,
+                or_(Document.retired_generation.is_(None), Document.retired_generation > generation),
+            ))
             docs = result.scalars().all()
             
             if not docs:
@@ -27,6 +27,77 @@ class Settings(BaseSettings):
     
     REDIS_URL: str = "redis://localhost:6379/0"
 
+    # Ingestion pipeline
+    INGESTION_RUNNER: str = "inprocess"  # "inprocess" (single node) or "celery"
+    INGEST_PROGRESS_INTERVAL: float = 1.0  # Seconds between job progress writes/SSE polls
+    INGEST_SHARD_BYTES: int = 0  # Celery runner: fan out repos above this size into shards of it, 0 = off
+    INGEST_SHARD_MAX_RETRIES: int = 3
+    INGEST_STALE_AFTER: int = 300  # Seconds without a heartbeat before an unfinished job is resumed elsewhere
+    INGEST_RESUME_ON_STARTUP: bool = True  # API processes watch for and resume interrupted jobs
+    INGEST_FROM_GIT_OBJECTS: bool = True  # Read files from the git object store, no working tree on disk
+    INGEST_MAX_FILE_BYTES: int = 1024 * 1024  # Larger files are skipped without being read, 0 = no limit
+    INGEST_IGNORE_FILE: str = ".speccraftignore"  # Per-project ignore rules (gitignore syntax) at the repo root
+    INGEST_SKIP_VENDORED: bool = True  # node_modules, vendor, third_party, ...
+    INGEST_SKIP_GENERATED: bool = True  # Minified bundles, lockfiles, protoc output, "DO NOT EDIT" files
+    INGEST_PARSE_WORKERS: int = 0  # 0 = os.cpu_count()
+    INGEST_QUEUE_SIZE: int = 64  # Max files buffered between stages
+    INGEST_COMMIT_EVERY: int = 200  # Files per DB transaction
+    INGEST_WRITE_BATCH_ROWS: int = 5000  # Rows buffered before a COPY round trip
+    INGEST_EMBED_BUFFER: int = 512  # Chunks buffered across files before encoding
+    INDEX_GC_DELAY: int = 60  # Seconds after a generation goes live before the rows it replaced are deleted
+    INDEX_GC_BATCH: int = 1000  # Documents (with their embeddings) deleted per GC transaction
+    EMBED_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    EMBED_BATCH_SIZE: int = 64  # Texts per encode() forward pass
+    EMBED_CACHE: bool = True  # Reuse chunk vectors by (model, sha256 of text) across projects and re-ingestions
+    EMBED_CACHE_DIR: str = ""  # Optional local disk tier in front of the Postgres table, "" = off
+    CHUNK_MAX_TOKENS: int = 0  # Tokens per chunk window, 0 = the embedding model's max_seq_length
+    CHUNK_OVERLAP_TOKENS: int = 32  # Tokens shared by consecutive windows of one split chunk
+    QUERY_EMBED_CACHE_SIZE: int = 2048  # Query embeddings kept in memory
+    QUERY_EMBED_CACHE_TTL: int = 0  # Seconds, 0 = no expiry
+    QUERY_BATCH_MAX_SIZE: int = 32  # Concurrent queries encoded in one forward pass
+    QUERY_BATCH_MAX_WAIT_MS: float = 5.0  # How long the first query waits for company
+
+    # Repo mirror cache (shared bare clones under REPO_STORAGE_PATH/.mirrors)
+    REPO_MIRROR_CACHE: bool = True
+    REPO_MIRROR_CACHE_BYTES: int = 10 * 1024 ** 3  # Disk budget, least recently used mirrors are evicted
+
+    # Answer cache
+    ANSWER_CACHE_SIZE: int = 1024
+    ANSWER_CACHE_TTL: int = 86400  # Seconds, 0 = no expiry
+    ANSWER_CACHE_REDIS: bool = False  # Share entries across workers through REDIS_URL
+    ANSWER_CACHE_SIMILARITY: float = 0.0  # Cosine threshold for near-duplicate hits, 0 = exact only
+    ANSWER_CACHE_SIMILARITY_WINDOW: int = 256  # Recent questions compared per project
+    ANSWER_CACHE_SIMILARITY_PROJECTS: int = 256  # Projects whose question vectors are kept, least recently used dropped
+
+    # Vector index (pgvector HNSW)
+    VECTOR_INDEX_M: int = 16
+    VECTOR_INDEX_EF_CONSTRUCTION: int = 64
+    VECTOR_EF_SEARCH: int = 40  # Per-query candidate list size, recall vs latency
+    VECTOR_ITERATIVE_SCAN: str = ""  # "relaxed_order"/"strict_order" on pgvector >= 0.8
+    VECTOR_PROJECT_INDEX_MIN_ROWS: int = 50000  # Projects this large get a partial index
+    VECTOR_QUANTIZATION: str = ""  # HNSW over "halfvec" or "bit" (binary_quantize) codes, "" = full precision
+    VECTOR_RERANK_CANDIDATES: int = 40  # Quantized candidates reranked by full-precision distance
+
+    # In-process vector index (memory-mapped exports of hot projects)
+    VECTOR_LOCAL_INDEX: bool = False
+    VECTOR_LOCAL_DIR: str = ""  # "" = <tmp>/speccraft-vectors
+    VECTOR_LOCAL_DTYPE: str = "float32"  # "float16" halves memory at a small precision cost
+    VECTOR_LOCAL_MEMORY_BYTES: int = 2 * 1024 ** 3  # Loaded indexes beyond this are evicted, least recently used first
+    VECTOR_LOCAL_HOT_QUERIES: int = 20  # Searches in this process before a project's index is exported
+
+    # Retrieval
+    RETRIEVAL_HYBRID: bool = True  # Fuse full-text and vector candidates
+    RETRIEVAL_CANDIDATES: int = 20  # Candidates per retriever before fusion
+    RETRIEVAL_RRF_K: int = 60  # Reciprocal rank fusion damping, higher flattens rank differences
+    RETRIEVAL_SYMBOL_FAST_PATH: bool = True  # Questions naming a defined symbol skip vector search
+
+    # Prompt context assembly
+    CONTEXT_CANDIDATES: int = 20  # Chunks retrieved before dedup, MMR and packing
+    CONTEXT_TOKEN_BUDGET: int = 1200  # Prompt tokens spent on code, sized for TinyLlama's 2048 window
+    CONTEXT_MMR_LAMBDA: float = 0.7  # Relevance vs diversity, 1 = retrieval order only
+    CONTEXT_MAX_OVERLAP: float = 0.5  # Chunks with more of their lines already in the context are dropped
+    CONTEXT_TOKEN_CACHE_SIZE: int = 50000  # Per-chunk token counts kept in memory
+
     class Config:
         case_sensitive = True
         env_file = ".env"
@@ -0,0 +1,133 @@
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+import json
+import struct
+import uuid
+import numpy as np
+from backend.core.config import settings
+
+# Postgres binary COPY framing: signature, flags, header extension length
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+
+def encode_uuid(value: uuid.UUID) -> bytes:
+    return value.bytes
+
+def encode_text(value: str) -> bytes:
+    return value.encode("utf-8")
+
+def encode_int(value: int) -> bytes:
+    return struct.pack("!i", value)
+
+def encode_bytes(value: bytes) -> bytes:
+    # bytea's binary format is the raw bytes
+    return bytes(value)
+
+def encode_json(value: Any) -> bytes:
+    # `json` (unlike `jsonb`) is sent as plain text in binary COPY
+    return json.dumps(value).encode("utf-8")
+
+def encode_vector(value) -> bytes:
+    # pgvector's vector_recv: int16 dim, int16 unused, then big-endian float4s
+    arr = np.asarray(value, dtype=">f4")
+    return struct.pack("!hh", arr.shape[0], 0) + arr.tobytes()
+
+Columns = Sequence[Tuple[str, Callable[[Any], bytes]]]
+
+def encode_rows(columns: Columns, rows: List[tuple]) -> bytes:
+    """
+    Encodes rows as a complete binary COPY payload.
+    """
+    parts = [PGCOPY_HEADER]
+    field_count = struct.pack("!h", len(columns))
+    for row in rows:
+        parts.append(field_count)
+        for (_, encode), value in zip(columns, row):
+            if value is None:
+                parts.append(struct.pack("!i", -1))
+            else:
+                data = encode(value)
+                parts.append(struct.pack("!i", len(data)))
+                parts.append(data)
+    parts.append(PGCOPY_TRAILER)
+    return b"".join(parts)
+
+class BulkWriter:
+    """
+    Buffers Document and Embedding rows and streams them into Postgres with
+    binary COPY on the session's own connection, so rows land inside the
+    session's current transaction. IDs are generated client-side, which
+    removes the per-document flush the ORM needs to learn the primary key.
+    """
+    DOCUMENT_COLUMNS: Columns = [
+        ("id", encode_uuid),
+        ("project_id", encode_uuid),
+        ("type", encode_text),
+        ("path", encode_text),
+        ("content_hash", encode_text),
+        ("metadata", encode_json),
+        ("generation", encode_int),
+    ]
+    EMBEDDING_COLUMNS: Columns = [
+        ("id", encode_uuid),
+        ("project_id", encode_uuid),
+        ("document_id", encode_uuid),
+        ("vector", encode_vector),
+        ("chunk_metadata", encode_json),
+        ("generation", encode_int),
+        ("symbol", encode_text),
+        ("lexemes", encode_text),
+        ("content", encode_bytes),
+    ]
+
+    def __init__(self, session, batch_size: Optional[int] = None):
+        self.session = session
+        self.batch_size = batch_size or settings.INGEST_WRITE_BATCH_ROWS
+        self.documents: List[tuple] = []
+        self.embeddings: List[tuple] = []
+
+    @property
+    def pending_rows(self) -> int:
+        return len(self.documents) + len(self.embeddings)
+
+    def add_document(self, project_id, path: str, content_hash: Optional[str] = None, metadata: Optional[dict] = None, type: str = "code", generation: int = 0) -> uuid.UUID:
+        doc_id = uuid.uuid4()
+        self.documents.append((doc_id, uuid.UUID(str(project_id)), type, path, content_hash, metadata, generation))
+        return doc_id
+
+    def add_embedding(
+        self, project_id, document_id: uuid.UUID, vector, chunk_metadata: dict,
+        generation: int = 0, symbol: Optional[str] = None, lexemes: Optional[str] = None,
+        content: Optional[bytes] = None,
+    ) -> uuid.UUID:
+        emb_id = uuid.uuid4()
+        self.embeddings.append((
+            emb_id, uuid.UUID(str(project_id)), document_id, vector, chunk_metadata, generation, symbol, lexemes, content,
+        ))
+        return emb_id
+
+    async def maybe_flush(self):
+        if self.pending_rows >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """
+        COPYs everything buffered so far. Documents go first so the embeddings'
+        foreign keys resolve. Does not commit.
+        """
+        if self.documents:
+            await self._copy("documents", self.DOCUMENT_COLUMNS, self.documents)
+            self.documents = []
+        if self.embeddings:
+            await self._copy("embeddings", self.EMBEDDING_COLUMNS, self.embeddings)
+            self.embeddings = []
+
+    async def _copy(self, table: str, columns: Columns, rows: List[tuple]):
+        conn = await self.session.connection()
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_to_table(
+            table,
+            # Not bytes: asyncpg tries os.fspath() first and would take those for a file path
+            source=memoryview(encode_rows(columns, rows)),
+            columns=[name for name, _ in columns],
+            format="binary",
+        )
@@ -1,15 +1,59 @@
 from backend.db.base import Base
-from backend.db.session import engine
+from backend.db import session as db_session
 from sqlalchemy import text
 from backend.models.models import User, Project
 from backend.models.document import Document
-from backend.models.analytics import Embedding, Query
+from backend.models.analytics import SEARCH_VECTOR_SQL, Embedding, EmbeddingCacheEntry, Query
+from backend.models.ingestion import IngestionJob
+from backend.core.config import settings
+from backend.rag.vector_index import GLOBAL_INDEX_NAME, hnsw_index_ddl, index_name
+
+# create_all() only creates missing tables. Columns/indexes added to existing
+# tables are applied here as idempotent DDL, in order.
+MIGRATIONS = [
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS project_id UUID REFERENCES projects(id)",
+    """UPDATE embeddings SET project_id = documents.project_id
+       FROM documents
+       WHERE embeddings.document_id = documents.id AND embeddings.project_id IS NULL""",
+    "CREATE INDEX IF NOT EXISTS ix_embeddings_project_id ON embeddings (project_id)",
+    # Built over the VECTOR_QUANTIZATION form. Switching it leaves the previous index to be dropped by hand
+    hnsw_index_ddl(index_name(GLOBAL_INDEX_NAME, settings.VECTOR_QUANTIZATION), quantization=settings.VECTOR_QUANTIZATION),
+    "ALTER TABLE projects ADD COLUMN IF NOT EXISTS index_version INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS files_skipped JSON",
+    "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS commit_sha VARCHAR(40)",
+    "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS checkpoint_at TIMESTAMPTZ",
+    "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS attempts INTEGER DEFAULT 0",
+    # Blue/green index generations. Existing rows are generation 0, which every project starts with active
+    "ALTER TABLE projects ADD COLUMN IF NOT EXISTS active_generation INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE projects ADD COLUMN IF NOT EXISTS latest_generation INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS generation INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS retired_generation INTEGER",
+    "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS generation INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS generation INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_embeddings_document_id ON embeddings (document_id)",
+    # Only retired rows, which garbage collection looks for
+    """CREATE INDEX IF NOT EXISTS ix_documents_retired ON documents (project_id, retired_generation)
+       WHERE retired_generation IS NOT NULL""",
+    # Lexical retrieval. Rows stored before get no terms until their project is re-ingested
+    "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS symbol VARCHAR",
+    "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS lexemes TEXT",
+    f"ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS ({SEARCH_VECTOR_SQL}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_embeddings_symbol ON embeddings (project_id, symbol)",
+    "CREATE INDEX IF NOT EXISTS ix_embeddings_search_vector ON embeddings USING gin (search_vector)",
+    # Chunk text out of chunk_metadata. Rows stored before keep it there, read as a fallback until re-ingested
+    "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS content BYTEA",
+]
 
 async def init_db():
-    async with engine.begin() as conn:
+    # The engine is created lazily on first get_db() call
+    await db_session.get_db()
+    async with db_session.engine.begin() as conn:
         # await conn.run_sync(Base.metadata.drop_all)
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         await conn.run_sync(Base.metadata.create_all)
+        for statement in MIGRATIONS:
+            await conn.execute(text(statement))
 
 if __name__ == "__main__":
     import asyncio
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from typing import Optional
+from backend.core.cache import LRUCache
+from backend.core.config import settings
+import numpy as np
+import hashlib
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+class AnswerCache:
+    """
+    Caches RAG answers per (project_id, index_version, normalized question).
+    The index version is bumped on every re-ingestion, so stale answers are
+    never served and need no explicit purge.
+
+    Exact hits are served from an in-process LRU, backed by Redis when
+    ANSWER_CACHE_REDIS is on so all API workers share entries. Near-duplicate
+    questions can hit too when ANSWER_CACHE_SIMILARITY > 0: the query
+    embedding is compared against recent cached questions for the same
+    project version (in-process only).
+    """
+    def __init__(self):
+        self.local = LRUCache(settings.ANSWER_CACHE_SIZE, settings.ANSWER_CACHE_TTL)
+        self.similarity_threshold = settings.ANSWER_CACHE_SIMILARITY
+        # project_id -> (version, OrderedDict[key -> unit query vector]), for
+        # the most recently answered projects only
+        self._vectors = LRUCache(settings.ANSWER_CACHE_SIMILARITY_PROJECTS)
+        self._redis = None
+        self.near_hits = 0
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        return re.sub(r"\s+", " ", question).strip().casefold()
+
+    def _key(self, project_id, version: int, question: str) -> str:
+        digest = hashlib.sha256(self.normalize(question).encode("utf-8")).hexdigest()
+        return f"answer:{project_id}:{version}:{digest}"
+
+    def _get_redis(self):
+        if self._redis is None and settings.ANSWER_CACHE_REDIS:
+            import redis.asyncio as redis
+            self._redis = redis.from_url(settings.REDIS_URL)
+        return self._redis
+
+    async def _lookup(self, key: str) -> Optional[dict]:
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry
+
+        client = self._get_redis()
+        if client is None:
+            return None
+        try:
+            raw = await client.get(key)
+        except Exception as e:
+            logger.warning(f"Answer cache Redis read failed: {e}")
+            return None
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        self.local.set(key, entry)
+        return entry
+
+    async def get(self, project_id, version: int, question: str, query_vector=None) -> Optional[dict]:
+        """
+        Returns {"answer": ..., "citations": [...]} or None.
+        """
+        entry = await self._lookup(self._key(project_id, version, question))
+        if entry is not None or not self.similarity_threshold or query_vector is None:
+            return entry
+
+        scope = self._vectors.get(str(project_id))
+        if scope is None or scope[0] != version or not scope[1]:
+            return None
+        vectors = scope[1]
+        keys = list(vectors.keys())
+        matrix = np.stack(list(vectors.values()))
+        scores = matrix @ self._unit(query_vector)
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+
+        entry = await self._lookup(keys[best])
+        if entry is not None:
+            self.near_hits += 1
+        return entry
+
+    async def set(self, project_id, version: int, question: str, answer: str, citations: list, query_vector=None):
+        key = self._key(project_id, version, question)
+        entry = {"answer": answer, "citations": citations}
+        self.local.set(key, entry)
+
+        if self.similarity_threshold and query_vector is not None:
+            scope = self._vectors.get(str(project_id))
+            if scope is None or scope[0] != version:
+                # A new version makes every older one for the project unreachable
+                scope = (version, OrderedDict())
+                self._vectors.set(str(project_id), scope)
+            vectors = scope[1]
+            vectors[key] = self._unit(query_vector)
+            vectors.move_to_end(key)
+            while len(vectors) > settings.ANSWER_CACHE_SIMILARITY_WINDOW:
+                vectors.popitem(last=False)
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                await client.set(key, json.dumps(entry), ex=settings.ANSWER_CACHE_TTL or None)
+            except Exception as e:
+                logger.warning(f"Answer cache Redis write failed: {e}")
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        arr = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(arr)
+        return arr / norm if norm else arr
+
+    def stats(self) -> dict:
+        return {**self.local.stats(), "near_hits": self.near_hits}
+
+answer_cache = AnswerCache()
@@ -0,0 +1,87 @@
+from typing import Callable, Dict, List, Optional, Sequence, Set
+from backend.core.cache import LRUCache
+from backend.core.config import settings
+from backend.inference.engine import inference_engine
+from backend.rag.lexical import text_terms
+
+# (tokenizer, chunk id) -> token count; chunk rows are immutable, new content gets a new id
+_token_counts = LRUCache(settings.CONTEXT_TOKEN_CACHE_SIZE)
+
+def chunk_tokens(chunk, text: str, count_tokens: Callable[[str], int], tokenizer: str) -> int:
+    key = (tokenizer, chunk.id)
+    tokens = _token_counts.get(key)
+    if tokens is None:
+        tokens = count_tokens(text)
+        _token_counts.set(key, tokens)
+    return tokens
+
+def drop_overlapping(chunks: Sequence, max_overlap: Optional[float] = None) -> List:
+    """
+    Keeps chunks in rank order, dropping any whose line span is mostly
+    (more than `max_overlap` of its lines) covered by better ranked chunks of
+    the same file, e.g. the overlapping windows of one long function.
+    """
+    max_overlap = settings.CONTEXT_MAX_OVERLAP if max_overlap is None else max_overlap
+    covered: Dict[object, Set[int]] = {}
+    kept = []
+    for chunk in chunks:
+        meta = chunk.chunk_metadata or {}
+        start, end = meta.get("start_line"), meta.get("end_line")
+        if start is None or end is None:
+            kept.append(chunk)
+            continue
+        lines = set(range(int(start), int(end) + 1))
+        seen = covered.setdefault(chunk.document_id, set())
+        if len(lines & seen) > max_overlap * len(lines):
+            continue
+        seen |= lines
+        kept.append(chunk)
+    return kept
+
+def mmr_order(chunks: Sequence, texts: Dict, mmr_lambda: Optional[float] = None) -> List:
+    """
+    Maximal marginal relevance: repeatedly takes the chunk with the best
+    lambda * relevance - (1 - lambda) * similarity to those already taken.
+    Relevance is the retrieval rank (fused rankings carry no comparable
+    score) and similarity the Jaccard overlap of identifier terms, which
+    needs no vectors.
+    """
+    mmr_lambda = settings.CONTEXT_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    n = len(chunks)
+    terms = [set(text_terms(texts.get(c.id, ""))) for c in chunks]
+    remaining = list(range(n))
+    order = []
+    while remaining:
+        def score(i):
+            similarity = max(
+                (len(terms[i] & terms[j]) / (len(terms[i] | terms[j]) or 1) for j in order),
+                default=0.0,
+            )
+            return mmr_lambda * (1.0 - i / n) - (1.0 - mmr_lambda) * similarity
+        best = max(remaining, key=score)
+        remaining.remove(best)
+        order.append(best)
+    return [chunks[i] for i in order]
+
+def pack_context(
+    chunks: Sequence, texts: Dict, budget: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None, tokenizer: Optional[str] = None,
+) -> List:
+    """
+    Chunks for the prompt (`texts` maps their ids to their text, see
+    rag.chunks): MMR ordered, then taken greedily while they fit in `budget`
+    tokens of the active model's tokenizer. A chunk too large for what is
+    left is skipped, not truncated, so smaller ones further down can still
+    use the space. drop_overlapping() runs before, it needs no text.
+    """
+    budget = settings.CONTEXT_TOKEN_BUDGET if budget is None else budget
+    if count_tokens is None:
+        count_tokens, tokenizer = inference_engine.count_tokens, inference_engine.tokenizer_name
+
+    packed, used = [], 0
+    for chunk in mmr_order(chunks, texts):
+        tokens = chunk_tokens(chunk, texts.get(chunk.id, ""), count_tokens, tokenizer)
+        if used + tokens <= budget:
+            packed.append(chunk)
+            used += tokens
+    return packed
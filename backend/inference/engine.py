@@ -1,6 +1,9 @@
 # Conditional imports - only load if needed
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
 import os
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +14,11 @@ class InferenceEngine:
         self.tokenizer = None
         self.use_gemini_fallback = False
         self.gemini_client = None
+        # Generation blocks for seconds; async callers run it here instead of on the event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("INFERENCE_WORKERS", "4")),
+            thread_name_prefix="inference"
+        )
         
         # Check if we should skip local model entirely (Cloud Run)
         if os.getenv("USE_GEMINI_ONLY", "false").lower() == "true":
@@ -133,4 +141,64 @@ class InferenceEngine:
             for new_text in streamer:
                 yield new_text
 
+    @property
+    def tokenizer_name(self) -> str:
+        """
+        Whose counts count_tokens() returns, so cached counts switch with it.
+        """
+        return self.model_id if self.tokenizer is not None else "approximate"
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Prompt tokens `text` costs: exact with the local model's tokenizer
+        once it is loaded, estimated otherwise (Gemini only counts over the
+        network, which would cost more than the prompt it saves).
+        """
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        from backend.ingestion.chunking import approximate_token_count
+        return approximate_token_count(text)
+
+    async def agenerate(self, prompt: str, max_tokens: int = 512):
+        """
+        Async counterpart of generate(); the event loop stays free while the model runs.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.generate, prompt, max_tokens)
+
+    async def agenerate_stream(self, prompt: str, max_tokens: int = 512):
+        """
+        Async iterator over generate_stream(). The blocking generator is
+        drained on the inference executor and tokens are handed back to the
+        event loop through an asyncio.Queue.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for token in self.generate_stream(prompt, max_tokens):
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Consumer went away (e.g. client disconnected): stop pulling tokens
+            stop.set()
+
 inference_engine = InferenceEngine()
@@ -1,18 +1,36 @@
+from backend.core.config import settings
 from backend.db.session import get_db
 from backend.models.analytics import Embedding, Query
-from backend.models.document import Document
+from backend.models.models import Project
+from backend.rag.chunks import citation, load_chunk_texts
 from backend.rag.embeddings import embedding_service
+from backend.rag.retrieval import retrieve
 from backend.inference.engine import inference_engine
+from backend.inference.answer_cache import answer_cache
+from backend.inference.context import drop_overlapping, pack_context
 from sqlalchemy import select
-from pgvector.sqlalchemy import Vector
+from typing import Tuple
 import logging
 import uuid as uuid_lib
 
 logger = logging.getLogger(__name__)
 
+async def get_index_state(session, pid: uuid_lib.UUID) -> Tuple[int, int]:
+    """
+    (index_version, active_generation) of the project, read together so the
+    cache key and the rows searched belong to the same flip.
+    """
+    row = (await session.execute(
+        select(Project.index_version, Project.active_generation).filter(Project.id == pid)
+    )).first()
+    return (row[0] or 0, row[1] or 0) if row else (0, 0)
+
+def is_cacheable(answer: str) -> bool:
+    return bool(answer and answer.strip()) and not answer.startswith("Error")
+
 async def rag_query(user_query: str, project_id: str):
     # 1. Embed Query
-    query_vector = embedding_service.embed_text(user_query)
+    query_vector = await embedding_service.aembed_query(user_query)
     
     # 2. Retrieve Documents - FILTER BY PROJECT_ID
     try:
@@ -22,17 +40,18 @@ async def rag_query(user_query: str, project_id: str):
     
     SessionLocal = await get_db()
     async with SessionLocal() as session:
-        # Join with Document to filter by project_id
-        stmt = select(Embedding).join(Document, Embedding.document_id == Document.id).filter(
-            Document.project_id == pid
-        ).order_by(
-            Embedding.vector.l2_distance(query_vector)
-        ).limit(5)
-        result = await session.execute(stmt)
-        embeddings = result.scalars().all()
+        version, generation = await get_index_state(session, pid)
+        cached = await answer_cache.get(pid, version, user_query, query_vector)
+        if cached is not None:
+            return cached
+        candidates = drop_overlapping(await retrieve(
+            session, pid, user_query, query_vector, limit=settings.CONTEXT_CANDIDATES, generation=generation
+        ))
+        texts = await load_chunk_texts(session, [c.id for c in candidates])
         
     # 3. Construct Context
-    context_text = "\n\n".join([e.chunk_metadata.get('content', '') for e in embeddings])
+    embeddings = pack_context(candidates, texts)
+    context_text = "\n\n".join([texts.get(e.id, '') for e in embeddings])
     
     # 4. Construct Prompt
     prompt = f"""
@@ -49,23 +68,25 @@ async def rag_query(user_query: str, project_id: str):
     
     # 5. Inference
     try:
-        # Note: In a real async api, offload this blocking call to threadpool or celery
-        response = inference_engine.generate(prompt)
+        response = await inference_engine.agenerate(prompt)
     except Exception as e:
         import traceback
         traceback.print_exc()
         logger.error(f"Inference failed: {e}")
         response = f"Error generating answer: {str(e)}"
         
+    citations = [citation(e) for e in embeddings]
+    if is_cacheable(response):
+        await answer_cache.set(pid, version, user_query, response, citations, query_vector)
     return {
         "answer": response,
-        "citations": [e.chunk_metadata for e in embeddings]
+        "citations": citations
     }
 
 async def rag_query_stream(user_query: str, project_id: str):
     import json
     # 1. Embed Query
-    query_vector = embedding_service.embed_text(user_query)
+    query_vector = await embedding_service.aembed_query(user_query)
     
     # 2. Retrieve Documents - FILTER BY PROJECT_ID
     try:
@@ -77,18 +98,26 @@ async def rag_query_stream(user_query: str, project_id: str):
     
     SessionLocal = await get_db()
     async with SessionLocal() as session:
-        # Join with Document to filter by project_id
-        stmt = select(Embedding).join(Document, Embedding.document_id == Document.id).filter(
-            Document.project_id == pid
-        ).order_by(
-            Embedding.vector.l2_distance(query_vector)
-        ).limit(5)
-        result = await session.execute(stmt)
-        embeddings = result.scalars().all()
+        version, generation = await get_index_state(session, pid)
+        cached = await answer_cache.get(pid, version, user_query, query_vector)
+        if cached is None:
+            candidates = drop_overlapping(await retrieve(
+                session, pid, user_query, query_vector, limit=settings.CONTEXT_CANDIDATES, generation=generation
+            ))
+            texts = await load_chunk_texts(session, [c.id for c in candidates])
+
+    if cached is not None:
+        # Replay the cached answer as the same event sequence a live answer produces
+        yield f"data: {json.dumps({'type': 'citations', 'data': cached['citations']})}\n\n"
+        yield f"data: {json.dumps({'type': 'token', 'data': cached['answer']})}\n\n"
+        yield "data: [DONE]\n\n"
+        return
         
     # 3. Construct Context
-    context_text = "\n\n".join([e.chunk_metadata.get('content', '') for e in embeddings])
-    citations = [e.chunk_metadata for e in embeddings]
+    embeddings = pack_context(candidates, texts)
+    context_text = "\n\n".join([texts.get(e.id, '') for e in embeddings])
+    # Pointers only, the client fetches a snippet's text when it's opened
+    citations = [citation(e) for e in embeddings]
     
     # Event 1: Citations
     yield f"data: {json.dumps({'type': 'citations', 'data': citations})}\n\n"
@@ -107,12 +136,18 @@ async def rag_query_stream(user_query: str, project_id: str):
     """
     
     # 5. Inference Stream
+    tokens = []
     try:
-        # Blocking call in thread logic is inside engine, so we can iterate
-        for token in inference_engine.generate_stream(prompt):
+        # Generation runs on the engine's executor, tokens arrive via an asyncio queue
+        async for token in inference_engine.agenerate_stream(prompt):
+            tokens.append(token)
             yield f"data: {json.dumps({'type': 'token', 'data': token})}\n\n"
     except Exception as e:
         logger.error(f"Stream error: {e}")
         yield f"data: {json.dumps({'type': 'error', 'data': str(e)})}\n\n"
+    else:
+        answer = "".join(tokens)
+        if is_cacheable(answer):
+            await answer_cache.set(pid, version, user_query, answer, citations, query_vector)
         
     yield "data: [DONE]\n\n"
@@ -0,0 +1,177 @@
+from typing import List, Optional, Tuple
+from backend.core.config import settings
+import bisect
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_TOKENS = 256  # all-MiniLM-L6-v2's max_seq_length
+SPECIAL_TOKENS = 2  # [CLS] and [SEP] come out of every window's budget
+
+# Stand-in for the real tokenizer when it can't be loaded (offline workers):
+# words and single punctuation marks, which tracks WordPiece counts on code closely
+_APPROX_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+def approximate_token_count(text: str) -> int:
+    return sum(1 for _ in _APPROX_TOKEN.finditer(text))
+
+def _cached_file(model_name: str, filename: str) -> Optional[str]:
+    # Local Hugging Face cache only: a Hub lookup without network retries for
+    # ~20s, once per process, and parse pools spawn many processes
+    try:
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(model_name, filename, local_files_only=True)
+    except Exception:
+        return None
+
+class TokenCounter:
+    """
+    Counts tokens with the embedding model's own tokenizer (the `tokenizers`
+    runtime only, so parse workers don't load the model), falling back to a
+    regex approximation when it isn't available. The window size is the
+    model's max_seq_length unless CHUNK_MAX_TOKENS overrides it.
+
+    Nothing is fetched from the Hub: the tokenizer and max_seq_length come
+    from the caller (see init_token_counter) or the local model cache.
+    """
+    def __init__(self, model_name: str, tokenizer=None, max_seq_length: Optional[int] = None, resolved: bool = False):
+        self.model_name = model_name
+        self._tokenizer = tokenizer
+        # resolved: `tokenizer` is final, None means approximate
+        self._loaded = resolved or tokenizer is not None
+        self._max_seq_length = max_seq_length
+        self._max_tokens = None
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        path = _cached_file(self.model_name, "tokenizer.json")
+        try:
+            from tokenizers import Tokenizer
+            self._tokenizer = Tokenizer.from_file(path)
+            self._tokenizer.no_truncation()
+        except Exception as e:
+            logger.warning(f"Tokenizer for {self.model_name} unavailable ({e if path else 'not cached'}), approximating token counts")
+
+    @property
+    def max_tokens(self) -> int:
+        if self._max_tokens is None:
+            limit = settings.CHUNK_MAX_TOKENS or self.max_seq_length
+            self._max_tokens = max(limit - SPECIAL_TOKENS, 16)
+        return self._max_tokens
+
+    @property
+    def max_seq_length(self) -> int:
+        if self._max_seq_length is None:
+            self._max_seq_length = DEFAULT_MAX_TOKENS
+            path = _cached_file(self.model_name, "sentence_bert_config.json")
+            if path:
+                try:
+                    with open(path) as f:
+                        self._max_seq_length = int(json.load(f)["max_seq_length"])
+                except Exception:
+                    pass
+        return self._max_seq_length
+
+    def spec(self) -> Tuple[Optional[str], int]:
+        """
+        (tokenizer JSON or None, max_seq_length): what init_token_counter()
+        needs to count identically in another process.
+        """
+        self._load()
+        return (self._tokenizer.to_str() if self._tokenizer is not None else None, self.max_seq_length)
+
+    def offsets(self, text: str) -> List[Tuple[int, int]]:
+        """
+        (start, end) character offsets of every token in `text`.
+        """
+        self._load()
+        if self._tokenizer is not None:
+            return [o for o in self._tokenizer.encode(text, add_special_tokens=False).offsets if o[1] > o[0]]
+        return [m.span() for m in _APPROX_TOKEN.finditer(text)]
+
+    def count(self, text: str) -> int:
+        return len(self.offsets(text))
+
+_counter: Optional[TokenCounter] = None
+
+def get_token_counter() -> TokenCounter:
+    global _counter
+    if _counter is None:
+        _counter = TokenCounter(settings.EMBED_MODEL)
+    return _counter
+
+def init_token_counter(tokenizer_json: Optional[str], max_seq_length: int):
+    """
+    Installs the counter resolved by the ingesting process (TokenCounter.spec).
+    Also the parse pool's worker initializer, so workers never look anything up.
+    """
+    global _counter
+    tokenizer = None
+    if tokenizer_json is not None:
+        try:
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_str(tokenizer_json)
+            tokenizer.no_truncation()
+        except Exception as e:
+            logger.warning(f"Tokenizer for {settings.EMBED_MODEL} unusable ({e}), approximating token counts")
+    _counter = TokenCounter(settings.EMBED_MODEL, tokenizer, max_seq_length, resolved=True)
+
+def split_text(text: str, start_line: int = 0, max_tokens: Optional[int] = None, overlap: Optional[int] = None) -> List[Tuple[str, int, int]]:
+    """
+    Splits `text` (whose first line is `start_line`, 0-based) into windows of
+    at most `max_tokens` tokens that overlap by about `overlap` tokens.
+    Windows end on line boundaries whenever a line fits, so every window
+    keeps exact (start_line, end_line) spans for citations; only a single
+    line longer than a window is cut mid-line.
+
+    Returns [(content, start_line, end_line)], a single entry if it fits.
+    """
+    counter = get_token_counter()
+    max_tokens = max_tokens or counter.max_tokens
+    overlap = settings.CHUNK_OVERLAP_TOKENS if overlap is None else overlap
+    overlap = min(overlap, max_tokens // 2)
+
+    offsets = counter.offsets(text)
+    if len(offsets) <= max_tokens:
+        return [(text, start_line, start_line + text.count("\n", 0, len(text.rstrip("\n"))))]
+
+    line_starts = [0] + [m.end() for m in re.finditer("\n", text)]
+    token_lines = [bisect.bisect_right(line_starts, start) - 1 for start, _ in offsets]
+    windows = []
+    first = 0
+    while first < len(offsets):
+        last = min(first + max_tokens, len(offsets))
+        if last < len(offsets):
+            # Pull the cut back to the last line boundary inside the window
+            boundary = last
+            while boundary > first and token_lines[boundary] == token_lines[boundary - 1]:
+                boundary -= 1
+            if boundary > first:
+                last = boundary
+
+        begin_char = offsets[first][0]
+        if first == 0 or token_lines[first] != token_lines[first - 1]:
+            begin_char = line_starts[token_lines[first]]
+        end_char = offsets[last - 1][1]
+        if last == len(offsets) or token_lines[last] != token_lines[last - 1]:
+            line = token_lines[last - 1]
+            end_char = line_starts[line + 1] if line + 1 < len(line_starts) else len(text)
+        windows.append((
+            text[begin_char:end_char],
+            start_line + token_lines[first],
+            start_line + token_lines[last - 1],
+        ))
+        if last == len(offsets):
+            break
+
+        # Step back by the overlap, snapped forward to a line start when possible
+        next_first = max(last - overlap, first + 1)
+        snapped = next_first
+        while snapped < last and snapped > 0 and token_lines[snapped] == token_lines[snapped - 1]:
+            snapped += 1
+        first = snapped if snapped < last else next_first
+    return windows
@@ -0,0 +1,204 @@
+from typing import Dict, List, Optional, Tuple
+from backend.core.config import settings
+import fnmatch
+import os
+import re
+
+# Directories that hold third-party code, matched on any path component
+VENDORED_DIRS = {
+    "node_modules", "bower_components", "jspm_packages", "vendor", "third_party",
+    "third-party", "thirdparty", "site-packages", "venv", ".venv",
+    "Pods", "Carthage",
+}
+
+MINIFIED_NAMES = ["*.min.js", "*.min.mjs", "*.min.css", "*-min.js", "*.bundle.js", "*.chunk.js"]
+
+GENERATED_NAMES = [
+    "*.pb.go", "*.pb.gw.go", "*_pb2.py", "*_pb2_grpc.py", "*_pb2.pyi", "*.pb.cc", "*.pb.h",
+    "*_generated.go", "*.generated.*", "*.g.dart", "*.designer.cs",
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "Cargo.lock", "poetry.lock",
+    "Pipfile.lock", "composer.lock", "Gemfile.lock", "go.sum",
+]
+
+# Marker comments near the top of generated sources (Go, protoc, .NET, Facebook tooling)
+GENERATED_MARKER = re.compile(
+    rb"code generated .* do not edit|@generated|<auto-generated|generated by the protocol buffer compiler",
+    re.IGNORECASE,
+)
+
+SNIFF_BYTES = 8000  # Same window git uses to decide a blob is binary
+MINIFIED_AVG_LINE = 300  # Average bytes per line above which source is considered minified
+
+class SkipFile(Exception):
+    """
+    Raised by parse workers for files whose content shows they should not be
+    indexed. `reason` is one of the skip-count keys.
+    """
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+def _translate(pattern: str) -> str:
+    """
+    gitignore glob -> regex fragment, without anchoring.
+    """
+    i, n, out = 0, len(pattern), []
+    while i < n:
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                out.append(re.escape(pattern[i]))
+                i += 1
+                continue
+            body = pattern[i + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append(f"[{body}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(out)
+
+def parse_ignore_rules(text: str) -> List[Tuple[re.Pattern, bool, bool]]:
+    """
+    Compiles gitignore syntax into (regex, negated, directory_only) rules,
+    matched against paths relative to the ignore file's directory.
+    """
+    rules = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+        # A slash anywhere but the end anchors the pattern to the ignore file's directory
+        anchored = "/" in line
+        body = _translate(line.lstrip("/"))
+        regex = re.compile(("^" if anchored else "^(?:.*/)?") + body + "$")
+        rules.append((regex, negated, dir_only))
+    return rules
+
+class FileFilter:
+    """
+    Decides which repository files are worth indexing. Path rules run before
+    any content is read: dotfiles, .gitignore files at any depth plus the
+    project's INGEST_IGNORE_FILE (both gitignore syntax, applied even to
+    tracked files), INGEST_MAX_FILE_BYTES, and vendored/minified/generated
+    name heuristics. sniff() covers what only the content can tell.
+
+    Paths are repo-relative with "/" separators. Every skip is counted in
+    `skipped` by reason.
+    """
+    def __init__(self, skipped: Optional[Dict[str, int]] = None):
+        self.skipped = skipped if skipped is not None else {}
+        # base directory ("" = repo root) -> rules, applied root first
+        self._rules: Dict[str, list] = {}
+        self._dir_cache: Dict[str, bool] = {}
+
+    def add_ignore_file(self, base_dir: str, text: str):
+        rules = parse_ignore_rules(text)
+        if rules:
+            self._rules.setdefault(base_dir.strip("/"), []).extend(rules)
+            self._dir_cache.clear()
+
+    def _matches(self, rel_path: str, is_dir: bool) -> bool:
+        ignored = False
+        for base in sorted(self._rules, key=len):
+            if base and not rel_path.startswith(base + "/"):
+                continue
+            sub_path = rel_path[len(base) + 1:] if base else rel_path
+            for regex, negated, dir_only in self._rules[base]:
+                if dir_only and not is_dir:
+                    continue
+                if regex.match(sub_path):
+                    ignored = not negated
+        return ignored
+
+    def is_ignored(self, rel_path: str, is_dir: bool = False) -> bool:
+        # Like git, nothing under an ignored directory can be re-included
+        parts = rel_path.split("/")
+        for depth in range(1, len(parts)):
+            if self.is_dir_ignored("/".join(parts[:depth])):
+                return True
+        return self._matches(rel_path, is_dir)
+
+    def is_dir_ignored(self, rel_dir: str) -> bool:
+        if rel_dir not in self._dir_cache:
+            self._dir_cache[rel_dir] = self._matches(rel_dir, True)
+        return self._dir_cache[rel_dir]
+
+    def dir_reason(self, rel_dir: str) -> Optional[str]:
+        """
+        Reason to prune a whole directory, so walks never descend into it.
+        """
+        if settings.INGEST_SKIP_VENDORED and os.path.basename(rel_dir) in VENDORED_DIRS:
+            return "vendored"
+        if self.is_dir_ignored(rel_dir):
+            return "ignored"
+        return None
+
+    def path_reason(self, rel_path: str, size: Optional[int] = None) -> Optional[str]:
+        name = rel_path.rsplit("/", 1)[-1]
+        parts = rel_path.split("/")
+        if name.startswith("."):
+            return "hidden"
+        if settings.INGEST_SKIP_VENDORED and any(p in VENDORED_DIRS for p in parts[:-1]):
+            return "vendored"
+        if self.is_ignored(rel_path):
+            return "ignored"
+        if settings.INGEST_MAX_FILE_BYTES and size is not None and size > settings.INGEST_MAX_FILE_BYTES:
+            return "too_large"
+        if settings.INGEST_SKIP_GENERATED:
+            if any(fnmatch.fnmatchcase(name, p) for p in MINIFIED_NAMES):
+                return "minified"
+            if any(fnmatch.fnmatchcase(name, p) for p in GENERATED_NAMES):
+                return "generated"
+        return None
+
+    def accept(self, rel_path: str, size: Optional[int] = None) -> bool:
+        reason = self.path_reason(rel_path, size)
+        if reason:
+            self.count(reason)
+        return reason is None
+
+    def count(self, reason: str, n: int = 1):
+        self.skipped[reason] = self.skipped.get(reason, 0) + n
+
+def sniff(content: bytes) -> Optional[str]:
+    """
+    Content checks for files that passed the path rules: binary data (a NUL
+    byte early on), generated-code markers, and minified sources.
+    """
+    head = content[:SNIFF_BYTES]
+    if b"\0" in head:
+        return "binary"
+    if not settings.INGEST_SKIP_GENERATED:
+        return None
+    if GENERATED_MARKER.search(content[:1024]):
+        return "generated"
+    if len(content) > SNIFF_BYTES and len(content) / (content.count(b"\n") + 1) > MINIFIED_AVG_LINE:
+        return "minified"
+    return None
@@ -0,0 +1,435 @@
+from datetime import timedelta
+from typing import Callable, List, Optional
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.sql import func
+from backend.core.config import settings
+from backend.db.session import get_db
+from backend.models.ingestion import IngestionJob
+from backend.models.models import Project
+import asyncio
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"done", "failed"}
+# Never picked up again by claim_job: finished, or handed to Celery shard tasks
+UNRESUMABLE_STATUSES = TERMINAL_STATUSES | {"sharded"}
+
+# Pipeline counters -> IngestionJob columns
+PROGRESS_COLUMNS = {
+    "files": "files_total",
+    "scanned": "files_parsed",
+    "parsed": "files_written",
+    "unchanged": "files_unchanged",
+    "errors": "files_failed",
+    "embedded": "chunks_embedded",
+    "chunks": "chunks_written",
+}
+
+# In-process runner: strong refs so running jobs aren't garbage collected
+_running_jobs = set()
+
+def job_to_dict(job: IngestionJob) -> dict:
+    return {
+        "id": str(job.id),
+        "project_id": str(job.project_id),
+        "status": job.status,
+        "incremental": job.incremental,
+        **{column: getattr(job, column) or 0 for column in PROGRESS_COLUMNS.values()},
+        "files_skipped": job.files_skipped or {},
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+async def get_latest_job(session, project_id: uuid.UUID) -> Optional[IngestionJob]:
+    result = await session.execute(
+        select(IngestionJob)
+        .filter(IngestionJob.project_id == project_id)
+        .order_by(IngestionJob.created_at.desc())
+        .limit(1)
+    )
+    return result.scalars().first()
+
+async def get_last_ingested_commit(session, project_id: uuid.UUID) -> Optional[str]:
+    """
+    Commit of the project's latest successful ingestion, what its index reflects.
+    """
+    return await session.scalar(
+        select(IngestionJob.commit_sha)
+        .filter(IngestionJob.project_id == project_id, IngestionJob.status == "done", IngestionJob.commit_sha.isnot(None))
+        .order_by(IngestionJob.finished_at.desc())
+        .limit(1)
+    )
+
+async def create_job(session, project_id: uuid.UUID, incremental: bool = False) -> IngestionJob:
+    """
+    Queues an ingestion job for the project, or returns the one already in
+    flight so two runs never write the same project concurrently.
+    """
+    latest = await get_latest_job(session, project_id)
+    if latest and latest.status not in TERMINAL_STATUSES:
+        return latest
+
+    job = IngestionJob(id=uuid.uuid4(), project_id=project_id, status="queued", incremental=incremental)
+    session.add(job)
+    await session.commit()
+    await session.refresh(job)
+    return job
+
+async def update_job(job_id, **values):
+    SessionLocal = await get_db()
+    async with SessionLocal() as session:
+        await session.execute(
+            update(IngestionJob).where(IngestionJob.id == uuid.UUID(str(job_id))).values(**values)
+        )
+        await session.commit()
+
+def _progress_values(stats: dict) -> dict:
+    values = {column: stats.get(key, 0) for key, column in PROGRESS_COLUMNS.items()}
+    values["files_skipped"] = dict(stats.get("skipped", {}))
+    return values
+
+def merge_skipped(*counts: Optional[dict]) -> dict:
+    merged = {}
+    for skipped in counts:
+        for reason, n in (skipped or {}).items():
+            merged[reason] = merged.get(reason, 0) + n
+    return merged
+
+async def add_job_progress(job_id, stats: dict):
+    """
+    Adds a shard's counters to the job row atomically (shards finish concurrently).
+    """
+    await update_job(job_id, **{
+        column: getattr(IngestionJob, column) + stats.get(key, 0)
+        for key, column in PROGRESS_COLUMNS.items()
+        if key != "files"
+    })
+
+async def _report_progress(job_id, stats: dict, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=settings.INGEST_PROGRESS_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        if stop.is_set():
+            return
+        try:
+            await update_job(job_id, status=stats.get("stage", "parsing"), **_progress_values(stats))
+        except Exception as e:
+            # Progress is best effort, it must never fail the ingestion itself
+            logger.warning(f"Progress update for job {job_id} failed: {e}")
+
+async def get_job_generation(job_id) -> Optional[int]:
+    SessionLocal = await get_db()
+    async with SessionLocal() as session:
+        return await session.scalar(
+            select(IngestionJob.generation).where(IngestionJob.id == uuid.UUID(str(job_id)))
+        )
+
+def _stale_before():
+    return func.now() - timedelta(seconds=settings.INGEST_STALE_AFTER)
+
+async def claim_job(job_id) -> bool:
+    """
+    Takes the lease on a job before running it: queued jobs, and unfinished
+    ones whose heartbeat (updated_at, bumped by every progress write) is older
+    than INGEST_STALE_AFTER because their runner died. Returns False when
+    another runner holds the job or it has already finished, so a redelivered
+    Celery task or a second resume attempt backs off.
+    """
+    SessionLocal = await get_db()
+    async with SessionLocal() as session:
+        result = await session.execute(
+            update(IngestionJob)
+            .where(IngestionJob.id == uuid.UUID(str(job_id)))
+            .where(or_(
+                IngestionJob.status == "queued",
+                and_(IngestionJob.status.notin_(UNRESUMABLE_STATUSES), IngestionJob.updated_at < _stale_before()),
+            ))
+            .values(status="cloning", attempts=func.coalesce(IngestionJob.attempts, 0) + 1)
+            .returning(IngestionJob.id)
+        )
+        claimed = result.first() is not None
+        await session.commit()
+    return claimed
+
+def _checkpointer(job_id, stats: dict):
+    async def checkpoint(session):
+        # Same transaction as the batch's rows, so a checkpoint never covers rolled back work
+        await session.execute(
+            update(IngestionJob)
+            .where(IngestionJob.id == uuid.UUID(str(job_id)))
+            .values(checkpoint_at=func.now(), **_progress_values(stats))
+        )
+    return checkpoint
+
+async def run_ingestion_job(job_id, fan_out: Optional[Callable] = None) -> Optional[dict]:
+    """
+    Runs an ingestion job end to end: clone (or fetch, when incremental),
+    then the parse/embed/write pipeline. Status and counters are persisted
+    on the job row as it goes. Returns the pipeline stats, or None on failure
+    (or when the job is finished or running elsewhere, see claim_job).
+
+    Every batch the pipeline commits is a checkpoint. A job that was cut off
+    (crash, deploy, preempted worker) resumes at the commit and into the
+    index generation it recorded: files already stored are recognised by
+    content hash and skipped, so only the remainder is parsed and embedded
+    again. Until the job finishes, queries keep reading the previous
+    generation; a failed job's generation is abandoned.
+
+    With `fan_out` (Celery runner) and INGEST_SHARD_BYTES set, a full
+    ingestion of a large repo is split into byte-sized shards instead and
+    handed to fan_out(project_id, repo_url, commit, shards); the job is then
+    completed by finalize_sharded_job.
+    """
+    from backend.ingestion.repo_loader import repo_loader
+    from backend.ingestion.pipeline import ingestion_pipeline, shard_files
+
+    SessionLocal = await get_db()
+    async with SessionLocal() as session:
+        job = await session.get(IngestionJob, uuid.UUID(str(job_id)))
+        project = await session.get(Project, job.project_id) if job else None
+        base_commit = await get_last_ingested_commit(session, job.project_id) if job and job.incremental else None
+    if not job or not project:
+        logger.error(f"Ingestion job {job_id} or its project not found")
+        return None
+    if not await claim_job(job_id):
+        logger.info(f"Ingestion job {job_id} is finished or running elsewhere, skipping")
+        return None
+
+    project_id = str(project.id)
+    resume = bool(job.commit_sha)
+    print(f"[INGEST] {'Resuming' if resume else 'Starting'} ingestion for {project.repo_url} (Project: {project_id}, Job: {job_id})")
+
+    stats = ingestion_pipeline.new_stats()
+    stats["stage"] = "cloning"
+    generation = job.generation if resume else None
+    stop = asyncio.Event()
+    # Progress writes double as the job's heartbeat, see claim_job
+    reporter = asyncio.create_task(_report_progress(job_id, stats, stop))
+    try:
+        # 1. Clone (GitPython blocks, keep it off the event loop)
+        await update_job(job_id, status="cloning")
+        changes = None
+        if resume:
+            repo_path = await asyncio.to_thread(repo_loader.ensure_checkout, project.repo_url, project_id, job.commit_sha)
+        elif job.incremental:
+            repo_path, changes = await asyncio.to_thread(repo_loader.sync_repo, project.repo_url, project_id, base_commit)
+        else:
+            repo_path = await asyncio.to_thread(repo_loader.clone_repo, project.repo_url, project_id)
+        commit = job.commit_sha or await asyncio.to_thread(repo_loader.get_head_commit, repo_path)
+        if generation is None:
+            generation = await ingestion_pipeline.begin_generation(project_id)
+        if not resume or generation != job.generation:
+            await update_job(job_id, commit_sha=commit, generation=generation)
+        print(f"[INGEST] Cloned to {repo_path} at {commit}")
+
+        # 2. Walk, Parse, Embed and Store (staged pipeline)
+        blobs = None
+        if settings.INGEST_FROM_GIT_OBJECTS:
+            blobs = await asyncio.to_thread(repo_loader.list_blobs, repo_path, "HEAD", stats["skipped"])
+            files = list(blobs)
+        else:
+            files = await asyncio.to_thread(repo_loader.get_file_list, repo_path, stats["skipped"])
+        print(f"[INGEST] Found {len(files)} files (skipped: {stats['skipped'] or 'none'})")
+        stats["files"] = len(files)
+        stats["stage"] = "parsing"
+        await update_job(job_id, status="parsing", files_total=len(files), files_skipped=dict(stats["skipped"]))
+
+        if fan_out and not job.incremental and not resume and settings.INGEST_SHARD_BYTES:
+            shards = await asyncio.to_thread(shard_files, files, settings.INGEST_SHARD_BYTES, blobs)
+            if len(shards) > 1:
+                stats["stage"] = "sharded"
+                # Shard workers may have a different checkout root, ship repo-relative paths
+                fan_out(project_id, project.repo_url, commit, [
+                    [os.path.relpath(f, repo_path).replace(os.sep, "/") for f in shard]
+                    for shard in shards
+                ])
+                await update_job(job_id, status="sharded")
+                print(f"[INGEST] Fanned out {len(files)} files into {len(shards)} shards")
+                stats["shards"] = len(shards)
+                return stats
+
+        checkpoint = _checkpointer(job_id, stats)
+        if job.incremental:
+            # A resumed sync re-hashes everything: what the interrupted attempt stored is skipped
+            await ingestion_pipeline.sync(
+                files, project_id, None if resume else changes,
+                stats=stats, blobs=blobs, checkpoint=checkpoint, generation=generation,
+            )
+            if resume and not (stats["parsed"] or stats["removed"] or stats.get("deleted")):
+                # The interrupted attempt may have stored everything but not finalized
+                await ingestion_pipeline.finalize(project_id, generation)
+        else:
+            known_docs = await ingestion_pipeline.load_known_docs(project_id, generation=generation) if resume else None
+            await ingestion_pipeline.run(
+                files, project_id, known_docs,
+                stats=stats, blobs=blobs, checkpoint=checkpoint, generation=generation,
+            )
+    except Exception as e:
+        logger.exception(f"Ingestion job {job_id} failed")
+        stop.set()
+        await reporter
+        if generation is not None:
+            await _abandon_generation(project_id, generation)
+        await update_job(job_id, status="failed", error=str(e), finished_at=func.now(), **_progress_values(stats))
+        return None
+    finally:
+        stop.set()
+        await reporter
+
+    schedule_index_gc(project_id)
+    await update_job(job_id, status="done", finished_at=func.now(), **_progress_values(stats))
+    print(f"[INGEST] Completed. Parsed {stats['parsed']}/{stats['files']} files. Total chunks: {stats['chunks']}")
+    return stats
+
+async def _abandon_generation(project_id: str, generation: int):
+    from backend.ingestion.pipeline import ingestion_pipeline
+    try:
+        await ingestion_pipeline.abandon(project_id, generation)
+    except Exception as e:
+        # Leftover rows stay invisible, a later build of the project supersedes them
+        logger.warning(f"Abandoning index generation {generation} of project {project_id} failed: {e}")
+
+async def collect_index_garbage(project_id: str, delay: float = 0) -> int:
+    """
+    Deletes the rows a generation flip retired. The delay lets queries that
+    started against the previous generation finish first.
+    """
+    from backend.ingestion.pipeline import ingestion_pipeline
+    if delay:
+        await asyncio.sleep(delay)
+    try:
+        return await ingestion_pipeline.collect_garbage(project_id)
+    except Exception as e:
+        logger.warning(f"Index garbage collection for project {project_id} failed: {e}")
+        return 0
+
+def schedule_index_gc(project_id: str):
+    """
+    Runs collect_index_garbage INDEX_GC_DELAY seconds from now, on the
+    configured runner (see start_ingestion_job).
+    """
+    if settings.INGESTION_RUNNER == "celery":
+        from backend.worker.tasks import collect_index_garbage_task
+        collect_index_garbage_task.apply_async(args=[str(project_id)], countdown=settings.INDEX_GC_DELAY)
+        return
+
+    task = asyncio.get_running_loop().create_task(collect_index_garbage(project_id, settings.INDEX_GC_DELAY))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+
+async def resume_stale_jobs() -> int:
+    """
+    Restarts unfinished jobs whose runner stopped heartbeating (see
+    claim_job). With Celery only jobs a worker has claimed count: a queued
+    one may just be waiting in a backed-up broker, and sending it again
+    would only add to the backlog (its unacked message is redelivered if a
+    worker dies). In-process, a queued job lost with its process has no
+    broker to come back from and is resumed too. Sharded jobs are left to
+    Celery's own shard retries. Returns how many were handed to the runner.
+    """
+    skipped = UNRESUMABLE_STATUSES | {"queued"} if settings.INGESTION_RUNNER == "celery" else UNRESUMABLE_STATUSES
+    SessionLocal = await get_db()
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(IngestionJob.id).where(
+                IngestionJob.status.notin_(skipped),
+                IngestionJob.updated_at < _stale_before(),
+            )
+        )
+        job_ids = result.scalars().all()
+    for job_id in job_ids:
+        print(f"[INGEST] Resuming interrupted job {job_id}")
+        start_ingestion_job(job_id)
+    return len(job_ids)
+
+async def watch_stale_jobs():
+    """
+    Background loop for API processes: resumes interrupted jobs, including
+    ones that were running in this process before it restarted.
+    """
+    while True:
+        try:
+            await resume_stale_jobs()
+        except Exception as e:
+            logger.warning(f"Checking for interrupted ingestion jobs failed: {e}")
+        await asyncio.sleep(settings.INGEST_STALE_AFTER)
+
+async def run_ingestion_shard(job_id, project_id: str, repo_url: str, commit: str, rel_paths: List[str]) -> dict:
+    """
+    Parses, embeds and stores one shard of a fanned-out job. Files committed
+    by an earlier attempt of the same shard are recognised by content hash
+    and skipped, so a retried shard neither duplicates rows nor redoes work.
+    """
+    from backend.ingestion.repo_loader import repo_loader
+    from backend.ingestion.pipeline import ingestion_pipeline
+
+    generation = await get_job_generation(job_id)
+    repo_path = await asyncio.to_thread(repo_loader.ensure_checkout, repo_url, project_id, commit)
+    files = [os.path.join(repo_path, *p.split("/")) for p in rel_paths]
+    blobs = None
+    if settings.INGEST_FROM_GIT_OBJECTS:
+        # Already filtered by the coordinator, don't count its skips twice
+        blobs = await asyncio.to_thread(repo_loader.list_blobs, repo_path)
+    known_docs = await ingestion_pipeline.load_known_docs(project_id, files, generation)
+    stats = await ingestion_pipeline.run(files, project_id, known_docs, finalize=False, blobs=blobs, generation=generation)
+    await add_job_progress(job_id, stats)
+    return stats
+
+async def finalize_sharded_job(job_id, project_id: str, shard_stats: List[dict]) -> dict:
+    """
+    Runs once every shard has finished: index maintenance, the flip to the
+    job's generation and job completion.
+    """
+    from backend.ingestion.pipeline import ingestion_pipeline
+
+    totals = {}
+    for stats in shard_stats:
+        for key, value in stats.items():
+            if isinstance(value, int):
+                totals[key] = totals.get(key, 0) + value
+    # Content skips from the shards on top of the coordinator's path skips
+    SessionLocal = await get_db()
+    async with SessionLocal() as session:
+        job = await session.get(IngestionJob, uuid.UUID(str(job_id)))
+    totals["skipped"] = merge_skipped(job.files_skipped if job else None, *(s.get("skipped") for s in shard_stats))
+
+    if job is not None and job.generation is not None:
+        await ingestion_pipeline.finalize(project_id, job.generation, replace=True)
+        schedule_index_gc(project_id)
+    await update_job(job_id, status="done", finished_at=func.now(), files_skipped=totals["skipped"])
+    print(f"[INGEST] Completed {len(shard_stats)} shards. Parsed {totals.get('parsed', 0)} files. Total chunks: {totals.get('chunks', 0)}")
+    return totals
+
+async def fail_sharded_job(job_id, error: str):
+    """
+    A shard exhausted its retries: the job's generation never goes live.
+    """
+    SessionLocal = await get_db()
+    async with SessionLocal() as session:
+        job = await session.get(IngestionJob, uuid.UUID(str(job_id)))
+    if job is not None and job.generation is not None:
+        await _abandon_generation(str(job.project_id), job.generation)
+    await update_job(job_id, status="failed", error=error, finished_at=func.now())
+
+def start_ingestion_job(job_id):
+    """
+    Hands a queued job to the configured runner and returns immediately.
+    "celery" sends it to the worker fleet; "inprocess" runs it as a task on
+    this process's event loop (single-node deployments; on Cloud Run this
+    needs CPU always allocated, since the request has already returned).
+    """
+    if settings.INGESTION_RUNNER == "celery":
+        from backend.worker.tasks import ingest_repo_task
+        ingest_repo_task.delay(job_id=str(job_id))
+        return
+
+    task = asyncio.get_running_loop().create_task(run_ingestion_job(job_id))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
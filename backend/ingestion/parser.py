@@ -1,14 +1,30 @@
 import tree_sitter_languages
+from typing import List, NamedTuple, Optional
+from backend.ingestion.chunking import get_token_counter, split_text
+from backend.ingestion.filters import SkipFile, sniff
+import hashlib
 import os
+import re
+
+QUERIES_DIR = os.path.join(os.path.dirname(__file__), "queries")
+# Grammars that share another language's query file
+QUERY_FILES = {"tsx": "typescript"}
+
+class Definition(NamedTuple):
+    node: object
+    kind: str  # function, class or method (the @definition.<kind> capture)
+    name: str
+    members: list  # Definitions nested directly inside this one
 
 class CodeParser:
     def __init__(self):
         self.parsers = {}
+        self.queries = {}
         self.supported_extensions = {
             ".py": "python",
             ".js": "javascript",
             ".ts": "typescript",
-            ".tsx": "typescript",
+            ".tsx": "tsx",
             ".go": "go",
             ".rs": "rust",
             ".java": "java",
@@ -28,13 +44,46 @@ class CodeParser:
                 return None
         return self.parsers[language_name]
 
+    def get_query(self, language_name: str):
+        """
+        Compiled definitions query (queries/<language>.scm), built once per language.
+        """
+        if language_name not in self.queries:
+            try:
+                query_file = os.path.join(QUERIES_DIR, QUERY_FILES.get(language_name, language_name) + ".scm")
+                with open(query_file) as f:
+                    self.queries[language_name] = tree_sitter_languages.get_language(language_name).query(f.read())
+            except Exception as e:
+                print(f"Error loading query for {language_name}: {e}")
+                self.queries[language_name] = None
+        return self.queries[language_name]
+
+    def get_language(self, file_path: str):
+        ext = os.path.splitext(file_path)[1]
+        return self.supported_extensions.get(ext)
+
     def parse_file(self, file_path: str):
         """
         Parses a file and returns its AST (root node) and content.
         """
-        ext = os.path.splitext(file_path)[1]
-        language_name = self.supported_extensions.get(ext)
-        
+        if not self.get_language(file_path):
+            return None, None
+
+        try:
+            with open(file_path, "rb") as f:
+                content = f.read()
+        except Exception as e:
+            print(f"Failed to parse {file_path}: {e}")
+            return None, None
+
+        return self.parse_content(content, file_path)
+
+    def parse_content(self, content: bytes, file_path: str):
+        """
+        Parses already loaded bytes; `file_path` only selects the language.
+        Returns the AST (root node) and content.
+        """
+        language_name = self.get_language(file_path)
         if not language_name:
             return None, None
 
@@ -43,56 +92,89 @@ class CodeParser:
             return None, None
 
         try:
-            with open(file_path, "rb") as f:
-                content = f.read()
-            
             tree = parser.parse(content)
             return tree.root_node, content
         except Exception as e:
             print(f"Failed to parse {file_path}: {e}")
             return None, None
 
-    def extract_definitions(self, root_node, content: bytes):
+    def extract_definitions(self, root_node, content: bytes, language_name: str):
         """
-        Extracts top-level class and function definitions.
-        Simple heuristic: look for 'function_definition' or 'class_definition' nodes.
-        Note: Exact node types vary by language (e.g. 'function_item' in Rust).
+        Extracts the outermost function/class/method definitions with the
+        language's precompiled query, in one native pass. Definitions nested
+        in a class are kept as its members, so an oversized class can be
+        split at them.
         """
-        definitions = []
-        
-        cursor = root_node.walk()
-        
-        # This is a specialized simplified walker for demonstration
-        # In production, this needs language-specific queries.
-        
-        # Python example node types
-        node_types_of_interest = {
-            "function_definition", "class_definition", 
-            "method_definition", # JS/TS
-            "func_literal" # Go
-        }
+        query = self.get_query(language_name)
+        if query is None:
+            return []
+
+        found = {}
+        for _, captures in query.matches(root_node):
+            name_node = captures.get("name")
+            for capture, node in captures.items():
+                if not capture.startswith("definition.") or name_node is None:
+                    continue
+                if node.parent is not None and node.parent.type == "decorated_definition":
+                    continue  # Captured through its decorated wrapper instead
+                key = (node.start_byte, node.end_byte)
+                if key not in found:
+                    name = content[name_node.start_byte:name_node.end_byte].decode("utf-8", errors="ignore")
+                    found[key] = Definition(node, capture.split(".", 1)[1], name, [])
 
-        for child in root_node.children:
-            if child.type in node_types_of_interest:
-                self._add_definition(child, content, definitions)
-            elif child.type == "decorated_definition":
-                # Drill down to find the wrapped definition
-                definition_node = child.children[-1]
-                if definition_node.type in node_types_of_interest:
-                     self._add_definition(definition_node, content, definitions)
+        # Nest by byte range: sorted by start, enclosing definitions come first
+        outermost: List[Definition] = []
+        stack: List[Definition] = []
+        for key in sorted(found, key=lambda k: (k[0], -k[1])):
+            definition = found[key]
+            while stack and stack[-1].node.end_byte < key[1]:
+                stack.pop()
+            (stack[-1].members if stack else outermost).append(definition)
+            stack.append(definition)
 
+        definitions = []
+        for definition in outermost:
+            self._add_definition(definition, content, definitions)
         return definitions
 
+    def chunk_file(self, file_path: str):
+        """
+        Parses a file and returns its chunks, falling back to generic chunking
+        when no definitions are found. Returns [] for unsupported files.
+        """
+        root_node, content = self.parse_file(file_path)
+        if not root_node:
+            return []
+        return self.chunk_content(content, file_path, root_node)
+
+    def chunk_content(self, content: bytes, file_path: str, root_node=None):
+        """
+        Same as chunk_file for bytes that are already in memory.
+        """
+        if root_node is None:
+            root_node, content = self.parse_content(content, file_path)
+            if not root_node:
+                return []
+
+        chunks = self.extract_definitions(root_node, content, self.get_language(file_path))
+        if not chunks:
+            chunks = self.chunk_file_generic(content, file_path)
+        return chunks
+
     def chunk_file_generic(self, content: bytes, file_path: str):
         """
-        Fallback chunker that just returns the whole file as one chunk if parsing failed or yielded no definitions.
+        Fallback chunker that returns the whole file as one chunk if parsing failed or yielded no definitions,
+        or as overlapping token windows when it is longer than the embedding model can see.
         """
         try:
             text = content.decode("utf-8", errors="ignore")
             # Minimal constraint: ignore empty files
             if not text.strip():
                 return []
-            
+
+            windows = split_text(text)
+            if len(windows) > 1:
+                return self._window_chunks("file_content", os.path.basename(file_path), windows)
             return [{
                 "type": "file_content",
                 "name": os.path.basename(file_path),
@@ -103,25 +185,110 @@ class CodeParser:
         except:
             return []
 
-    def _add_definition(self, node, content, definitions):
-        start_byte = node.start_byte
-        end_byte = node.end_byte
-        code_snippet = content[start_byte:end_byte].decode("utf-8", errors="ignore")
+    def _add_definition(self, definition: Definition, content: bytes, definitions, name=None):
+        node = definition.node
+        code_snippet = content[node.start_byte:node.end_byte].decode("utf-8", errors="ignore")
+        name = name or definition.name
+        # Decorators are part of the chunk, the type is the wrapped definition's
+        node_type = node.children[-1].type if node.type == "decorated_definition" else node.type
+
+        counter = get_token_counter()
+        if counter.count(code_snippet) > counter.max_tokens:
+            # Too long to embed whole: split classes per member, anything else into windows
+            if definition.kind == "class" and definition.members:
+                self._add_class_parts(definition, node_type, content, definitions, name)
+            else:
+                windows = split_text(code_snippet, node.start_point[0])
+                definitions.extend(self._window_chunks(node_type, name, windows))
+            return
+
         definitions.append({
-            "type": node.type,
-            "name": self._get_name(node, content) or "anonymous",
+            "type": node_type,
+            "name": name,
             "content": code_snippet,
             "start_line": node.start_point[0],
             "end_line": node.end_point[0]
         })
 
-    def _get_name(self, node, content: bytes):
-        # Very naive name extraction
-        for child in node.children:
-            if child.type == "identifier" or child.type == "name":
-                 start = child.start_byte
-                 end = child.end_byte
-                 return content[start:end].decode("utf-8")
-        return None
+    def _add_class_parts(self, definition: Definition, node_type: str, content: bytes, definitions, class_name: str):
+        """
+        Emits each member as its own definition ("Class.method") and the code
+        between them (class header, docstring, attributes) as windows of the class.
+        """
+        node = definition.node
+        cursor = node.start_byte
+        for member in definition.members + [None]:
+            method = member.node if member else None
+            gap_end = method.start_byte if method else node.end_byte
+            gap = content[cursor:gap_end].decode("utf-8", errors="ignore")
+            # Skip gaps that are only punctuation, e.g. a closing brace
+            if re.search(r"\w", gap):
+                line = content.count(b"\n", 0, cursor)
+                # Drop the tail of the previous member's last line and blank lines
+                while "\n" in gap and not gap[:gap.index("\n")].strip():
+                    gap = gap[gap.index("\n") + 1:]
+                    line += 1
+                windows = split_text(gap.rstrip(), line)
+                definitions.extend(self._window_chunks(node_type, class_name, windows))
+            if member is None:
+                break
+
+            self._add_definition(member, content, definitions, name=f"{class_name}.{member.name}")
+            cursor = method.end_byte
+
+    @staticmethod
+    def _window_chunks(chunk_type: str, name: str, windows):
+        return [{
+            "type": chunk_type,
+            "name": name,
+            "content": text,
+            "start_line": start_line,
+            "end_line": end_line,
+            "part": part if len(windows) > 1 else None,
+        } for part, (text, start_line, end_line) in enumerate(windows)]
 
 code_parser = CodeParser()
+
+def chunk_file(file_path: str, known_hash: Optional[str] = None):
+    """
+    Process pool entry point. Bound methods can't be pickled once the
+    tree-sitter parsers are cached, so workers go through the module singleton.
+
+    Returns (file_path, content_hash, chunks). Unsupported files come back as
+    (file_path, None, []) without being read; files whose hash equals
+    `known_hash` come back with chunks=None and are not parsed. Raises
+    SkipFile when the content turns out to be binary, minified or generated.
+    """
+    if not code_parser.get_language(file_path):
+        return file_path, None, []
+
+    with open(file_path, "rb") as f:
+        content = f.read()
+
+    content_hash = hashlib.sha256(content).hexdigest()
+    if content_hash == known_hash:
+        return file_path, content_hash, None
+    reason = sniff(content)
+    if reason:
+        raise SkipFile(reason)
+    return file_path, content_hash, code_parser.chunk_content(content, file_path)
+
+def chunk_blob(file_path: str, repo_path: str, blob_sha: str, known_hash: Optional[str] = None):
+    """
+    chunk_file for a file that only exists in the git object database
+    (see RepoLoader.list_blobs). Same return value; unsupported files are
+    still skipped without reading the blob.
+    """
+    from backend.ingestion.repo_loader import read_blob
+
+    if not code_parser.get_language(file_path):
+        return file_path, None, []
+
+    content = read_blob(repo_path, blob_sha)
+    content_hash = hashlib.sha256(content).hexdigest()
+    if content_hash == known_hash:
+        return file_path, content_hash, None
+    reason = sniff(content)
+    if reason:
+        raise SkipFile(reason)
+    return file_path, content_hash, code_parser.chunk_content(content, file_path)
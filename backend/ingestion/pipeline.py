@@ -0,0 +1,520 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import uuid
+
+from sqlalchemy import delete, func, select, update
+
+from backend.core.config import settings
+from backend.db.bulk import BulkWriter
+from backend.db.session import get_db
+from backend.ingestion.chunking import get_token_counter, init_token_counter
+from backend.ingestion.filters import SkipFile
+from backend.ingestion.parser import chunk_blob, chunk_file
+from backend.models.analytics import Embedding
+from backend.models.document import Document
+from backend.models.models import Project
+from backend.rag.chunks import split_chunk
+from backend.rag.embeddings import embedding_service
+from backend.rag.lexical import chunk_lexemes, chunk_symbol
+from backend.rag.local_index import local_index_cache
+from backend.rag.vector_index import ensure_project_index
+
+logger = logging.getLogger(__name__)
+
+# Sentinel pushed through the queues once a stage has drained its input
+_DONE = object()
+
+# Pipeline stages in data order. Stages overlap, the reported one is the
+# furthest any item has reached.
+STAGES = ("parsing", "embedding", "writing")
+
+def _enter_stage(stats: dict, stage: str):
+    if STAGES.index(stage) > STAGES.index(stats.get("stage", "parsing")):
+        stats["stage"] = stage
+
+class IngestionPipeline:
+    """
+    Staged ingestion: a pool of parser processes feeds a batching embedder,
+    which feeds a single DB writer. Stages are connected by bounded queues so
+    memory stays flat no matter how large the repository is.
+
+    Every run builds a new index generation next to the live one (blue/green).
+    Rows are written with the run's generation and rows it replaces are only
+    marked retired by it, so queries, which read the project's
+    active_generation, never see a half-built index. finalize() flips the
+    pointer in one transaction and collect_garbage() deletes what the flip
+    retired.
+    """
+    def __init__(
+        self,
+        parse_workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        commit_every: Optional[int] = None,
+        embed_buffer: Optional[int] = None,
+        write_batch_rows: Optional[int] = None,
+    ):
+        self.parse_workers = parse_workers or settings.INGEST_PARSE_WORKERS or os.cpu_count() or 1
+        self.queue_size = queue_size or settings.INGEST_QUEUE_SIZE
+        self.commit_every = commit_every or settings.INGEST_COMMIT_EVERY
+        self.embed_buffer = embed_buffer or settings.INGEST_EMBED_BUFFER
+        self.write_batch_rows = write_batch_rows or settings.INGEST_WRITE_BATCH_ROWS
+
+    @staticmethod
+    def _token_counter_spec() -> Tuple[Optional[str], int]:
+        """
+        The chunking tokenizer, resolved once here rather than in every parse
+        worker: from the loaded embedding model when there is one, otherwise
+        from the local model cache (see TokenCounter).
+        """
+        model = embedding_service._model
+        tokenizer = getattr(getattr(model, "tokenizer", None), "backend_tokenizer", None)
+        if tokenizer is not None:
+            return tokenizer.to_str(), int(model.max_seq_length)
+        return get_token_counter().spec()
+
+    def _make_executor(self) -> Executor:
+        spec = self._token_counter_spec()
+        init_token_counter(*spec)
+        # Celery prefork children are daemonic and may not spawn processes of
+        # their own; fall back to threads there and scale via worker concurrency.
+        if multiprocessing.current_process().daemon:
+            logger.info("Daemonic process detected, parsing with threads")
+            return ThreadPoolExecutor(max_workers=self.parse_workers)
+        return ProcessPoolExecutor(
+            max_workers=self.parse_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_token_counter,
+            initargs=spec,
+        )
+
+    async def run(
+        self,
+        files: List[str],
+        project_id: str,
+        known_docs: Optional[Dict[str, Tuple[uuid.UUID, Optional[str]]]] = None,
+        stats: Optional[dict] = None,
+        finalize: bool = True,
+        blobs: Optional[dict] = None,
+        checkpoint: Optional[Callable[..., Awaitable]] = None,
+        generation: Optional[int] = None,
+    ) -> dict:
+        """
+        Full (re-)ingestion of `files` for `project_id` into `generation`
+        (a new one if not given), which replaces every older row on finalize.
+        `known_docs` maps paths to (document_id, content_hash) of rows already
+        stored: unchanged files are skipped, changed ones replace their row.
+        Counters are kept in `stats` (updated live, so callers can report
+        progress while the run is going) and returned.
+        finalize=False leaves index maintenance to the caller, for runs that
+        only cover one shard of the repository.
+        With `blobs` (a RepoLoader.list_blobs index) file content is read
+        from the git object database instead of the filesystem.
+        `checkpoint(session)` is awaited inside every batch transaction just
+        before it commits, so callers can record progress atomically with it.
+        """
+        if generation is None:
+            generation = await self.begin_generation(project_id)
+        stats = await self._run(files, project_id, known_docs, stats, blobs, checkpoint, generation)
+        if finalize:
+            await self.finalize(project_id, generation, replace=True)
+        return stats
+
+    async def _run(
+        self,
+        files: List[str],
+        project_id: str,
+        known_docs: Optional[Dict[str, Tuple[uuid.UUID, Optional[str]]]] = None,
+        stats: Optional[dict] = None,
+        blobs: Optional[dict] = None,
+        checkpoint: Optional[Callable[..., Awaitable]] = None,
+        generation: int = 0,
+    ) -> dict:
+        known_docs = known_docs or {}
+        stats = self.new_stats(stats)
+        stats["files"] = len(files)
+        stats["stage"] = "parsing"
+        parsed_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        embedded_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+
+        with self._make_executor() as executor:
+            tasks = [
+                asyncio.create_task(self._parse_stage(executor, files, known_docs, parsed_queue, stats, blobs)),
+                asyncio.create_task(self._embed_stage(parsed_queue, embedded_queue, stats)),
+                asyncio.create_task(self._write_stage(embedded_queue, project_id, known_docs, stats, checkpoint, generation)),
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # A dead stage would leave its neighbours blocked on a queue forever
+                for task in tasks:
+                    task.cancel()
+                raise
+
+        return stats
+
+    @staticmethod
+    def new_stats(stats: Optional[dict] = None) -> dict:
+        """
+        Initialises (in place, if given) the counters a run maintains:
+        files scanned by the parsers, files/chunks written, chunks embedded,
+        and files skipped by FileFilter, per reason.
+        """
+        stats = stats if stats is not None else {}
+        for key in ("files", "scanned", "parsed", "embedded", "chunks", "errors", "unchanged", "removed"):
+            stats.setdefault(key, 0)
+        stats.setdefault("skipped", {})
+        return stats
+
+    async def begin_generation(self, project_id: str) -> int:
+        """
+        Allocates the index generation a new build writes into.
+        """
+        SessionLocal = await get_db()
+        async with SessionLocal() as session:
+            generation = await session.scalar(
+                update(Project)
+                .where(Project.id == uuid.UUID(str(project_id)))
+                .values(latest_generation=Project.latest_generation + 1)
+                .returning(Project.latest_generation)
+            )
+            await session.commit()
+        return generation
+
+    async def finalize(self, project_id: str, generation: int, replace: bool = False):
+        """
+        Makes `generation` the one queries read, once its content is stored.
+        With replace=True (full ingestion) every row of older generations is
+        retired along with it. Retiring and the pointer flip share one
+        transaction, so readers switch from the old index to the new one at
+        once; the retired rows stay in place for collect_garbage().
+        """
+        await ensure_project_index(project_id)
+        pid = uuid.UUID(str(project_id))
+        SessionLocal = await get_db()
+        async with SessionLocal() as session:
+            if replace:
+                await session.execute(
+                    update(Document)
+                    .where(
+                        Document.project_id == pid,
+                        Document.retired_generation.is_(None),
+                        Document.generation < generation,
+                    )
+                    .values(retired_generation=generation)
+                )
+            # Answers cached against the previous version become unreachable
+            await session.execute(
+                update(Project)
+                .where(Project.id == pid)
+                .values(
+                    active_generation=func.greatest(Project.active_generation, generation),
+                    index_version=Project.index_version + 1,
+                )
+            )
+            await session.commit()
+        if settings.VECTOR_LOCAL_INDEX:
+            # Other processes move on by generation, this one can free the old export now
+            local_index_cache.invalidate(project_id)
+        print(f"[INGEST] Generation {generation} of project {project_id} is live")
+
+    async def abandon(self, project_id: str, generation: int):
+        """
+        Rolls back a build that will never go live: rows it retired are live
+        again and rows it wrote are deleted. No-op once the generation is active.
+        """
+        pid = uuid.UUID(str(project_id))
+        SessionLocal = await get_db()
+        async with SessionLocal() as session:
+            active = await session.scalar(select(Project.active_generation).where(Project.id == pid))
+            if active is None or active >= generation:
+                return
+            await session.execute(
+                update(Document)
+                .where(Document.project_id == pid, Document.retired_generation == generation)
+                .values(retired_generation=None)
+            )
+            await session.commit()
+        # Invisible either way, but must be gone before a later generation goes live
+        await self._purge_documents(pid, Document.generation == generation)
+
+    async def collect_garbage(self, project_id: str) -> int:
+        """
+        Deletes rows that no longer belong to the active generation, in
+        INDEX_GC_BATCH sized transactions so no lock is held for long.
+        Returns the number of documents deleted.
+        """
+        pid = uuid.UUID(str(project_id))
+        SessionLocal = await get_db()
+        async with SessionLocal() as session:
+            active = await session.scalar(select(Project.active_generation).where(Project.id == pid))
+        if active is None:
+            return 0
+        deleted = await self._purge_documents(pid, Document.retired_generation <= active)
+        if deleted:
+            print(f"[INGEST] Collected {deleted} retired documents of project {project_id}")
+        return deleted
+
+    async def _purge_documents(self, pid: uuid.UUID, *criteria) -> int:
+        SessionLocal = await get_db()
+        deleted = 0
+        while True:
+            async with SessionLocal() as session:
+                result = await session.execute(
+                    select(Document.id)
+                    .where(Document.project_id == pid, *criteria)
+                    .limit(settings.INDEX_GC_BATCH)
+                )
+                doc_ids = result.scalars().all()
+                if not doc_ids:
+                    return deleted
+                await self._delete_documents(session, doc_ids)
+                await session.commit()
+            deleted += len(doc_ids)
+
+    async def sync(
+        self,
+        files: List[str],
+        project_id: str,
+        changes: Optional[dict] = None,
+        stats: Optional[dict] = None,
+        blobs: Optional[dict] = None,
+        checkpoint: Optional[Callable[..., Awaitable]] = None,
+        generation: Optional[int] = None,
+    ) -> dict:
+        """
+        Incremental re-ingestion into `generation` (a new one if not given).
+        With a git diff (`changes` from RepoLoader.sync_repo) only
+        added/modified files are considered, otherwise every file is hashed.
+        Files whose hash matches the stored Document are skipped and
+        Documents for paths no longer in `files` are retired.
+        """
+        if generation is None:
+            generation = await self.begin_generation(project_id)
+        known_docs = await self.load_known_docs(project_id)
+
+        if changes is not None:
+            candidates = set(changes["added"]) | set(changes["modified"])
+            to_process = [f for f in files if f in candidates]
+        else:
+            to_process = files
+
+        present = set(files)
+        stale_ids = [doc_id for path, (doc_id, _) in known_docs.items() if path not in present]
+        if stale_ids:
+            SessionLocal = await get_db()
+            async with SessionLocal() as session:
+                await self._retire_documents(session, stale_ids, generation)
+                await session.commit()
+
+        stats = await self._run(to_process, project_id, known_docs, stats, blobs, checkpoint, generation)
+        stats["deleted"] = len(stale_ids)
+        if stats["parsed"] or stats["removed"] or stale_ids:
+            await self.finalize(project_id, generation)
+        return stats
+
+    async def load_known_docs(
+        self,
+        project_id: str,
+        paths: Optional[List[str]] = None,
+        generation: Optional[int] = None,
+    ) -> Dict[str, Tuple[uuid.UUID, Optional[str]]]:
+        """
+        Live (not retired) documents of the project, or only those written
+        by `generation`.
+        """
+        SessionLocal = await get_db()
+        async with SessionLocal() as session:
+            stmt = select(Document.id, Document.path, Document.content_hash).filter(
+                Document.project_id == uuid.UUID(str(project_id)),
+                Document.retired_generation.is_(None),
+            )
+            if generation is not None:
+                stmt = stmt.filter(Document.generation == generation)
+            if paths is not None:
+                stmt = stmt.filter(Document.path.in_(paths))
+            result = await session.execute(stmt)
+            return {path: (doc_id, content_hash) for doc_id, path, content_hash in result.all()}
+
+    async def _retire_documents(self, session, doc_ids: List[uuid.UUID], generation: int):
+        await session.execute(
+            update(Document)
+            .where(Document.id.in_(doc_ids), Document.retired_generation.is_(None))
+            .values(retired_generation=generation)
+        )
+
+    async def _delete_documents(self, session, doc_ids: List[uuid.UUID]):
+        await session.execute(delete(Embedding).where(Embedding.document_id.in_(doc_ids)))
+        await session.execute(delete(Document).where(Document.id.in_(doc_ids)))
+
+    async def _parse_stage(
+        self,
+        executor: Executor,
+        files: List[str],
+        known_docs: dict,
+        out_queue: asyncio.Queue,
+        stats: dict,
+        blobs: Optional[dict] = None,
+    ):
+        loop = asyncio.get_running_loop()
+        # Caps parsed-but-unqueued results, not just running parses
+        in_flight = asyncio.Semaphore(self.parse_workers * 2)
+        pending = set()
+
+        async def parse_one(file_path: str):
+            try:
+                known = known_docs.get(file_path)
+                known_hash = known[1] if known else None
+                if blobs is not None:
+                    _, content_hash, chunks = await loop.run_in_executor(
+                        executor, chunk_blob, file_path, blobs.repo_path, blobs[file_path][0], known_hash
+                    )
+                else:
+                    _, content_hash, chunks = await loop.run_in_executor(
+                        executor, chunk_file, file_path, known_hash
+                    )
+                if chunks is None:
+                    stats["unchanged"] += 1
+                elif chunks or known:
+                    # A known file that no longer yields chunks still has to drop its old row
+                    await out_queue.put((file_path, content_hash, chunks))
+            except SkipFile as e:
+                stats["skipped"][e.reason] = stats["skipped"].get(e.reason, 0) + 1
+                if known_docs.get(file_path):
+                    await out_queue.put((file_path, None, []))
+            except Exception as e:
+                print(f"[INGEST] Error processing {file_path}: {e}")
+                stats["errors"] += 1
+            finally:
+                stats["scanned"] += 1
+                in_flight.release()
+
+        for file_path in files:
+            await in_flight.acquire()
+            task = asyncio.create_task(parse_one(file_path))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        if pending:
+            await asyncio.gather(*pending)
+        _enter_stage(stats, "embedding")
+        await out_queue.put(_DONE)
+
+    async def _embed_stage(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue, stats: dict):
+        # Chunks are buffered across files so small files still fill a batch
+        buffered = []
+        buffered_chunks = 0
+
+        async def flush():
+            nonlocal buffered, buffered_chunks
+            texts = [c["content"] for _, _, chunks in buffered for c in chunks]
+            # Cached vectors are reused, encode() runs off the event loop for the rest
+            vectors = await embedding_service.aembed_chunks(texts)
+            stats["embedded"] += len(texts)
+            offset = 0
+            for file_path, content_hash, chunks in buffered:
+                await out_queue.put((file_path, content_hash, chunks, vectors[offset:offset + len(chunks)]))
+                offset += len(chunks)
+            buffered = []
+            buffered_chunks = 0
+
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                if buffered:
+                    await flush()
+                _enter_stage(stats, "writing")
+                await out_queue.put(_DONE)
+                return
+
+            _enter_stage(stats, "embedding")
+            buffered.append(item)
+            buffered_chunks += len(item[2])
+            if buffered_chunks >= self.embed_buffer:
+                await flush()
+
+    async def _write_stage(
+        self,
+        in_queue: asyncio.Queue,
+        project_id: str,
+        known_docs: dict,
+        stats: dict,
+        checkpoint: Optional[Callable[..., Awaitable]] = None,
+        generation: int = 0,
+    ):
+        SessionLocal = await get_db()
+        async with SessionLocal() as session:
+            writer = BulkWriter(session, batch_size=self.write_batch_rows)
+            uncommitted = 0
+            # Rows replaced by this window, retired in one statement at commit time
+            replaced_ids = []
+
+            async def commit_window():
+                nonlocal replaced_ids, uncommitted
+                if replaced_ids:
+                    await self._retire_documents(session, replaced_ids, generation)
+                    replaced_ids = []
+                await writer.flush()
+                if checkpoint:
+                    await checkpoint(session)
+                await session.commit()
+                uncommitted = 0
+
+            while True:
+                item = await in_queue.get()
+                if item is _DONE:
+                    break
+
+                _enter_stage(stats, "writing")
+                file_path, content_hash, chunks, vectors = item
+                if file_path in known_docs:
+                    replaced_ids.append(known_docs[file_path][0])
+                    stats["removed"] += 1
+
+                if chunks:
+                    doc_id = writer.add_document(project_id, file_path, content_hash, {"language": "unknown"}, generation=generation)
+                    for chunk, vector in zip(chunks, vectors):
+                        metadata, content = split_chunk(chunk, file_path)
+                        writer.add_embedding(
+                            project_id, doc_id, vector, metadata, generation=generation,
+                            symbol=chunk_symbol(chunk), lexemes=chunk_lexemes(chunk), content=content,
+                        )
+
+                    stats["parsed"] += 1
+                    stats["chunks"] += len(chunks)
+                    await writer.maybe_flush()
+                uncommitted += 1
+
+                if uncommitted >= self.commit_every:
+                    await commit_window()
+                    print(f"[INGEST] Stored {stats['parsed']}/{stats['files']} files")
+
+            await commit_window()
+
+def shard_files(files: List[str], max_bytes: int, blobs: Optional[dict] = None) -> List[List[str]]:
+    """
+    Splits `files` into consecutive shards of at most `max_bytes` on disk
+    (a single larger file gets a shard of its own). Sizing by bytes rather
+    than file count keeps one vendored blob from stalling a whole shard, and
+    keeping path order keeps directories together. Sizes come from `blobs`
+    when the files only exist as git objects.
+    """
+    shards, current, current_bytes = [], [], 0
+    for file_path in files:
+        try:
+            size = blobs[file_path][1] if blobs is not None else os.path.getsize(file_path)
+        except (KeyError, OSError):
+            size = 0
+        if current and current_bytes + size > max_bytes:
+            shards.append(current)
+            current, current_bytes = [], 0
+        current.append(file_path)
+        current_bytes += size
+    if current:
+        shards.append(current)
+    return shards
+
+ingestion_pipeline = IngestionPipeline()
@@ -0,0 +1,19 @@
+; Definitions for CodeParser.extract_definitions.
+; @definition.<kind> marks the node to chunk, @name the identifier it is cited by.
+
+(function_definition
+  declarator: (function_declarator
+    declarator: (identifier) @name)) @definition.function
+
+(function_definition
+  declarator: (pointer_declarator
+    declarator: (function_declarator
+      declarator: (identifier) @name))) @definition.function
+
+(struct_specifier
+  name: (type_identifier) @name
+  body: (_)) @definition.class
+
+(enum_specifier
+  name: (type_identifier) @name
+  body: (_)) @definition.class
@@ -0,0 +1,28 @@
+; Definitions for CodeParser.extract_definitions.
+; @definition.<kind> marks the node to chunk, @name the identifier it is cited by.
+
+(function_definition
+  declarator: (function_declarator
+    declarator: [(identifier) (field_identifier) (qualified_identifier) (destructor_name) (operator_name)] @name)) @definition.function
+
+(function_definition
+  declarator: (pointer_declarator
+    declarator: (function_declarator
+      declarator: [(identifier) (field_identifier) (qualified_identifier)] @name))) @definition.function
+
+(function_definition
+  declarator: (reference_declarator
+    (function_declarator
+      declarator: [(identifier) (field_identifier) (qualified_identifier)] @name))) @definition.function
+
+(class_specifier
+  name: (type_identifier) @name
+  body: (_)) @definition.class
+
+(struct_specifier
+  name: (type_identifier) @name
+  body: (_)) @definition.class
+
+(namespace_definition
+  name: (_) @name
+  body: (_)) @definition.class
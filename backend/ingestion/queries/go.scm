@@ -0,0 +1,12 @@
+; Definitions for CodeParser.extract_definitions.
+; @definition.<kind> marks the node to chunk, @name the identifier it is cited by.
+
+(function_declaration
+  name: (identifier) @name) @definition.function
+
+(method_declaration
+  name: (field_identifier) @name) @definition.method
+
+(type_declaration
+  (type_spec
+    name: (type_identifier) @name)) @definition.class
@@ -0,0 +1,17 @@
+; Definitions for CodeParser.extract_definitions.
+; @definition.<kind> marks the node to chunk, @name the identifier it is cited by.
+
+(class_declaration
+  name: (identifier) @name) @definition.class
+
+(interface_declaration
+  name: (identifier) @name) @definition.class
+
+(enum_declaration
+  name: (identifier) @name) @definition.class
+
+(method_declaration
+  name: (identifier) @name) @definition.method
+
+(constructor_declaration
+  name: (identifier) @name) @definition.method
@@ -0,0 +1,16 @@
+; Definitions for CodeParser.extract_definitions.
+; @definition.<kind> marks the node to chunk, @name the identifier it is cited by.
+
+(function_definition
+  name: (identifier) @name) @definition.function
+
+(class_definition
+  name: (identifier) @name) @definition.class
+
+(decorated_definition
+  definition: (function_definition
+    name: (identifier) @name)) @definition.function
+
+(decorated_definition
+  definition: (class_definition
+    name: (identifier) @name)) @definition.class
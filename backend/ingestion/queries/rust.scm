@@ -0,0 +1,21 @@
+; Definitions for CodeParser.extract_definitions.
+; @definition.<kind> marks the node to chunk, @name the identifier it is cited by.
+
+(function_item
+  name: (identifier) @name) @definition.function
+
+(struct_item
+  name: (type_identifier) @name) @definition.class
+
+(enum_item
+  name: (type_identifier) @name) @definition.class
+
+(trait_item
+  name: (type_identifier) @name) @definition.class
+
+(impl_item
+  type: (_) @name) @definition.class
+
+(mod_item
+  name: (identifier) @name
+  body: (_)) @definition.class
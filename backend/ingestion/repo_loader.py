@@ -1,18 +1,73 @@
 import os
+import re
+import time
+import fcntl
 import shutil
+import hashlib
+import binascii
+import threading
 import git
-from typing import Optional
+from contextlib import contextmanager
+from typing import Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
 from backend.core.config import settings
+from backend.ingestion.filters import FileFilter
 import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 
+FETCH_STAMP = "speccraft-fetched"
+
+def normalize_repo_url(repo_url: str) -> str:
+    """
+    Canonical form of a repo URL, so trivially different spellings of the same
+    repo share one mirror: scp-style SSH becomes ssh://, scheme and host are
+    lowercased, trailing slashes and ".git" are dropped. Credentials are kept,
+    a mirror is only shared between callers that authenticate the same way.
+    """
+    url = repo_url.strip()
+    scp = re.match(r"^([\w.-]+@)?([\w.-]+):(?!//)(.+)$", url)
+    if scp and "://" not in url:
+        url = f"ssh://{scp.group(1) or ''}{scp.group(2)}/{scp.group(3)}"
+    parts = urlsplit(url)
+    netloc = parts.netloc.rpartition("@")
+    netloc = netloc[0] + netloc[1] + netloc[2].lower()
+    path = re.sub(r"/+$", "", parts.path)
+    if path.endswith(".git"):
+        path = path[:-4]
+    return urlunsplit((parts.scheme.lower(), netloc, path, "", ""))
+
+def mirror_key(repo_url: str) -> str:
+    return hashlib.sha256(normalize_repo_url(repo_url).encode("utf-8")).hexdigest()[:32]
+
+class BlobIndex(dict):
+    """
+    The files of one commit as stored in git: maps the path a file would have
+    in a checkout (repo_path/rel) to its (blob_sha, size). Content is read
+    from the object database with read_blob, nothing is written to disk.
+    """
+    def __init__(self, repo_path: str, entries=()):
+        super().__init__(entries)
+        self.repo_path = repo_path
+
+# Parse workers keep one Repo (and its `git cat-file` process) per thread
+_blob_readers = threading.local()
+
+def read_blob(repo_path: str, blob_sha: str) -> bytes:
+    repos = getattr(_blob_readers, "repos", None)
+    if repos is None:
+        repos = _blob_readers.repos = {}
+    if repo_path not in repos:
+        repos[repo_path] = git.Repo(repo_path)
+    return repos[repo_path].odb.stream(binascii.unhexlify(blob_sha)).read()
+
 class RepoLoader:
     def __init__(self, storage_path: str = None):
         # Use environment variable or default to /tmp for serverless
         self.storage_path = storage_path or os.environ.get('REPO_STORAGE_PATH', '/tmp/repos')
-        os.makedirs(self.storage_path, exist_ok=True)
+        self.mirror_path = os.path.join(self.storage_path, ".mirrors")
+        os.makedirs(self.mirror_path, exist_ok=True)
 
     def clone_repo(self, repo_url: str, repo_id: Optional[str] = None) -> str:
         """
@@ -30,27 +85,291 @@ class RepoLoader:
 
         logger.info(f"Cloning {repo_url} to {target_dir}...")
         try:
-             git.Repo.clone_from(repo_url, target_dir, depth=1)
+            if settings.REPO_MIRROR_CACHE:
+                with self.mirror(repo_url) as mirror_dir:
+                    repo = git.Repo.clone_from(mirror_dir, target_dir, no_checkout=settings.INGEST_FROM_GIT_OBJECTS)
+                # Keep the real URL as origin, sync_repo checks it
+                repo.remotes.origin.set_url(repo_url)
+            else:
+                git.Repo.clone_from(repo_url, target_dir, depth=1, no_checkout=settings.INGEST_FROM_GIT_OBJECTS)
         except Exception as e:
             logger.error(f"Failed to clone repo: {e}")
             raise e
             
         return target_dir
 
-    def get_file_list(self, repo_path: str):
+    @contextmanager
+    def mirror(self, repo_url: str):
+        """
+        Yields the path of an up to date bare mirror of `repo_url` (default
+        branch, depth 1). Mirrors are shared by every project with the same
+        normalized URL: an existing one is fetched instead of re-cloned, and
+        a caller that asked while another caller's fetch was running reuses
+        that fetch instead of starting its own. Callers for one URL take turns
+        (exclusive lock), and the mirror can't be evicted while a caller is
+        inside the block.
+        """
+        key = mirror_key(repo_url)
+        mirror_dir = os.path.join(self.mirror_path, key)
+        requested_at = time.time_ns()
+        with self._file_lock(os.path.join(self.mirror_path, f".{key}.lock")):
+            self._update_mirror(repo_url, mirror_dir, requested_at)
+            os.utime(mirror_dir)
+            # Still held while the caller reads: evict_mirrors skips locked mirrors
+            yield mirror_dir
+        self.evict_mirrors(keep=key)
+
+    def _update_mirror(self, repo_url: str, mirror_dir: str, requested_at: int):
+        stamp = os.path.join(mirror_dir, FETCH_STAMP)
+        if os.path.isdir(mirror_dir):
+            try:
+                mirror = git.Repo(mirror_dir)
+                if os.stat(stamp).st_mtime_ns >= requested_at:
+                    logger.info(f"Mirror of {repo_url} was fetched while we waited, reusing it")
+                    return
+                logger.info(f"Fetching {repo_url} into mirror {mirror_dir}...")
+                mirror.remotes.origin.set_url(repo_url)
+                mirror.git.fetch("origin", "HEAD", "--depth=1")
+                branch = mirror.git.symbolic_ref("--short", "HEAD")
+                mirror.git.update_ref(f"refs/heads/{branch}", "FETCH_HEAD")
+                self._touch_stamp(stamp)
+                return
+            except Exception as e:
+                logger.warning(f"Mirror {mirror_dir} unusable ({e}), re-cloning")
+                shutil.rmtree(mirror_dir, ignore_errors=True)
+
+        logger.info(f"Mirroring {repo_url} to {mirror_dir}...")
+        mirror = git.Repo.clone_from(repo_url, mirror_dir, bare=True, depth=1, single_branch=True)
+        # Shard workers fetch pinned commits from the mirror by hash
+        mirror.git.config("uploadpack.allowAnySHA1InWant", "true")
+        self._touch_stamp(stamp)
+
+    @staticmethod
+    def _touch_stamp(stamp: str):
+        # Completion time: every caller that asked before the fetch finished
+        # (it was running, or queued behind it) reuses it
+        open(stamp, "w").close()
+        os.utime(stamp)
+
+    def evict_mirrors(self, keep: Optional[str] = None):
+        """
+        Deletes least recently used mirrors until the cache fits in
+        REPO_MIRROR_CACHE_BYTES. Mirrors in use by another caller are skipped.
+        """
+        mirrors = []
+        for key in os.listdir(self.mirror_path):
+            path = os.path.join(self.mirror_path, key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(root, f))
+                for root, _, files in os.walk(path) for f in files
+            )
+            mirrors.append((os.path.getmtime(path), key, size))
+
+        total = sum(size for _, _, size in mirrors)
+        for _, key, size in sorted(mirrors):
+            if total <= settings.REPO_MIRROR_CACHE_BYTES:
+                break
+            if key == keep:
+                continue
+            try:
+                with self._file_lock(os.path.join(self.mirror_path, f".{key}.lock"), fcntl.LOCK_EX | fcntl.LOCK_NB):
+                    shutil.rmtree(os.path.join(self.mirror_path, key), ignore_errors=True)
+            except BlockingIOError:
+                continue
+            logger.info(f"Evicted repo mirror {key} ({size} bytes)")
+            total -= size
+
+    def sync_repo(self, repo_url: str, repo_id: str, base_commit: Optional[str] = None) -> Tuple[str, Optional[dict]]:
+        """
+        Brings an existing checkout up to date instead of re-cloning it.
+        Returns (local_path, changes) where changes maps "added", "modified" and
+        "deleted" to lists of absolute paths changed since `base_commit`, the
+        commit the index was last built from. The checkout's own HEAD is no
+        base: a sync that moved it may have failed before indexing anything.
+        changes is None when there is no base to diff against (unknown, or no
+        longer fetchable) or no usable checkout and a fresh clone had to be
+        made; the caller then compares every file.
+        """
+        target_dir = os.path.join(self.storage_path, repo_id)
+
+        try:
+            repo = git.Repo(target_dir)
+            if repo.remotes.origin.url != repo_url:
+                raise ValueError(f"Checkout points at {repo.remotes.origin.url}")
+
+            logger.info(f"Fetching {repo_url} into {target_dir}...")
+            self._fetch(repo, repo_url)
+            new_head = repo.git.rev_parse("FETCH_HEAD")
+            self._move_head(repo, new_head)
+        except Exception as e:
+            logger.info(f"No usable checkout for {repo_url} ({e}), cloning fresh")
+            return self.clone_repo(repo_url, repo_id=repo_id), None
+
+        if not base_commit:
+            return target_dir, None
+        if base_commit == new_head:
+            return target_dir, {"added": [], "modified": [], "deleted": []}
+        try:
+            if not self._has_commit(repo, base_commit):
+                # Shallow fetches only bring the tip, get the base's tree too
+                self._fetch(repo, repo_url, base_commit)
+            # Both commits are local now, so a tree diff needs no history
+            diff = repo.git.diff("--name-status", "--no-renames", base_commit, new_head)
+        except git.GitCommandError as e:
+            logger.info(f"Last ingested commit {base_commit} of {repo_url} unavailable ({e}), comparing every file")
+            return target_dir, None
+
+        changes = {"added": [], "modified": [], "deleted": []}
+        status_keys = {"A": "added", "M": "modified", "T": "modified", "D": "deleted"}
+        for line in diff.splitlines():
+            status, _, rel_path = line.partition("\t")
+            key = status_keys.get(status[:1])
+            if key:
+                changes[key].append(os.path.join(target_dir, *rel_path.split("/")))
+        return target_dir, changes
+
+    def _fetch(self, repo: git.Repo, repo_url: str, *refs: str):
+        if settings.REPO_MIRROR_CACHE:
+            with self.mirror(repo_url) as mirror_dir:
+                repo.git.fetch(mirror_dir, *refs, "--depth=1")
+        else:
+            repo.git.fetch("origin", *refs, "--depth=1")
+
+    @staticmethod
+    def _has_commit(repo: git.Repo, commit: str) -> bool:
+        try:
+            repo.git.cat_file("-e", f"{commit}^{{commit}}")
+            return True
+        except git.GitCommandError:
+            return False
+
+    @contextmanager
+    def _file_lock(self, path: str, mode: int = fcntl.LOCK_EX):
+        with open(path, "w") as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield lock_file
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def repo_lock(self, repo_id: str):
+        """
+        Exclusive per-checkout lock, so concurrent tasks on one host don't
+        clone into the same directory at once.
+        """
+        with self._file_lock(os.path.join(self.storage_path, f".{repo_id}.lock")):
+            yield
+
+    def get_head_commit(self, repo_path: str) -> str:
+        return git.Repo(repo_path).head.commit.hexsha
+
+    def ensure_checkout(self, repo_url: str, repo_id: str, commit: str) -> str:
+        """
+        Returns a local checkout of `repo_url` at exactly `commit`, reusing the
+        one on disk when it already matches. Used by shard workers, which may
+        run on hosts that never saw the original clone.
+        """
+        target_dir = os.path.join(self.storage_path, repo_id)
+        with self.repo_lock(repo_id):
+            try:
+                if self.get_head_commit(target_dir) == commit:
+                    return target_dir
+            except Exception:
+                pass
+
+            self.clone_repo(repo_url, repo_id=repo_id)
+            repo = git.Repo(target_dir)
+            if repo.head.commit.hexsha != commit:
+                # The remote moved on since the coordinator cloned; pin the planned commit
+                fetched = False
+                if settings.REPO_MIRROR_CACHE:
+                    try:
+                        with self.mirror(repo_url) as mirror_dir:
+                            repo.git.fetch(mirror_dir, commit, "--depth=1")
+                        fetched = True
+                    except git.GitCommandError:
+                        pass  # The mirror no longer has it, ask the remote
+                if not fetched:
+                    repo.git.fetch("origin", commit, "--depth=1")
+                self._move_head(repo, commit)
+        return target_dir
+
+    @staticmethod
+    def _move_head(repo: git.Repo, commit: str):
+        # Ingesting from git objects needs no working tree, only HEAD
+        repo.git.reset("--soft" if settings.INGEST_FROM_GIT_OBJECTS else "--hard", commit)
+
+    def list_blobs(self, repo_path: str, rev: str = "HEAD", skipped: Optional[dict] = None) -> BlobIndex:
+        """
+        Lists the files of `rev` straight from the git tree, filtered by the
+        same FileFilter path rules as get_file_list before any content is
+        read. Symlinks and submodules are dropped. Skipped files are counted
+        per reason into `skipped`.
+        """
+        entries = []
+        ignore_files = {}
+        listing = git.Repo(repo_path).git.ls_tree("-r", "-l", "-z", "--full-tree", rev)
+        for entry in listing.split("\0"):
+            if not entry:
+                continue
+            info, _, rel_path = entry.partition("\t")
+            mode, obj_type, blob_sha, size = info.split()
+            if obj_type != "blob" or mode == "120000":
+                continue
+            name = rel_path.rsplit("/", 1)[-1]
+            if name == ".gitignore" or rel_path == settings.INGEST_IGNORE_FILE:
+                ignore_files[rel_path] = blob_sha
+            entries.append((rel_path, blob_sha, int(size)))
+
+        file_filter = FileFilter(skipped)
+        for rel_path, blob_sha in sorted(ignore_files.items()):
+            text = read_blob(repo_path, blob_sha).decode("utf-8", errors="ignore")
+            file_filter.add_ignore_file(rel_path.rpartition("/")[0], text)
+
+        blobs = BlobIndex(repo_path)
+        for rel_path, blob_sha, size in entries:
+            if file_filter.accept(rel_path, size):
+                blobs[os.path.join(repo_path, *rel_path.split("/"))] = (blob_sha, size)
+        return blobs
+
+    def get_file_list(self, repo_path: str, skipped: Optional[dict] = None):
         """
         Walks the repo and returns list of files avoiding .git and other ignores.
+        Filtering is FileFilter's (see list_blobs); directories it rules out
+        are pruned unwalked and counted as "<reason>_dirs" in `skipped`.
         """
+        file_filter = FileFilter(skipped)
+        project_ignore = os.path.join(repo_path, settings.INGEST_IGNORE_FILE)
+        if os.path.isfile(project_ignore):
+            with open(project_ignore, encoding="utf-8", errors="ignore") as f:
+                file_filter.add_ignore_file("", f.read())
+
         files_list = []
         for root, dirs, files in os.walk(repo_path):
-            if ".git" in dirs:
-                dirs.remove(".git")
-            
+            rel_root = os.path.relpath(root, repo_path).replace(os.sep, "/")
+            rel_root = "" if rel_root == "." else rel_root
+            if ".gitignore" in files:
+                with open(os.path.join(root, ".gitignore"), encoding="utf-8", errors="ignore") as f:
+                    file_filter.add_ignore_file(rel_root, f.read())
+
+            for d in list(dirs):
+                reason = "git" if d == ".git" else file_filter.dir_reason(f"{rel_root}/{d}".lstrip("/"))
+                if reason:
+                    dirs.remove(d)
+                    if reason != "git":
+                        file_filter.count(f"{reason}_dirs")
+
             for file in files:
-                # Add basic filtering here
-                if file.startswith("."):
+                file_path = os.path.join(root, file)
+                try:
+                    size = os.path.getsize(file_path)
+                except OSError:
                     continue
-                files_list.append(os.path.join(root, file))
+                if file_filter.accept(f"{rel_root}/{file}".lstrip("/"), size):
+                    files_list.append(file_path)
         return files_list
 
 repo_loader = RepoLoader()
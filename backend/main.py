@@ -1,7 +1,8 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from backend.core.config import settings
 
+from backend.api import deps
 from backend.api.v1.api import api_router
 import backend.models # Register models
 
@@ -26,6 +27,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def resume_interrupted_ingestion():
+    if settings.INGEST_RESUME_ON_STARTUP:
+        import asyncio
+        from backend.ingestion.jobs import watch_stale_jobs
+        app.state.stale_job_watcher = asyncio.create_task(watch_stale_jobs())
+
+@app.on_event("shutdown")
+async def stop_stale_job_watcher():
+    watcher = getattr(app.state, "stale_job_watcher", None)
+    if watcher:
+        watcher.cancel()
+
 @app.get("/")
 def root():
     return {"message": "Welcome to SpecCraft AI API", "version": settings.VERSION}
@@ -33,3 +47,16 @@ def root():
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/stats", dependencies=[Depends(deps.get_current_user)])
+def cache_stats():
+    from backend.rag.embeddings import embedding_service
+    from backend.rag.embedding_cache import embedding_cache
+    from backend.rag.local_index import local_index_cache
+    from backend.inference.answer_cache import answer_cache
+    return {
+        "query_embedding_cache": embedding_service.query_cache.stats(),
+        "chunk_embedding_cache": embedding_cache.stats(),
+        "local_vector_index": local_index_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+    }
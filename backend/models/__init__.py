@@ -1,3 +1,4 @@
 from .models import User, Project
 from .document import Document
-from .analytics import Embedding, Query
+from .analytics import Embedding, EmbeddingCacheEntry, Query
+from .ingestion import IngestionJob
@@ -1,22 +1,44 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text, JSON
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, Computed, Integer, String, DateTime, ForeignKey, LargeBinary, Text, JSON, text
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
 from pgvector.sqlalchemy import Vector
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 import uuid
 from backend.db.base import Base
 
+# Symbol terms rank above content terms
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple', coalesce(lower(symbol), '')), 'A') || "
+    "to_tsvector('simple', coalesce(lexemes, ''))"
+)
+
 class Embedding(Base):
     __tablename__ = "embeddings"
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"))
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), index=True)
+    project_id = Column(UUID(as_uuid=True), ForeignKey("projects.id"), index=True) # Denormalized from Document for filtered ANN search
+    generation = Column(Integer, nullable=False, default=0, server_default=text("0")) # Denormalized from Document, never updated
     vector = Column(Vector(384)) # all-MiniLM-L6-v2 dimension
-    chunk_metadata = Column(JSON)
+    chunk_metadata = Column(JSON) # Pointer fields only: path, type, name, start_line, end_line, part
+    symbol = Column(String) # Name of the defined identifier, for exact lookups (see rag.lexical)
+    # Search-only columns, not loaded with retrieved rows
+    lexemes = deferred(Column(Text)) # Normalized name and content terms the full-text entry is built from
+    search_vector = deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True)))
+    content = deferred(Column(LargeBinary)) # zlib compressed chunk text, loaded for prompts and snippets (see rag.chunks)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     document = relationship("Document")
 
+class EmbeddingCacheEntry(Base):
+    __tablename__ = "embedding_cache"
+
+    # Content addressed: the same chunk text embeds to the same vector in every project
+    model = Column(String, primary_key=True)
+    content_hash = Column(String(64), primary_key=True) # sha256 of the chunk text
+    vector = Column(Vector()) # Unconstrained, dimension depends on the model
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class Query(Base):
     __tablename__ = "queries"
     
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, text
 from sqlalchemy.dialects.postgresql import UUID
 from pgvector.sqlalchemy import Vector
 from sqlalchemy.orm import relationship
@@ -14,6 +14,9 @@ class Document(Base):
     type = Column(String) # code, api, doc, infra
     path = Column(String)
     metadata_ = Column("metadata", JSON) # metadata is reserved
+    content_hash = Column(String(64)) # sha256 of file bytes, lets re-ingestion skip unchanged files
+    generation = Column(Integer, nullable=False, default=0, server_default=text("0")) # Index generation that wrote the row
+    retired_generation = Column(Integer) # First generation the row is no longer part of, NULL = live
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     project = relationship("Project", back_populates="documents")
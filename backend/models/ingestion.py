@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, JSON
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+import uuid
+from backend.db.base import Base
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    project_id = Column(UUID(as_uuid=True), ForeignKey("projects.id"), index=True)
+    status = Column(String, default="queued") # queued, cloning, parsing, embedding, writing, sharded, done, failed
+    incremental = Column(Boolean, default=False)
+    files_total = Column(Integer, default=0)
+    files_parsed = Column(Integer, default=0)
+    files_written = Column(Integer, default=0)
+    files_unchanged = Column(Integer, default=0)
+    files_failed = Column(Integer, default=0)
+    chunks_embedded = Column(Integer, default=0)
+    chunks_written = Column(Integer, default=0)
+    files_skipped = Column(JSON) # reason -> count, see ingestion.filters
+    commit_sha = Column(String(40)) # Commit being ingested, pinned so a resumed run sees the same tree
+    checkpoint_at = Column(DateTime(timezone=True)) # Last committed batch
+    attempts = Column(Integer, default=0)
+    generation = Column(Integer) # Index generation the job builds, reused by resumed runs and shards
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True))
+    
+    project = relationship("Project")
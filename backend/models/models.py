@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -22,6 +22,9 @@ class Project(Base):
     name = Column(String, index=True)
     repo_url = Column(String)
     owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
+    index_version = Column(Integer, nullable=False, default=0, server_default=text("0")) # Bumped by every ingestion that changes the index
+    active_generation = Column(Integer, nullable=False, default=0, server_default=text("0")) # Index generation queries read, see IngestionPipeline.finalize
+    latest_generation = Column(Integer, nullable=False, default=0, server_default=text("0")) # Last generation handed to a build
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     owner = relationship("User", back_populates="projects")
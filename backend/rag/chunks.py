@@ -0,0 +1,62 @@
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import select
+from backend.models.analytics import Embedding
+from backend.rag.vector_index import project_literal
+import uuid
+import zlib
+
+COMPRESSION_LEVEL = 6
+
+# chunk_metadata fields, enough to cite a chunk and fetch its text later
+POINTER_FIELDS = ("path", "type", "name", "start_line", "end_line", "part")
+
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL)
+
+def decompress_text(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8")
+
+def split_chunk(chunk: dict, path: str) -> Tuple[dict, bytes]:
+    """
+    (pointer metadata, compressed text) of a parsed chunk, as stored on Embedding.
+    """
+    metadata = {key: chunk.get(key) for key in POINTER_FIELDS if key != "path"}
+    return {"path": path, **metadata}, compress_text(chunk.get("content") or "")
+
+def citation(chunk) -> dict:
+    """
+    What the client is told about a context chunk: its id and where it is.
+    The text is fetched through the snippet endpoint when someone looks.
+    """
+    meta = chunk.chunk_metadata or {}
+    return {"id": str(chunk.id), **{key: meta[key] for key in POINTER_FIELDS if key in meta}}
+
+def _row_text(content: Optional[bytes], metadata: Optional[dict]) -> str:
+    if content is not None:
+        return decompress_text(content)
+    # Stored before the text moved out of chunk_metadata
+    return (metadata or {}).get("content", "")
+
+async def load_chunk_texts(session, ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, str]:
+    """
+    Text of the given chunks in one primary key lookup.
+    """
+    ids = list(ids)
+    if not ids:
+        return {}
+    result = await session.execute(
+        select(Embedding.id, Embedding.content, Embedding.chunk_metadata).filter(Embedding.id.in_(ids))
+    )
+    return {emb_id: _row_text(content, metadata) for emb_id, content, metadata in result.all()}
+
+async def get_snippet(session, pid: uuid.UUID, chunk_id: uuid.UUID) -> Optional[dict]:
+    """
+    A cited chunk with its text, or None if the project has no such chunk.
+    """
+    row = (await session.execute(
+        select(Embedding.id, Embedding.content, Embedding.chunk_metadata)
+        .filter(Embedding.id == chunk_id, Embedding.project_id == project_literal(pid))
+    )).first()
+    if row is None:
+        return None
+    return {**citation(row), "content": _row_text(row.content, row.chunk_metadata)}
@@ -0,0 +1,124 @@
+from typing import Dict, Iterable, Optional
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from backend.core.config import settings
+from backend.db.session import get_db
+from backend.models.analytics import EmbeddingCacheEntry
+import numpy as np
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+DB_BATCH = 1000  # Keys per SELECT / rows per INSERT, well under asyncpg's bind parameter limit
+
+class EmbeddingCache:
+    """
+    Content-addressed chunk embeddings keyed by (model, sha256 of the text),
+    shared by every project: forks, mirrors and re-ingestions reuse vectors
+    instead of encoding identical chunks again.
+
+    Backed by the embedding_cache table, with an optional local disk tier
+    (EMBED_CACHE_DIR, one raw float32 file per vector) consulted first.
+    The cache is best effort: a failing tier counts as a miss.
+    """
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = settings.EMBED_CACHE_DIR if directory is None else directory
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+    def _path(self, model: str, digest: str) -> str:
+        return os.path.join(self.directory, model.replace("/", "--"), digest[:2], digest[2:] + ".f32")
+
+    def _read_disk(self, model: str, digests: Iterable[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        for digest in digests:
+            try:
+                with open(self._path(model, digest), "rb") as f:
+                    found[digest] = np.frombuffer(f.read(), dtype=np.float32)
+            except OSError:
+                continue
+        return found
+
+    def _write_disk(self, model: str, vectors: Dict[str, np.ndarray]):
+        for digest, vector in vectors.items():
+            path = self._path(model, digest)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so concurrent readers never see a partial vector
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(np.asarray(vector, dtype=np.float32).tobytes())
+            os.replace(tmp_path, path)
+
+    async def get_many(self, model: str, digests: Iterable[str]) -> Dict[str, np.ndarray]:
+        digests = list(dict.fromkeys(digests))
+        found = {}
+        if self.directory:
+            try:
+                found = await asyncio.to_thread(self._read_disk, model, digests)
+            except Exception as e:
+                logger.warning(f"Embedding cache disk read failed: {e}")
+
+        missing = [d for d in digests if d not in found]
+        if missing:
+            from_db = {}
+            try:
+                SessionLocal = await get_db()
+                async with SessionLocal() as session:
+                    for start in range(0, len(missing), DB_BATCH):
+                        result = await session.execute(
+                            select(EmbeddingCacheEntry.content_hash, EmbeddingCacheEntry.vector).where(
+                                EmbeddingCacheEntry.model == model,
+                                EmbeddingCacheEntry.content_hash.in_(missing[start:start + DB_BATCH]),
+                            )
+                        )
+                        for digest, vector in result.all():
+                            from_db[digest] = np.asarray(vector, dtype=np.float32)
+            except Exception as e:
+                logger.warning(f"Embedding cache lookup failed: {e}")
+            if from_db and self.directory:
+                await asyncio.to_thread(self._write_disk, model, from_db)
+            found.update(from_db)
+
+        self.hits += len(found)
+        self.misses += len(digests) - len(found)
+        return found
+
+    async def put_many(self, model: str, vectors: Dict[str, np.ndarray]):
+        if not vectors:
+            return
+        if self.directory:
+            try:
+                await asyncio.to_thread(self._write_disk, model, vectors)
+            except Exception as e:
+                logger.warning(f"Embedding cache disk write failed: {e}")
+
+        rows = [
+            {"model": model, "content_hash": digest, "vector": np.asarray(vector, dtype=np.float32)}
+            for digest, vector in vectors.items()
+        ]
+        try:
+            SessionLocal = await get_db()
+            async with SessionLocal() as session:
+                for start in range(0, len(rows), DB_BATCH):
+                    # Another worker may have stored the same chunk meanwhile
+                    await session.execute(
+                        insert(EmbeddingCacheEntry).values(rows[start:start + DB_BATCH]).on_conflict_do_nothing()
+                    )
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+embedding_cache = EmbeddingCache()
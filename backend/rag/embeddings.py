@@ -1,12 +1,75 @@
 from sentence_transformers import SentenceTransformer
+from typing import Optional
+from backend.core.cache import LRUCache
+from backend.core.config import settings
+from backend.rag.embedding_cache import embedding_cache
+import numpy as np
+import asyncio
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+class QueryBatcher:
+    """
+    Collects embed requests from concurrent coroutines for up to `max_wait_ms`
+    or `max_batch` distinct texts, encodes them in one embed_batch call on a
+    worker thread and resolves every caller's future. Identical texts that
+    arrive together share a single slot in the batch.
+    """
+    def __init__(self, service: "EmbeddingService", max_batch: int, max_wait_ms: float):
+        self.service = service
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._loop = None
+        self._pending = {}  # text -> [futures]
+        self._timer = None
+
+    async def submit(self, text: str):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # State is bound to one loop (tests and Celery may run several)
+            self._loop, self._pending, self._timer = loop, {}, None
+
+        future = loop.create_future()
+        self._pending.setdefault(text, []).append(future)
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            self._loop.create_task(self._encode(batch))
+
+    async def _encode(self, batch: dict):
+        texts = list(batch)
+        try:
+            vectors = await self._loop.run_in_executor(None, self.service.embed_batch, texts)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for text, vector in zip(texts, vectors):
+            result = vector.tolist()
+            for future in batch[text]:
+                if not future.done():
+                    future.set_result(result)
+
 class EmbeddingService:
-    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
-        self.model_name = model_name
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name or settings.EMBED_MODEL
         self._model = None
+        self.query_cache = LRUCache(settings.QUERY_EMBED_CACHE_SIZE, settings.QUERY_EMBED_CACHE_TTL)
+        self.query_batcher = QueryBatcher(self, settings.QUERY_BATCH_MAX_SIZE, settings.QUERY_BATCH_MAX_WAIT_MS)
 
     @property
     def model(self):
@@ -21,7 +84,69 @@ class EmbeddingService:
         """
         return self.model.encode(text).tolist()
 
-    def embed_batch(self, texts: list[str]):
-        return self.model.encode(texts).tolist()
+    @staticmethod
+    def normalize_query(text: str) -> str:
+        return re.sub(r"\s+", " ", text).strip()
+
+    async def aembed_query(self, text: str):
+        """
+        Embeds a user query without blocking the event loop. Results are
+        cached by (model, normalized text), so repeated questions skip encode(),
+        and misses from concurrent requests are micro-batched together.
+        """
+        normalized = self.normalize_query(text)
+        key = (self.model_name, normalized)
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = await self.query_batcher.submit(normalized)
+            self.query_cache.set(key, vector)
+        return vector
+
+    async def aembed_chunks(self, texts: list[str]) -> np.ndarray:
+        """
+        embed_batch for ingestion, without blocking the event loop. Vectors for
+        text any project has embedded before come from the content-addressed
+        cache (EMBED_CACHE); only new text is encoded, once per distinct text,
+        and is added to the cache in bulk.
+        """
+        loop = asyncio.get_running_loop()
+        if not settings.EMBED_CACHE or not texts:
+            return await loop.run_in_executor(None, self.embed_batch, texts)
+
+        digests = [embedding_cache.key(t) for t in texts]
+        found = await embedding_cache.get_many(self.model_name, digests)
+        missing = {}
+        for digest, text in zip(digests, texts):
+            if digest not in found:
+                missing.setdefault(digest, text)
+
+        if missing:
+            vectors = await loop.run_in_executor(None, self.embed_batch, list(missing.values()))
+            encoded = dict(zip(missing, vectors))
+            await embedding_cache.put_many(self.model_name, encoded)
+            found.update(encoded)
+        return np.stack([found[d] for d in digests]).astype(np.float32, copy=False)
+
+    def embed_batch(self, texts: list[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Embeds many strings, returning a (len(texts), dim) float32 array in input order.
+        Texts are length-bucketed so each forward pass pads to a similar length
+        instead of padding short chunks up to the longest one in the batch.
+        """
+        batch_size = batch_size or settings.EMBED_BATCH_SIZE
+        dim = self.model.get_sentence_embedding_dimension()
+        vectors = np.empty((len(texts), dim), dtype=np.float32)
+        if not texts:
+            return vectors
+
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            vectors[bucket] = self.model.encode(
+                [texts[i] for i in bucket],
+                batch_size=len(bucket),
+                convert_to_numpy=True,
+            )
+        return vectors
 
 embedding_service = EmbeddingService()
@@ -0,0 +1,125 @@
+from typing import List, Optional
+from sqlalchemy import select, func
+from sqlalchemy.engine import Row
+from backend.models.analytics import Embedding
+from backend.models.document import Document
+from backend.rag.vector_index import RETRIEVAL_COLUMNS, generation_filter, project_literal
+import re
+import uuid
+
+# Identifier-like words, snake_case and dotted names included
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+# camelCase / PascalCase / ACRONYMWord parts
+_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+# Candidate symbols in a question: `backticked`, dotted, snake_case, camelCase or called()
+_SYMBOL = re.compile(r"`([^`\s]+)`|([A-Za-z_][\w.]*)(\()?")
+
+# Question words that match half of every chunk
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+    "how", "i", "in", "is", "it", "of", "on", "or", "the", "this", "to", "what", "when",
+    "where", "which", "who", "why", "with", "code", "function", "method", "class", "file",
+}
+
+TEXT_SEARCH_CONFIG = "simple"  # No stemming or stop words, identifiers are not English
+
+def word_terms(word: str) -> List[str]:
+    """
+    Search terms for one identifier: its parts (snake_case and camelCase
+    split, lowercased) plus the whole identifier with separators removed,
+    so `get_file_list`, `getFileList` and "file list" all meet.
+    """
+    parts = [p.lower() for chunk in word.split("_") for p in _PART.findall(chunk)]
+    terms = [p for p in parts if len(p) > 1]
+    joined = "".join(parts)
+    if len(parts) > 1 and joined:
+        terms.append(joined)
+    return terms
+
+def text_terms(text: str) -> List[str]:
+    """
+    Distinct search terms of `text`, in order of first occurrence.
+    """
+    terms = {}
+    for word in _WORD.findall(text):
+        for term in word_terms(word):
+            terms.setdefault(term, None)
+    return list(terms)
+
+def chunk_lexemes(chunk: dict) -> str:
+    """
+    What the chunk's full-text entry is built from (see Embedding.search_vector):
+    its name and content reduced to plain alphanumeric terms, which Postgres'
+    parser keeps as single tokens.
+    """
+    return " ".join(text_terms(f"{chunk.get('name') or ''}\n{chunk.get('content') or ''}"))
+
+def chunk_symbol(chunk: dict) -> Optional[str]:
+    """
+    The identifier a definition chunk is found by, "get_file_list" for
+    "RepoLoader.get_file_list". Whole-file chunks have none.
+    """
+    name = chunk.get("name")
+    if not name or chunk.get("type") == "file_content":
+        return None
+    return name.rsplit(".", 1)[-1]
+
+def query_symbols(query: str) -> List[str]:
+    """
+    Words in a question that look like code identifiers rather than English.
+    """
+    symbols = {}
+    for match in _SYMBOL.finditer(query):
+        quoted, word, called = match.groups()
+        word = (quoted or word).strip(".()")
+        if not word:
+            continue
+        looks_like_code = (
+            quoted or called or "_" in word or "." in word
+            or (any(c.isupper() for c in word[1:]) and any(c.islower() for c in word))
+        )
+        if looks_like_code:
+            symbols.setdefault(word.rsplit(".", 1)[-1], None)
+    return [s for s in symbols if re.fullmatch(r"[A-Za-z_]\w*", s)]
+
+def query_tsquery(query: str) -> Optional[str]:
+    """
+    OR of the question's terms for to_tsquery, ranked by ts_rank_cd so chunks
+    matching more (and name) terms come first. Terms are [a-z0-9] only.
+    """
+    terms = [t for t in text_terms(query) if t not in STOP_WORDS]
+    return " | ".join(terms) if terms else None
+
+async def search_lexical(session, pid: uuid.UUID, query: str, limit: int = 20, generation: Optional[int] = None) -> List[Row]:
+    """
+    Full-text candidates for a project from the GIN-indexed search_vector.
+    """
+    tsquery_text = query_tsquery(query)
+    if not tsquery_text:
+        return []
+    tsquery = func.to_tsquery(TEXT_SEARCH_CONFIG, tsquery_text)
+    stmt = select(*RETRIEVAL_COLUMNS).filter(
+        Embedding.project_id == project_literal(pid),
+        Embedding.search_vector.op("@@")(tsquery),
+    )
+    if generation is not None:
+        stmt = stmt.join(Document, Document.id == Embedding.document_id).filter(*generation_filter(generation))
+    stmt = stmt.order_by(func.ts_rank_cd(Embedding.search_vector, tsquery).desc()).limit(limit)
+    result = await session.execute(stmt)
+    return result.all()
+
+async def search_symbols(session, pid: uuid.UUID, symbols: List[str], limit: int = 5, generation: Optional[int] = None) -> List[Row]:
+    """
+    Chunks defining any of `symbols`, by exact name.
+    """
+    if not symbols:
+        return []
+    stmt = select(*RETRIEVAL_COLUMNS).filter(
+        Embedding.project_id == project_literal(pid),
+        Embedding.symbol.in_(symbols),
+    )
+    if generation is not None:
+        stmt = stmt.join(Document, Document.id == Embedding.document_id).filter(*generation_filter(generation))
+    stmt = stmt.limit(limit)
+    result = await session.execute(stmt)
+    return result.all()
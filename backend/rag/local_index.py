@@ -0,0 +1,278 @@
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import select
+from backend.core.config import settings
+from backend.db.session import get_db
+from backend.models.analytics import Embedding
+from backend.models.document import Document
+from backend.rag.vector_index import generation_filter, project_literal
+import numpy as np
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+
+logger = logging.getLogger(__name__)
+
+BLOCK_ROWS = 65536  # Rows scored per matmul, bounds the float32 scratch space for float16 files
+EXPORT_BATCH = 2000  # Rows fetched per round trip while exporting
+
+def index_nbytes(rows: int, dim: int, dtype: str, meta_bytes: int) -> int:
+    """
+    Memory a LocalVectorIndex of this shape maps: vectors, float32 norms, two
+    16-byte id arrays, int64 offsets and the metadata. The export budget check
+    and eviction both use it, so an index that is exported also stays loaded.
+    """
+    return rows * (dim * np.dtype(dtype).itemsize + 4 + 16 + 16 + 8) + 8 + meta_bytes
+
+class LocalChunk(NamedTuple):
+    """
+    Retrieved chunk served from a local index, shaped like Embedding where
+    retrieval reads it.
+    """
+    id: uuid.UUID
+    document_id: uuid.UUID
+    chunk_metadata: dict
+
+class LocalVectorIndex:
+    """
+    One project generation's vectors in memory-mapped files: a contiguous
+    (n, dim) matrix, their squared norms, the 16-byte row and document ids
+    and the chunk metadata (JSON lines addressed by an offsets array). Search is an exact
+    L2 scan, ||x||^2 - 2 x.q per row in vectorized blocks, the same ordering
+    pgvector's vector_l2_ops gives.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.norms = np.load(os.path.join(path, "norms.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.document_ids = np.load(os.path.join(path, "document_ids.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        # np.memmap refuses empty files
+        self.meta = np.memmap(os.path.join(path, "meta.jsonl"), dtype=np.uint8, mode="r") if self.offsets[-1] else b""
+
+    @property
+    def nbytes(self) -> int:
+        return index_nbytes(len(self), self.vectors.shape[1], self.vectors.dtype, int(self.offsets[-1]))
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def search(self, query_vector, limit: int = 5) -> List[LocalChunk]:
+        if not len(self):
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        limit = min(limit, len(self))
+        best_rows, best_scores = [], []
+        for start in range(0, len(self), BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+            scores = self.norms[start:start + BLOCK_ROWS] - 2.0 * (block @ query)
+            top = np.argpartition(scores, limit - 1)[:limit] if len(scores) > limit else np.arange(len(scores))
+            best_rows.append(top + start)
+            best_scores.append(scores[top])
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        order = np.argsort(scores, kind="stable")[:limit]
+        return [self.chunk(int(i)) for i in rows[order]]
+
+    def chunk(self, row: int) -> LocalChunk:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return LocalChunk(
+            uuid.UUID(bytes=self.ids[row].tobytes()),
+            uuid.UUID(bytes=self.document_ids[row].tobytes()),
+            json.loads(bytes(self.meta[start:end])),
+        )
+
+def write_index(
+    path: str, ids: List[uuid.UUID], vectors: np.ndarray, metadata: List[dict],
+    dtype: str = "float32", document_ids: Optional[List[uuid.UUID]] = None,
+):
+    """
+    Writes an index directory atomically: built next to `path`, then renamed.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix=".export-")
+    try:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        stored = vectors.astype(dtype)
+        np.save(os.path.join(tmp_path, "vectors.npy"), stored)
+        # Norms of the stored (possibly float16) values, so scores stay consistent
+        np.save(os.path.join(tmp_path, "norms.npy"), np.einsum("ij,ij->i", *(stored.astype(np.float32),) * 2))
+        np.save(os.path.join(tmp_path, "ids.npy"), np.array([i.bytes for i in ids], dtype="V16"))
+        document_ids = document_ids or [uuid.UUID(int=0)] * len(ids)
+        np.save(os.path.join(tmp_path, "document_ids.npy"), np.array([i.bytes for i in document_ids], dtype="V16"))
+        offsets = [0]
+        with open(os.path.join(tmp_path, "meta.jsonl"), "wb") as f:
+            for meta in metadata:
+                data = json.dumps(meta).encode("utf-8") + b"\n"
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        np.save(os.path.join(tmp_path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+            # Another process exported the same generation first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+class LocalIndexCache:
+    """
+    Serves vector search for hot projects from LocalVectorIndex files inside
+    the API process, so their chat turns skip the pgvector round trip.
+
+    A project becomes hot after VECTOR_LOCAL_HOT_QUERIES searches in this
+    process; its active generation is then exported in the background
+    (until that finishes, and for cold projects, search() returns None and
+    the caller queries Postgres). Loaded indexes are kept in LRU order
+    within VECTOR_LOCAL_MEMORY_BYTES. Indexes are keyed by generation, so an
+    ingestion that activates a new one makes the old export unreachable;
+    invalidate() also drops it right away.
+    """
+    def __init__(self, directory: Optional[str] = None, budget: Optional[int] = None):
+        self.directory = directory or settings.VECTOR_LOCAL_DIR or os.path.join(tempfile.gettempdir(), "speccraft-vectors")
+        self.budget = budget or settings.VECTOR_LOCAL_MEMORY_BYTES
+        self._resident: "OrderedDict[Tuple[str, int], LocalVectorIndex]" = OrderedDict()
+        self._queries: Dict[str, int] = {}
+        self._exporting: Dict[Tuple[str, int], asyncio.Task] = {}
+        self._too_large = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, pid: str, generation: int) -> str:
+        return os.path.join(self.directory, pid, str(generation))
+
+    def _load(self, pid: str, generation: int) -> Optional[LocalVectorIndex]:
+        key = (pid, generation)
+        index = self._resident.get(key)
+        if index is not None:
+            self._resident.move_to_end(key)
+            return index
+        if not os.path.isdir(self._path(pid, generation)):
+            return None
+        try:
+            index = LocalVectorIndex(self._path(pid, generation))
+        except Exception as e:
+            logger.warning(f"Local vector index for {pid}@{generation} unreadable, dropping it: {e}")
+            shutil.rmtree(self._path(pid, generation), ignore_errors=True)
+            return None
+        if index.nbytes > self.budget:
+            # Exported before the budget shrank (or by a process with a larger one)
+            self._too_large.add(key)
+            shutil.rmtree(self._path(pid, generation), ignore_errors=True)
+            return None
+        self._drop_superseded(pid, generation)
+        self._resident[key] = index
+        self._evict()
+        return self._resident.get(key)
+
+    def _drop_superseded(self, pid: str, generation: int):
+        """
+        Forgets and deletes the project's older generations, which are never
+        read again. Only the finalizing process runs invalidate(), every other
+        API host cleans up here.
+        """
+        for old_key in [k for k in self._resident if k[0] == pid]:
+            self._resident.pop(old_key)
+        project_dir = os.path.join(self.directory, pid)
+        for entry in os.listdir(project_dir):
+            # Newer generations may be exported while a lagging query still reads this one
+            if entry.isdigit() and int(entry) < generation:
+                shutil.rmtree(os.path.join(project_dir, entry), ignore_errors=True)
+
+    def _evict(self):
+        used = sum(index.nbytes for index in self._resident.values())
+        while used > self.budget and self._resident:
+            # Searches still holding the index keep its maps open until they finish
+            _, index = self._resident.popitem(last=False)
+            used -= index.nbytes
+
+    async def search(self, project_id, generation: int, query_vector, limit: int = 5) -> Optional[List[LocalChunk]]:
+        """
+        Nearest chunks from the local index, or None if the project isn't served locally.
+        """
+        pid = str(project_id)
+        index = self._load(pid, generation)
+        if index is None:
+            self.misses += 1
+            self._queries[pid] = self._queries.get(pid, 0) + 1
+            if self._queries[pid] >= settings.VECTOR_LOCAL_HOT_QUERIES:
+                self._schedule_export(pid, generation)
+            return None
+        self.hits += 1
+        return await asyncio.to_thread(index.search, query_vector, limit)
+
+    def _schedule_export(self, pid: str, generation: int):
+        key = (pid, generation)
+        if key in self._exporting or key in self._too_large:
+            return
+        task = asyncio.get_running_loop().create_task(self.export(pid, generation))
+        self._exporting[key] = task
+        task.add_done_callback(lambda _: self._exporting.pop(key, None))
+
+    async def export(self, project_id, generation: int) -> bool:
+        """
+        Writes the rows visible in `generation` to a local index. Returns
+        False when the project doesn't fit the memory budget or the export failed.
+        """
+        pid = str(project_id)
+        ids, document_ids, vectors, metadata = [], [], [], []
+        meta_bytes = 0
+        try:
+            SessionLocal = await get_db()
+            async with SessionLocal() as session:
+                stmt = (
+                    select(Embedding.id, Embedding.document_id, Embedding.vector, Embedding.chunk_metadata)
+                    .join(Document, Document.id == Embedding.document_id)
+                    .filter(Embedding.project_id == project_literal(uuid.UUID(pid)), *generation_filter(generation))
+                    .execution_options(yield_per=EXPORT_BATCH)
+                )
+                result = await session.stream(stmt)
+                async for emb_id, document_id, vector, chunk_metadata in result:
+                    ids.append(emb_id)
+                    document_ids.append(document_id)
+                    vectors.append(np.asarray(vector, dtype=np.float32))
+                    # Rows stored before the text moved out still carry it in chunk_metadata
+                    metadata.append({k: v for k, v in (chunk_metadata or {}).items() if k != "content"})
+                    meta_bytes += len(json.dumps(metadata[-1]).encode("utf-8")) + 1
+                    if index_nbytes(len(ids), len(vectors[0]), settings.VECTOR_LOCAL_DTYPE, meta_bytes) > self.budget:
+                        logger.info(f"Project {pid} exceeds the local vector index budget, serving it from Postgres")
+                        self._too_large.add((pid, generation))
+                        return False
+
+            matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+            await asyncio.to_thread(
+                write_index, self._path(pid, generation), ids, matrix, metadata,
+                settings.VECTOR_LOCAL_DTYPE, document_ids,
+            )
+        except Exception as e:
+            logger.warning(f"Exporting local vector index for {pid}@{generation} failed: {e}")
+            return False
+        logger.info(f"Exported {len(ids)} vectors of project {pid} (generation {generation}) to the local index")
+        return True
+
+    def invalidate(self, project_id):
+        """
+        Drops every local index of the project, resident and on disk.
+        """
+        pid = str(project_id)
+        for key in [k for k in self._resident if k[0] == pid]:
+            self._resident.pop(key)
+        shutil.rmtree(os.path.join(self.directory, pid), ignore_errors=True)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "resident": len(self._resident),
+            "resident_bytes": sum(index.nbytes for index in self._resident.values()),
+        }
+
+local_index_cache = LocalIndexCache()
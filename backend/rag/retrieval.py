@@ -0,0 +1,55 @@
+from typing import List, Optional, Sequence
+from backend.core.config import settings
+from sqlalchemy.engine import Row
+from backend.rag.lexical import query_symbols, search_lexical, search_symbols
+from backend.rag.local_index import local_index_cache
+from backend.rag.vector_index import search_embeddings
+import uuid
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Row]], k: Optional[int] = None, limit: int = 5) -> List[Row]:
+    """
+    Merges ranked candidate lists by sum of 1 / (k + rank): chunks that
+    several retrievers rank highly come first, and no retriever's raw
+    scores (distances, ts_rank) have to be comparable with another's.
+    """
+    k = settings.RETRIEVAL_RRF_K if k is None else k
+    scores, chunks = {}, {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking):
+            scores[chunk.id] = scores.get(chunk.id, 0.0) + 1.0 / (k + rank + 1)
+            chunks.setdefault(chunk.id, chunk)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [chunks[chunk_id] for chunk_id in ordered[:limit]]
+
+async def search_vectors(session, pid: uuid.UUID, query_vector, limit: int = 5, generation: Optional[int] = None):
+    """
+    Vector leg of retrieval: the in-process index for hot projects
+    (VECTOR_LOCAL_INDEX), pgvector otherwise.
+    """
+    if settings.VECTOR_LOCAL_INDEX and generation is not None:
+        hits = await local_index_cache.search(pid, generation, query_vector, limit)
+        if hits is not None:
+            return hits
+    return await search_embeddings(session, pid, query_vector, limit=limit, generation=generation)
+
+async def retrieve(session, pid: uuid.UUID, query: str, query_vector, limit: int = 5, generation: Optional[int] = None) -> List[Row]:
+    """
+    Context chunks for a question. A question naming a symbol the project
+    defines is answered from those definitions without a vector search;
+    otherwise vector and full-text candidates are fused (RETRIEVAL_HYBRID),
+    so exact identifiers the embedding model blurs still surface.
+    """
+    if settings.RETRIEVAL_SYMBOL_FAST_PATH:
+        symbols = query_symbols(query)
+        if symbols:
+            hits = await search_symbols(session, pid, symbols, limit=limit, generation=generation)
+            if hits:
+                return hits
+
+    if not settings.RETRIEVAL_HYBRID:
+        return await search_vectors(session, pid, query_vector, limit=limit, generation=generation)
+
+    candidates = max(settings.RETRIEVAL_CANDIDATES, limit)
+    vector_hits = await search_vectors(session, pid, query_vector, limit=candidates, generation=generation)
+    lexical_hits = await search_lexical(session, pid, query, limit=candidates, generation=generation)
+    return reciprocal_rank_fusion([vector_hits, lexical_hits], limit=limit)
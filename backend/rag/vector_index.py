@@ -0,0 +1,184 @@
+from typing import List, Optional
+from pgvector.sqlalchemy import BIT, HALFVEC, Vector
+from sqlalchemy.engine import Row
+from sqlalchemy import Float, cast, literal, select, func, or_, text, literal_column
+from backend.core.cache import LRUCache
+from backend.core.config import settings
+from backend.db import session as db_session
+from backend.models.analytics import Embedding
+from backend.models.document import Document
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_INDEX_NAME = "ix_embeddings_vector_hnsw"
+VECTOR_DIM = Embedding.vector.type.dim
+
+# (project, quantization) -> whether its partial index exists. Projects only
+# grow into one, a stale "no" costs an exact scan until it expires.
+_project_indexes = LRUCache(4096, ttl=300)
+
+# What retrievers return per chunk: never the vector, and no text, which is
+# loaded only for the chunks that make it into a prompt (see rag.chunks)
+RETRIEVAL_COLUMNS = (Embedding.id, Embedding.document_id, Embedding.chunk_metadata)
+
+# First-stage representations searched by the HNSW index: (indexed
+# expression, operator class). The heap keeps full-precision vectors,
+# which rerank the candidates (see search_embeddings).
+QUANTIZATIONS = {
+    "": ("vector", "vector_l2_ops"),
+    "halfvec": (f"(vector::halfvec({VECTOR_DIM}))", "halfvec_l2_ops"),  # 2 bytes per dimension
+    "bit": (f"(binary_quantize(vector)::bit({VECTOR_DIM}))", "bit_hamming_ops"),  # 1 bit per dimension
+}
+
+def index_name(base: str, quantization: str = "") -> str:
+    return f"{base}_{quantization}" if quantization else base
+
+def project_index_name(pid: uuid.UUID, quantization: str = "") -> str:
+    return index_name(f"{GLOBAL_INDEX_NAME}_{pid.hex}", quantization)
+
+def project_literal(pid: uuid.UUID):
+    """
+    project_id as an inline SQL literal. Partial indexes are only matched by
+    the planner against constants; a bind parameter gets a generic plan that
+    can't use them. Safe because `pid` is always a parsed uuid.UUID.
+    """
+    return literal_column(f"'{uuid.UUID(str(pid))}'::uuid")
+
+def hnsw_index_ddl(name: str, where: Optional[str] = None, concurrently: bool = False, quantization: str = "") -> str:
+    expression, opclass = QUANTIZATIONS[quantization]
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} "
+        f"ON embeddings USING hnsw ({expression} {opclass}) "
+        f"WITH (m = {int(settings.VECTOR_INDEX_M)}, ef_construction = {int(settings.VECTOR_INDEX_EF_CONSTRUCTION)})"
+        + (f" WHERE {where}" if where else "")
+    )
+
+async def ensure_project_index(project_id) -> bool:
+    """
+    Gives large projects their own partial HNSW index. With one global index
+    a project-filtered query walks neighbours from every tenant and discards
+    most of them; a partial index only contains the project's own vectors.
+    Small projects are served by the project_id btree plus an exact sort.
+    Returns True if the project has a dedicated index.
+    """
+    pid = uuid.UUID(str(project_id))
+    SessionLocal = await db_session.get_db()
+    async with SessionLocal() as session:
+        count = await session.scalar(
+            select(func.count()).select_from(Embedding).filter(Embedding.project_id == pid)
+        )
+    if not count or count < settings.VECTOR_PROJECT_INDEX_MIN_ROWS:
+        return False
+
+    quantization = settings.VECTOR_QUANTIZATION
+    logger.info(f"Building partial HNSW index for project {pid} ({count} vectors, {quantization or 'full precision'})")
+    # CONCURRENTLY can't run in a transaction block, and keeps writes to
+    # other projects flowing while the index builds
+    async with db_session.engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text(hnsw_index_ddl(
+            project_index_name(pid, quantization),
+            where=f"project_id = '{pid}'::uuid",
+            concurrently=True,
+            quantization=quantization,
+        )))
+    _project_indexes.set((pid, quantization), True)
+    return True
+
+async def has_project_index(session, pid: uuid.UUID, quantization: str = "") -> bool:
+    key = (pid, quantization)
+    found = _project_indexes.get(key)
+    if found is None:
+        result = await session.execute(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": project_index_name(pid, quantization)}
+        )
+        found = bool(result.scalar())
+        _project_indexes.set(key, found)
+    return found
+
+def first_stage_distance(query_vector, quantization: str):
+    """
+    Distance in the quantized representation, spelled exactly like the
+    indexed expression so the planner can use the index.
+    """
+    # Parameters are cast explicitly, binary_quantize() is overloaded for vector and halfvec
+    query = cast(literal(query_vector, Vector(VECTOR_DIM)), Vector(VECTOR_DIM))
+    if quantization == "halfvec":
+        return cast(Embedding.vector, HALFVEC(VECTOR_DIM)).op("<->", return_type=Float)(
+            cast(query, HALFVEC(VECTOR_DIM))
+        )
+    if quantization == "bit":
+        return cast(func.binary_quantize(Embedding.vector), BIT(VECTOR_DIM)).op("<~>", return_type=Float)(
+            cast(func.binary_quantize(query), BIT(VECTOR_DIM))
+        )
+    raise ValueError(f"Unknown vector quantization {quantization!r}")
+
+def generation_filter(generation: int):
+    """
+    Criteria for rows visible in index `generation`: written by it or an
+    earlier one, and not retired by it or an earlier one. Needs Document joined.
+    """
+    return (
+        Embedding.generation <= generation,
+        or_(Document.retired_generation.is_(None), Document.retired_generation > generation),
+    )
+
+async def search_embeddings(
+    session,
+    pid: uuid.UUID,
+    query_vector,
+    limit: int = 5,
+    generation: Optional[int] = None,
+    quantization: Optional[str] = None,
+    candidates: Optional[int] = None,
+) -> List[Row]:
+    """
+    Nearest chunks (RETRIEVAL_COLUMNS) for a project, filtered on the denormalized
+    Embedding.project_id so the project's partial index applies. With
+    `generation` only that index generation's rows are returned (see
+    IngestionPipeline), which costs a primary key lookup per candidate.
+
+    With a quantization (VECTOR_QUANTIZATION by default) the index is
+    searched in the compact form for `candidates` (VECTOR_RERANK_CANDIDATES
+    by default) rows, which are then reordered by their full-precision
+    distance.
+
+    Projects without a partial index (below VECTOR_PROJECT_INDEX_MIN_ROWS)
+    get an exact scan of their rows: through the global index the filter
+    would drop other tenants' neighbours and could leave fewer than `limit`.
+    """
+    quantization = settings.VECTOR_QUANTIZATION if quantization is None else quantization
+    if not await has_project_index(session, pid, quantization):
+        stmt = select(*RETRIEVAL_COLUMNS).filter(Embedding.project_id == project_literal(pid))
+        if generation is not None:
+            stmt = stmt.join(Document, Document.id == Embedding.document_id).filter(*generation_filter(generation))
+        # Not the indexed `vector <-> query` expression, so the planner reads
+        # the project's rows through the project_id btree and sorts them
+        exact_distance = Embedding.vector.l2_distance(query_vector) + 0
+        return (await session.execute(stmt.order_by(exact_distance).limit(limit))).all()
+
+    candidates = settings.VECTOR_RERANK_CANDIDATES if candidates is None else candidates
+    candidates = max(candidates, limit) if quantization else limit
+    # SET LOCAL only lasts for the current transaction and can't take bind params
+    await session.execute(text(f"SET LOCAL hnsw.ef_search = {int(max(settings.VECTOR_EF_SEARCH, candidates))}"))
+    if settings.VECTOR_ITERATIVE_SCAN:
+        # pgvector >= 0.8: keep scanning the graph until the filter yields `limit` rows
+        await session.execute(text("SELECT set_config('hnsw.iterative_scan', :mode, true)"), {"mode": settings.VECTOR_ITERATIVE_SCAN})
+
+    # The quantized first stage only needs ids, the rerank reads the rest
+    columns = (Embedding.id,) if quantization else RETRIEVAL_COLUMNS
+    stmt = select(*columns).filter(
+        Embedding.project_id == project_literal(pid)
+    )
+    if generation is not None:
+        stmt = stmt.join(Document, Document.id == Embedding.document_id).filter(*generation_filter(generation))
+    if quantization:
+        first_stage = stmt.order_by(first_stage_distance(query_vector, quantization)).limit(candidates).subquery()
+        stmt = select(*RETRIEVAL_COLUMNS).join(first_stage, first_stage.c.id == Embedding.id)
+    stmt = stmt.order_by(
+        Embedding.vector.l2_distance(query_vector)
+    ).limit(limit)
+    result = await session.execute(stmt)
+    return result.all()
@@ -12,6 +12,13 @@ if not os.getenv("SUPABASE_URL"):
 if not os.getenv("SUPABASE_KEY"):
     os.environ["SUPABASE_KEY"] = "mock-key"
 
+# Tests never download models; tokenizer lookups fall back instead of retrying the Hub
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+# No Postgres behind the chunk embedding cache here, tests that need it enable it explicitly
+os.environ.setdefault("EMBED_CACHE", "false")
+# Nor behind the interrupted-job watchdog the app would start
+os.environ.setdefault("INGEST_RESUME_ON_STARTUP", "false")
+
 from backend.main import app
 from backend.api import deps
 from unittest.mock import MagicMock, AsyncMock, patch
@@ -43,6 +50,8 @@ def mock_db_session():
     mock_result.scalars.return_value.first.return_value = None
     mock_session.execute.return_value = mock_result
     mock_session.get.return_value = None
+    # Session.add() is synchronous on AsyncSession too
+    mock_session.add = MagicMock()
     
     # Mock context manager
     mock_session_factory = MagicMock()
@@ -18,3 +18,27 @@ def test_read_projects_authorized(client):
     """
     response = client.get("/api/v1/projects/")
     assert response.status_code == status.HTTP_200_OK
+
+def test_snippet_unauthorized(unauth_client):
+    import uuid
+    response = unauth_client.get(f"/api/v1/chat/snippets/{uuid.uuid4()}?project_id={uuid.uuid4()}")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_snippet_of_another_users_project_is_forbidden(client, mock_db_session):
+    from unittest.mock import patch, AsyncMock, MagicMock
+    import uuid
+
+    session = mock_db_session.return_value.__aenter__.return_value
+    session.get.return_value = MagicMock(id=uuid.uuid4(), owner_id=uuid.uuid4())
+    with patch("backend.api.v1.endpoints.chat.get_db", AsyncMock(return_value=mock_db_session)):
+        response = client.get(f"/api/v1/chat/snippets/{uuid.uuid4()}?project_id={uuid.uuid4()}")
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+def test_cache_stats_require_auth(unauth_client):
+    response = unauth_client.get("/stats")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_cache_stats_authorized(client):
+    response = client.get("/stats")
+    assert response.status_code == status.HTTP_200_OK
+    assert "answer_cache" in response.json()
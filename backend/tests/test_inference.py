@@ -12,3 +12,70 @@ def test_chat_endpoint_exists(client):
     
     # Should return 422 (validation error) since fields are required
     assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+@pytest.mark.asyncio
+async def test_agenerate_stream_bridges_tokens_off_the_loop():
+    """
+    Tokens from the blocking generator reach the async consumer in order,
+    and the generator runs on the engine's executor rather than the loop thread.
+    """
+    import threading
+    from backend.inference.engine import InferenceEngine
+
+    engine = InferenceEngine()
+    threads = set()
+
+    def fake_stream(prompt, max_tokens=512):
+        threads.add(threading.current_thread().name)
+        yield from ["Hello", ", ", "world"]
+
+    with patch.object(engine, "generate_stream", fake_stream):
+        tokens = [t async for t in engine.agenerate_stream("hi")]
+
+    assert tokens == ["Hello", ", ", "world"]
+    assert threads and all(name.startswith("inference") for name in threads)
+
+@pytest.mark.asyncio
+async def test_agenerate_stream_propagates_errors():
+    from backend.inference.engine import InferenceEngine
+
+    engine = InferenceEngine()
+
+    def failing_stream(prompt, max_tokens=512):
+        yield "partial"
+        raise RuntimeError("model crashed")
+
+    with patch.object(engine, "generate_stream", failing_stream):
+        received = []
+        with pytest.raises(RuntimeError, match="model crashed"):
+            async for token in engine.agenerate_stream("hi"):
+                received.append(token)
+    assert received == ["partial"]
+
+def test_pack_context_dedups_diversifies_and_fits_budget():
+    from types import SimpleNamespace
+    from backend.inference import context
+
+    def chunk(doc, start, end, content):
+        return SimpleNamespace(id=object(), document_id=doc, chunk_metadata={
+            "content": content, "start_line": start, "end_line": end,
+        })
+
+    top = chunk("a.py", 0, 20, "def load_repo(path): clone repo path")
+    window = chunk("a.py", 15, 25, "def load_repo(path): clone repo path again")  # 6 of 11 lines already in
+    near_copy = chunk("b.py", 0, 5, "def load_repo(path): clone repo path")
+    other = chunk("c.py", 0, 5, "def parse_tree(node): walk children")
+    huge = chunk("d.py", 0, 500, "x " * 500)
+    count = MagicMock(side_effect=lambda text: len(text.split()))
+
+    chunks = [top, window, near_copy, other, huge]
+    texts = {c.id: c.chunk_metadata.pop("content") for c in chunks}
+
+    # The duplicate window is dropped, the distinct chunk beats the near copy, the huge one doesn't fit
+    candidates = context.drop_overlapping(chunks)
+    assert window not in candidates
+    packed = context.pack_context(candidates, texts, budget=20, count_tokens=count, tokenizer="t")
+    assert packed == [top, other, near_copy]
+    calls = count.call_count
+    context.pack_context([top, other], texts, budget=20, count_tokens=count, tokenizer="t")
+    assert count.call_count == calls  # token counts come from the cache
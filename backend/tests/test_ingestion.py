@@ -0,0 +1,696 @@
+import pytest
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, AsyncMock, patch
+from backend.ingestion.pipeline import IngestionPipeline
+import numpy as np
+import uuid
+import os
+
+def fake_chunk_file(file_path, known_hash=None):
+    if file_path.endswith(".bin"):
+        return file_path, None, []
+    if file_path.endswith(".bad"):
+        raise ValueError("boom")
+    content_hash = "same" if "same" in file_path else f"hash-{file_path}"
+    if content_hash == known_hash:
+        return file_path, content_hash, None
+    return file_path, content_hash, [
+        {"type": "function_definition", "name": "a", "content": f"def a(): # {file_path}", "start_line": 0, "end_line": 0},
+        {"type": "function_definition", "name": "b", "content": "def b(): pass", "start_line": 1, "end_line": 1},
+    ]
+
+@pytest.mark.asyncio
+async def test_pipeline_parses_embeds_and_writes(mock_db_session):
+    """
+    Every parseable file becomes one Document plus one Embedding per chunk,
+    and failures in the parse stage don't take the run down.
+    """
+    files = [f"/repo/file_{i}.py" for i in range(25)] + ["/repo/blob.bin", "/repo/broken.bad"]
+    pipeline = IngestionPipeline(parse_workers=2, queue_size=2, commit_every=10)
+    mock_embed = MagicMock(side_effect=lambda texts: np.zeros((len(texts), 384), dtype=np.float32))
+    mock_copy = AsyncMock()
+
+    with patch.object(pipeline, "_make_executor", return_value=ThreadPoolExecutor(max_workers=2)), \
+         patch("backend.ingestion.pipeline.chunk_file", fake_chunk_file), \
+         patch("backend.ingestion.pipeline.embedding_service.embed_batch", mock_embed), \
+         patch("backend.ingestion.pipeline.get_db", AsyncMock(return_value=mock_db_session)), \
+         patch("backend.db.bulk.BulkWriter._copy", mock_copy), \
+         patch.object(pipeline, "finalize", AsyncMock()) as mock_finish:
+        project_id = str(uuid.uuid4())
+        stats = await pipeline.run(files, project_id, generation=4)
+
+    assert stats == {
+        "files": 27, "scanned": 27, "parsed": 25, "embedded": 50, "chunks": 50,
+        "errors": 1, "unchanged": 0, "removed": 0, "stage": "writing", "skipped": {},
+    }
+    copied = {}
+    for call in mock_copy.await_args_list:
+        table, _, rows = call.args
+        copied[table] = copied.get(table, 0) + len(rows)
+    assert copied == {"documents": 25, "embeddings": 50}
+    session = mock_db_session.return_value.__aenter__.return_value
+    # Two full windows plus the final commit
+    assert session.commit.await_count == 3
+    # The pointer flips to the new generation once, after the data is in
+    mock_finish.assert_awaited_once_with(project_id, 4, replace=True)
+    doc_rows = [row for call in mock_copy.await_args_list if call.args[0] == "documents" for row in call.args[2]]
+    assert {row[-1] for row in doc_rows} == {4}
+
+@pytest.mark.asyncio
+async def test_pipeline_reports_the_furthest_stage_while_parsing_continues(mock_db_session):
+    import threading
+
+    first_write = threading.Event()
+
+    def slow_chunk_file(file_path, known_hash=None):
+        if file_path.endswith("slow.py"):
+            first_write.wait(timeout=5)
+        return fake_chunk_file(file_path, known_hash)
+
+    seen = []
+
+    async def checkpoint(session):
+        seen.append((stats["stage"], stats["scanned"]))
+        first_write.set()
+
+    stats = {}
+    pipeline = IngestionPipeline(parse_workers=2, queue_size=2, commit_every=1, embed_buffer=1)
+    with patch.object(pipeline, "_make_executor", return_value=ThreadPoolExecutor(max_workers=2)), \
+         patch("backend.ingestion.pipeline.chunk_file", slow_chunk_file), \
+         patch("backend.ingestion.pipeline.embedding_service.embed_batch", lambda texts: np.zeros((len(texts), 384), dtype=np.float32)), \
+         patch("backend.ingestion.pipeline.get_db", AsyncMock(return_value=mock_db_session)), \
+         patch("backend.db.bulk.BulkWriter._copy", AsyncMock()), \
+         patch.object(pipeline, "finalize", AsyncMock()):
+        await pipeline.run(["/repo/fast.py", "/repo/slow.py"], str(uuid.uuid4()), stats=stats, checkpoint=checkpoint, generation=1)
+
+    # The first file was being written while the second was still parsing
+    assert seen[0] == ("writing", 1)
+    assert stats["stage"] == "writing"
+
+@pytest.mark.asyncio
+async def test_pipeline_buffers_chunks_across_files(mock_db_session):
+    files = [f"/repo/file_{i}.py" for i in range(10)]
+    pipeline = IngestionPipeline(parse_workers=2, queue_size=4, embed_buffer=8)
+    mock_embed = MagicMock(side_effect=lambda texts: np.zeros((len(texts), 384), dtype=np.float32))
+
+    with patch.object(pipeline, "_make_executor", return_value=ThreadPoolExecutor(max_workers=2)), \
+         patch("backend.ingestion.pipeline.chunk_file", fake_chunk_file), \
+         patch("backend.ingestion.pipeline.embedding_service.embed_batch", mock_embed), \
+         patch("backend.ingestion.pipeline.get_db", AsyncMock(return_value=mock_db_session)), \
+         patch("backend.db.bulk.BulkWriter._copy", AsyncMock()), \
+         patch("backend.ingestion.pipeline.ensure_project_index", AsyncMock()):
+        stats = await pipeline.run(files, str(uuid.uuid4()), generation=1)
+
+    assert stats["chunks"] == 20
+    # 4 files (8 chunks) per encode call, remainder flushed at the end
+    assert [len(call.args[0]) for call in mock_embed.call_args_list] == [8, 8, 4]
+
+@pytest.mark.asyncio
+async def test_pipeline_sync_skips_unchanged_and_drops_stale(mock_db_session):
+    stale_id, same_id, changed_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    known_docs = {
+        "/repo/gone.py": (stale_id, "old"),
+        "/repo/same.py": (same_id, "same"),
+        "/repo/changed.py": (changed_id, "old"),
+    }
+    files = ["/repo/same.py", "/repo/changed.py", "/repo/new.py"]
+    pipeline = IngestionPipeline(parse_workers=2)
+    mock_embed = MagicMock(side_effect=lambda texts: np.zeros((len(texts), 384), dtype=np.float32))
+    mock_retire = AsyncMock()
+
+    with patch.object(pipeline, "_make_executor", return_value=ThreadPoolExecutor(max_workers=2)), \
+         patch.object(pipeline, "load_known_docs", AsyncMock(return_value=known_docs)), \
+         patch.object(pipeline, "_retire_documents", mock_retire), \
+         patch("backend.ingestion.pipeline.chunk_file", fake_chunk_file), \
+         patch("backend.ingestion.pipeline.embedding_service.embed_batch", mock_embed), \
+         patch("backend.ingestion.pipeline.get_db", AsyncMock(return_value=mock_db_session)), \
+         patch("backend.db.bulk.BulkWriter._copy", AsyncMock()), \
+         patch("backend.ingestion.pipeline.ensure_project_index", AsyncMock()):
+        stats = await pipeline.sync(files, str(uuid.uuid4()), generation=3)
+
+    assert stats["unchanged"] == 1
+    assert stats["parsed"] == 2
+    assert stats["deleted"] == 1
+    # Replaced rows are only retired by the new generation, live queries keep seeing them
+    retired = [call.args[1:] for call in mock_retire.await_args_list]
+    assert ([stale_id], 3) in retired
+    assert ([changed_id], 3) in retired
+    assert not any(same_id in ids for ids, _ in retired)
+
+def test_repo_loader_sync_reports_changes(tmp_path):
+    import git
+    from backend.ingestion.parser import chunk_blob
+    from backend.ingestion.repo_loader import RepoLoader, read_blob
+
+    origin = git.Repo.init(tmp_path / "origin")
+    origin.config_writer().set_value("user", "name", "test").release()
+    origin.config_writer().set_value("user", "email", "test@example.com").release()
+    for name in ("keep.py", "edit.py", "drop.py"):
+        (tmp_path / "origin" / name).write_text(f"# {name}\n")
+    origin.index.add(["keep.py", "edit.py", "drop.py"])
+    origin.index.commit("initial")
+
+    loader = RepoLoader(storage_path=str(tmp_path / "store"))
+    url = (tmp_path / "origin").as_uri()
+    repo_path, changes = loader.sync_repo(url, "proj")
+    assert changes is None
+    first = loader.get_head_commit(repo_path)
+
+    (tmp_path / "origin" / "edit.py").write_text("# edited\n")
+    (tmp_path / "origin" / "add.py").write_text("# added\n")
+    origin.index.add(["edit.py", "add.py"])
+    origin.index.remove(["drop.py"], working_tree=True)
+    origin.index.commit("second")
+
+    expected = {
+        "added": [os.path.join(tmp_path / "store" / "proj", "add.py")],
+        "modified": [os.path.join(tmp_path / "store" / "proj", "edit.py")],
+        "deleted": [os.path.join(tmp_path / "store" / "proj", "drop.py")],
+    }
+    assert loader.sync_repo(url, "proj", base_commit=first)[1] == expected
+    # The sync that moved HEAD failed: the next one still diffs from the last ingested commit
+    repo_path, changes = loader.sync_repo(url, "proj", base_commit=first)
+    assert changes == expected
+    # Nothing known to diff against, every file gets compared
+    assert loader.sync_repo(url, "proj")[1] is None
+    # No working tree is materialized, content comes from the object database
+    assert not os.path.exists(os.path.join(repo_path, "edit.py"))
+    blobs = loader.list_blobs(repo_path)
+    assert sorted(os.path.basename(p) for p in blobs) == ["add.py", "edit.py", "keep.py"]
+    edit = os.path.join(repo_path, "edit.py")
+    assert read_blob(repo_path, blobs[edit][0]) == b"# edited\n"
+
+    _, content_hash, chunks = chunk_blob(edit, repo_path, blobs[edit][0])
+    assert chunks[0]["content"] == "# edited\n"
+    assert chunk_blob(edit, repo_path, blobs[edit][0], known_hash=content_hash)[2] is None
+
+def test_repo_mirror_is_shared_and_evicted(tmp_path):
+    import git
+    from backend.ingestion.repo_loader import RepoLoader, mirror_key, normalize_repo_url, read_blob
+
+    assert normalize_repo_url("git@GitHub.com:Org/Repo.git") == "ssh://git@github.com/Org/Repo"
+    assert mirror_key("https://GitHub.com/org/repo.git/") == mirror_key("https://github.com/org/repo")
+
+    origin = git.Repo.init(tmp_path / "origin")
+    origin.config_writer().set_value("user", "name", "test").release()
+    origin.config_writer().set_value("user", "email", "test@example.com").release()
+    (tmp_path / "origin" / "a.py").write_text("# a\n")
+    origin.index.add(["a.py"])
+    origin.index.commit("initial")
+
+    loader = RepoLoader(storage_path=str(tmp_path / "store"))
+    url = (tmp_path / "origin").as_uri()
+    with patch("git.Repo.clone_from", wraps=git.Repo.clone_from) as clone_from:
+        first = loader.clone_repo(url, "p1")
+        second = loader.clone_repo(url + "/", "p2")
+
+    # One network clone into the mirror, then two local clones from it
+    remote_clones = [c for c in clone_from.call_args_list if c.args[0].startswith("file:")]
+    assert len(remote_clones) == 1
+    assert git.Repo(first).head.commit == git.Repo(second).head.commit
+    assert git.Repo(second).remotes.origin.url == url + "/"
+
+    with patch("backend.ingestion.repo_loader.settings.REPO_MIRROR_CACHE_BYTES", 0):
+        loader.evict_mirrors()
+    assert not os.path.exists(os.path.join(loader.mirror_path, mirror_key(url)))
+    # Checkouts don't depend on the evicted mirror
+    blob_sha, _ = loader.list_blobs(second)[os.path.join(second, "a.py")]
+    assert read_blob(second, blob_sha) == b"# a\n"
+
+def test_concurrent_mirror_requests_share_one_fetch(tmp_path):
+    import threading
+    import git
+    from backend.ingestion.repo_loader import RepoLoader
+
+    origin = git.Repo.init(tmp_path / "origin")
+    origin.config_writer().set_value("user", "name", "test").release()
+    origin.config_writer().set_value("user", "email", "test@example.com").release()
+    (tmp_path / "origin" / "a.py").write_text("# a\n")
+    origin.index.add(["a.py"])
+    origin.index.commit("initial")
+    loader = RepoLoader(storage_path=str(tmp_path / "store"))
+    url = (tmp_path / "origin").as_uri()
+    with loader.mirror(url):
+        pass
+
+    fetching, release, fetches = threading.Event(), threading.Event(), []
+    call_process = git.cmd.Git._call_process
+
+    def slow_fetch(self, method, *args, **kwargs):
+        if method == "fetch":
+            fetches.append(args)
+            fetching.set()
+            release.wait(5)
+        return call_process(self, method, *args, **kwargs)
+
+    def use_mirror():
+        with loader.mirror(url):
+            pass
+
+    # Set once a caller has asked (taken its request time) and queues for the lock
+    asking = threading.Event()
+    file_lock = loader._file_lock
+
+    def signalling_lock(*args, **kwargs):
+        asking.set()
+        return file_lock(*args, **kwargs)
+
+    with patch.object(git.cmd.Git, "_call_process", slow_fetch):
+        first = threading.Thread(target=use_mirror)
+        first.start()
+        assert fetching.wait(5)
+        # Asks while the first fetch is running, and waits for it instead of fetching again
+        with patch.object(loader, "_file_lock", signalling_lock):
+            second = threading.Thread(target=use_mirror)
+            second.start()
+            assert asking.wait(5)
+        release.set()
+        first.join(5)
+        second.join(5)
+    assert len(fetches) == 1
+
+def test_file_filter_rules(tmp_path):
+    import git
+    from backend.ingestion.filters import FileFilter, sniff
+    from backend.ingestion.repo_loader import RepoLoader
+
+    tree = {
+        ".gitignore": "*.log\nbuild/\n!keep.log\n",
+        ".speccraftignore": "docs/generated/**\n",
+        "src/app.py": "print('hi')\n",
+        "src/.env": "SECRET=1\n",
+        "src/debug.log": "noise\n",
+        "keep.log": "kept\n",
+        "build/out.py": "x = 1\n",
+        "docs/generated/api.py": "x = 1\n",
+        "node_modules/lib/index.js": "module.exports = 1\n",
+        "web/app.min.js": "var a=1;\n",
+        "api/service.pb.go": "package api\n",
+        "web/sub/.gitignore": "/local.js\n",
+        "web/sub/local.js": "x\n",
+        "web/sub/main.js": "x\n",
+        "big.py": "x" * 2048,
+    }
+    for rel, text in tree.items():
+        (tmp_path / rel).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / rel).write_text(text)
+
+    skipped = {}
+    with patch("backend.ingestion.filters.settings.INGEST_MAX_FILE_BYTES", 1024):
+        files = RepoLoader(storage_path=str(tmp_path / ".store")).get_file_list(str(tmp_path), skipped)
+    assert sorted(os.path.relpath(f, tmp_path) for f in files) == ["keep.log", "src/app.py", "web/sub/main.js"]
+    assert skipped == {
+        "hidden": 4, "ignored": 3, "ignored_dirs": 1, "vendored_dirs": 1,
+        "minified": 1, "generated": 1, "too_large": 1,
+    }
+
+    # The object-database listing applies the same rules, counting files
+    repo = git.Repo.init(tmp_path)
+    repo.git.add("-f", "--", *tree)
+    repo.git.commit("-m", "tree", author="t <t@example.com>", env={"GIT_COMMITTER_NAME": "t", "GIT_COMMITTER_EMAIL": "t@example.com"})
+    skipped = {}
+    with patch("backend.ingestion.filters.settings.INGEST_MAX_FILE_BYTES", 1024):
+        blobs = RepoLoader(storage_path=str(tmp_path / ".store")).list_blobs(str(tmp_path), skipped=skipped)
+    assert sorted(os.path.relpath(f, tmp_path) for f in blobs) == ["keep.log", "src/app.py", "web/sub/main.js"]
+    assert skipped["vendored"] == 1 and skipped["ignored"] == 4
+
+    assert sniff(b"\x89PNG\r\n\x1a\n\0\0") == "binary"
+    assert sniff(b"// Code generated by protoc-gen-go. DO NOT EDIT.\npackage api\n") == "generated"
+    assert sniff(b"var a=1;" * 2000) == "minified"
+    assert sniff(b"def f():\n    return 1\n") is None
+    assert FileFilter().path_reason("third_party/zlib/zlib.c") == "vendored"
+
+def test_split_text_windows_keep_line_spans():
+    from backend.ingestion.chunking import split_text
+
+    lines = [f"value_{i} = compute({i}, {i + 1})" for i in range(40)]  # 8 tokens per line
+    text = "\n".join(lines) + "\n"
+    windows = split_text(text, start_line=10, max_tokens=40, overlap=8)
+
+    assert len(windows) > 1
+    for content, start, end in windows:
+        # Windows are whole lines and their spans point at exactly those lines
+        assert content.rstrip("\n").split("\n") == lines[start - 10:end - 10 + 1]
+    assert windows[0][1] == 10 and windows[-1][2] == 49
+    # Consecutive windows overlap by a line
+    assert all(b[1] == a[2] for a, b in zip(windows, windows[1:]))
+    assert split_text("x = 1\n", max_tokens=40) == [("x = 1\n", 0, 0)]
+
+def test_large_class_is_split_at_methods():
+    from backend.ingestion.chunking import get_token_counter
+    from backend.ingestion.parser import CodeParser
+
+    methods = "\n".join(
+        f"    def method_{i}(self, a, b):\n        return self.value + a * b + {i}\n" for i in range(6)
+    )
+    source = f"class Service:\n    \"\"\"Does things.\"\"\"\n    value = 1\n\n{methods}".encode()
+
+    counter = get_token_counter()
+    with patch.object(counter, "_max_tokens", 40):
+        chunks = CodeParser().chunk_content(source, "service.py")
+
+    names = [c["name"] for c in chunks]
+    assert names == ["Service"] + [f"Service.method_{i}" for i in range(6)]
+    assert chunks[0]["content"].startswith("class Service:") and "value = 1" in chunks[0]["content"]
+    lines = source.decode().splitlines()
+    for chunk in chunks[1:]:
+        assert lines[chunk["start_line"]].strip().startswith("def " + chunk["name"].split(".")[1])
+        assert chunk["content"] == "\n".join(lines[chunk["start_line"]:chunk["end_line"] + 1]).strip()
+
+@pytest.mark.parametrize("file_name, source, expected", [
+    ("a.py", "@cache\ndef load():\n    pass\n\nclass Repo:\n    def get(self):\n        pass\n",
+     [("function_definition", "load"), ("class_definition", "Repo")]),
+    ("a.js", "function main() {}\nclass Store { get() {} }\nconst handler = () => 1;\n",
+     [("function_declaration", "main"), ("class_declaration", "Store"), ("lexical_declaration", "handler")]),
+    ("a.ts", "interface Shape { area(): number }\nexport class Circle { area() { return 1; } }\n",
+     [("interface_declaration", "Shape"), ("class_declaration", "Circle")]),
+    ("a.tsx", "export function App() { return <div>hi</div>; }\n",
+     [("function_declaration", "App")]),
+    ("a.go", "package main\ntype Server struct{}\nfunc (s *Server) Run() {}\nfunc main() {}\n",
+     [("type_declaration", "Server"), ("method_declaration", "Run"), ("function_declaration", "main")]),
+    ("a.rs", "struct Point { x: i32 }\nimpl Point { fn norm(&self) -> i32 { self.x } }\nfn main() {}\n",
+     [("struct_item", "Point"), ("impl_item", "Point"), ("function_item", "main")]),
+    ("A.java", "public class Greeter {\n  public Greeter() {}\n  void greet() {}\n}\n",
+     [("class_declaration", "Greeter")]),
+    ("a.c", "struct node { int v; };\nstatic char *name(void) { return 0; }\nint main(void) { return 0; }\n",
+     [("struct_specifier", "node"), ("function_definition", "name"), ("function_definition", "main")]),
+    ("a.cpp", "namespace app {\nclass Engine { void start() {} };\n}\nint Engine::stop() { return 0; }\n",
+     [("namespace_definition", "app"), ("function_definition", "Engine::stop")]),
+])
+def test_definition_queries_cover_every_language(file_name, source, expected):
+    from backend.ingestion.parser import CodeParser
+
+    parser = CodeParser()
+    chunks = parser.chunk_content(source.encode(), file_name)
+    assert [(c["type"], c["name"]) for c in chunks] == expected
+    # Compiled once and cached next to the parser
+    assert parser.get_query(parser.get_language(file_name)) is parser.queries[parser.get_language(file_name)]
+
+def test_definition_query_members_split_large_classes():
+    from backend.ingestion.chunking import get_token_counter
+    from backend.ingestion.parser import CodeParser
+
+    source = "public class Api {\n" + "".join(
+        f"  public int handler{i}(int a, int b) {{ return a * b + {i}; }}\n" for i in range(8)
+    ) + "}\n"
+    with patch.object(get_token_counter(), "_max_tokens", 40):
+        chunks = CodeParser().chunk_content(source.encode(), "Api.java")
+    assert [c["name"] for c in chunks] == ["Api"] + [f"Api.handler{i}" for i in range(8)]
+    assert chunks[1]["type"] == "method_declaration" and chunks[1]["start_line"] == 1
+
+def test_bulk_copy_payload_is_valid_binary_copy():
+    import struct
+    from backend.db.bulk import BulkWriter, encode_rows, PGCOPY_HEADER, PGCOPY_TRAILER
+    from backend.rag.chunks import compress_text, decompress_text
+
+    writer = BulkWriter(session=None, batch_size=10)
+    doc_id = writer.add_document(uuid.uuid4(), "/repo/a.py", None, {"language": "unknown"})
+    writer.add_embedding(
+        uuid.uuid4(), doc_id, np.array([1.0, -2.5], dtype=np.float32), {"name": "a"}, generation=3,
+        symbol="a", lexemes="a", content=compress_text("def a(): pass"),
+    )
+    assert writer.pending_rows == 2
+
+    payload = encode_rows(BulkWriter.EMBEDDING_COLUMNS, writer.embeddings)
+    assert payload.startswith(PGCOPY_HEADER) and payload.endswith(PGCOPY_TRAILER)
+
+    offset = len(PGCOPY_HEADER)
+    (field_count,) = struct.unpack_from("!h", payload, offset)
+    assert field_count == 9
+    offset += 2
+    fields = []
+    for _ in range(field_count):
+        (length,) = struct.unpack_from("!i", payload, offset)
+        offset += 4
+        fields.append(payload[offset:offset + length])
+        offset += length
+    assert uuid.UUID(bytes=fields[2]) == doc_id
+    dim, _ = struct.unpack_from("!hh", fields[3])
+    assert dim == 2
+    assert struct.unpack_from("!2f", fields[3], 4) == (1.0, -2.5)
+    assert fields[4] == b'{"name": "a"}'
+    assert struct.unpack("!i", fields[5]) == (3,)
+    assert decompress_text(fields[8]) == "def a(): pass"
+
+    # NULLs are sent as length -1
+    doc_payload = encode_rows(BulkWriter.DOCUMENT_COLUMNS, writer.documents)
+    assert struct.pack("!i", -1) in doc_payload
+
+def test_create_project_queues_ingestion_job(client):
+    """
+    POST returns as soon as the job is queued instead of awaiting ingestion.
+    """
+    with patch("backend.api.v1.endpoints.projects.start_ingestion_job") as mock_start:
+        response = client.post("/api/v1/projects/?repo_url=https://github.com/test/repo")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "queued"
+    mock_start.assert_called_once()
+    assert str(mock_start.call_args.args[0]) == body["job_id"]
+
+@pytest.mark.asyncio
+async def test_run_ingestion_job_records_status_transitions(mock_db_session):
+    from types import SimpleNamespace
+    from backend.ingestion import jobs
+
+    project_id = uuid.uuid4()
+    job = SimpleNamespace(id=uuid.uuid4(), project_id=project_id, incremental=False, commit_sha=None, generation=None)
+    project = SimpleNamespace(id=project_id, repo_url="https://github.com/test/repo")
+    session = mock_db_session.return_value.__aenter__.return_value
+    session.get.side_effect = [job, project]
+
+    async def fake_run(files, pid, known_docs=None, stats=None, blobs=None, checkpoint=None, generation=None):
+        assert known_docs is None and generation == 8
+        stats.update(parsed=len(files), chunks=3, scanned=len(files))
+        return stats
+
+    updates = []
+    async def record_update(job_id, **values):
+        updates.append(values)
+
+    with patch.object(jobs, "get_db", AsyncMock(return_value=mock_db_session)), \
+         patch.object(jobs, "update_job", record_update), \
+         patch("backend.ingestion.repo_loader.repo_loader.clone_repo", return_value="/tmp/repos/x"), \
+         patch("backend.ingestion.repo_loader.repo_loader.list_blobs", return_value={"/tmp/repos/x/a.py": ("f00", 10)}), \
+         patch("backend.ingestion.repo_loader.repo_loader.get_head_commit", return_value="abc123"), \
+         patch("backend.ingestion.pipeline.ingestion_pipeline.begin_generation", AsyncMock(return_value=8)), \
+         patch("backend.ingestion.pipeline.ingestion_pipeline.run", fake_run), \
+         patch.object(jobs, "schedule_index_gc") as schedule_gc:
+        stats = await jobs.run_ingestion_job(job.id)
+
+    assert stats["parsed"] == 1
+    assert {"commit_sha": "abc123", "generation": 8} in updates
+    schedule_gc.assert_called_once_with(str(project_id))
+    statuses = [u["status"] for u in updates if "status" in u]
+    assert statuses[0] == "cloning"
+    assert statuses[-1] == "done"
+    assert updates[-1]["files_written"] == 1 and updates[-1]["chunks_written"] == 3
+
+@pytest.mark.asyncio
+async def test_run_ingestion_job_marks_failures(mock_db_session):
+    from types import SimpleNamespace
+    from backend.ingestion import jobs
+
+    project_id = uuid.uuid4()
+    session = mock_db_session.return_value.__aenter__.return_value
+    session.get.side_effect = [
+        SimpleNamespace(id=uuid.uuid4(), project_id=project_id, incremental=False, commit_sha=None, generation=None),
+        SimpleNamespace(id=project_id, repo_url="https://github.com/test/missing"),
+    ]
+    updates = []
+    async def record_update(job_id, **values):
+        updates.append(values)
+
+    abandon = AsyncMock()
+    with patch.object(jobs, "get_db", AsyncMock(return_value=mock_db_session)), \
+         patch.object(jobs, "update_job", record_update), \
+         patch("backend.ingestion.repo_loader.repo_loader.clone_repo", return_value="/tmp/repos/x"), \
+         patch("backend.ingestion.repo_loader.repo_loader.get_head_commit", return_value="abc123"), \
+         patch("backend.ingestion.repo_loader.repo_loader.list_blobs", side_effect=RuntimeError("bad object")), \
+         patch("backend.ingestion.pipeline.ingestion_pipeline.begin_generation", AsyncMock(return_value=2)), \
+         patch("backend.ingestion.pipeline.ingestion_pipeline.abandon", abandon):
+        assert await jobs.run_ingestion_job(uuid.uuid4()) is None
+
+    assert updates[-1]["status"] == "failed"
+    assert updates[-1]["error"] == "bad object"
+    # The half-built generation never goes live
+    abandon.assert_awaited_once_with(str(project_id), 2)
+
+@pytest.mark.asyncio
+async def test_interrupted_job_resumes_at_recorded_commit(mock_db_session):
+    from types import SimpleNamespace
+    from backend.ingestion import jobs
+
+    project_id = uuid.uuid4()
+    session = mock_db_session.return_value.__aenter__.return_value
+    session.get.side_effect = [
+        SimpleNamespace(id=uuid.uuid4(), project_id=project_id, incremental=True, commit_sha="abc123", generation=5),
+        SimpleNamespace(id=project_id, repo_url="https://github.com/test/repo"),
+    ]
+    checkpoints = []
+    async def fake_sync(files, pid, changes, stats=None, blobs=None, checkpoint=None, generation=None):
+        # Files stored before the interruption match by hash, nothing left to do
+        assert changes is None and generation == 5
+        await checkpoint(session)
+        checkpoints.append(pid)
+        return stats
+
+    updates = []
+    async def record_update(job_id, **values):
+        updates.append(values)
+
+    ensure_checkout = MagicMock(return_value="/tmp/repos/x")
+    finalize = AsyncMock()
+    with patch.object(jobs, "get_db", AsyncMock(return_value=mock_db_session)), \
+         patch.object(jobs, "update_job", record_update), \
+         patch("backend.ingestion.repo_loader.repo_loader.ensure_checkout", ensure_checkout), \
+         patch("backend.ingestion.repo_loader.repo_loader.clone_repo", side_effect=AssertionError("resume must not re-clone")), \
+         patch("backend.ingestion.repo_loader.repo_loader.list_blobs", return_value={"/tmp/repos/x/a.py": ("f00", 10)}), \
+         patch("backend.ingestion.pipeline.ingestion_pipeline.sync", fake_sync), \
+         patch("backend.ingestion.pipeline.ingestion_pipeline.finalize", finalize), \
+         patch.object(jobs, "schedule_index_gc"):
+        stats = await jobs.run_ingestion_job(uuid.uuid4())
+
+    assert stats is not None
+    assert ensure_checkout.call_args.args == ("https://github.com/test/repo", str(project_id), "abc123")
+    assert checkpoints == [str(project_id)]
+    finalize.assert_awaited_once_with(str(project_id), 5)
+    assert not any("commit_sha" in u for u in updates)
+    assert updates[-1]["status"] == "done"
+
+def test_celery_worker_reuses_one_event_loop():
+    from backend.worker import tasks
+
+    async def current_loop():
+        return asyncio.get_running_loop()
+
+    first = tasks.run_async(current_loop())
+    second = tasks.run_async(current_loop())
+    assert first is second and not first.is_closed()
+
+def test_shard_files_sizes_by_bytes(tmp_path):
+    from backend.ingestion.pipeline import shard_files
+
+    sizes = {"a.py": 40, "b.py": 40, "c.py": 40, "big.min.js": 500, "d.py": 10}
+    files = []
+    for name, size in sizes.items():
+        (tmp_path / name).write_bytes(b"x" * size)
+        files.append(str(tmp_path / name))
+
+    shards = shard_files(files, max_bytes=100)
+
+    assert [[os.path.basename(f) for f in shard] for shard in shards] == [
+        ["a.py", "b.py"], ["c.py"], ["big.min.js"], ["d.py"],
+    ]
+
+@pytest.mark.asyncio
+async def test_large_job_fans_out_shards(mock_db_session, tmp_path):
+    from types import SimpleNamespace
+    from backend.ingestion import jobs
+
+    from backend.ingestion.repo_loader import BlobIndex
+
+    blobs = BlobIndex(str(tmp_path), {str(tmp_path / name): ("f00", 80) for name in ("a.py", "b.py", "c.py")})
+
+    project_id = uuid.uuid4()
+    session = mock_db_session.return_value.__aenter__.return_value
+    session.get.side_effect = [
+        SimpleNamespace(id=uuid.uuid4(), project_id=project_id, incremental=False, commit_sha=None, generation=None),
+        SimpleNamespace(id=project_id, repo_url="https://github.com/test/mono"),
+    ]
+    fan_out = MagicMock()
+    run = AsyncMock()
+
+    with patch.object(jobs, "get_db", AsyncMock(return_value=mock_db_session)), \
+         patch.object(jobs, "update_job", AsyncMock()), \
+         patch.object(jobs.settings, "INGEST_SHARD_BYTES", 100), \
+         patch("backend.ingestion.repo_loader.repo_loader.clone_repo", return_value=str(tmp_path)), \
+         patch("backend.ingestion.repo_loader.repo_loader.list_blobs", return_value=blobs), \
+         patch("backend.ingestion.repo_loader.repo_loader.get_head_commit", return_value="abc123"), \
+         patch("backend.ingestion.pipeline.ingestion_pipeline.begin_generation", AsyncMock(return_value=1)), \
+         patch("backend.ingestion.pipeline.ingestion_pipeline.run", run):
+        stats = await jobs.run_ingestion_job(uuid.uuid4(), fan_out=fan_out)
+
+    assert stats["shards"] == 3
+    run.assert_not_called()
+    pid, repo_url, commit, shards = fan_out.call_args.args
+    assert (pid, commit) == (str(project_id), "abc123")
+    assert shards == [["a.py"], ["b.py"], ["c.py"]]
+
+@pytest.mark.asyncio
+async def test_bulk_copy_goes_through_asyncpg_copy_in():
+    import asyncio
+    from asyncpg.connection import Connection
+    from backend.db.bulk import BulkWriter, PGCOPY_HEADER
+
+    class StubConnection(Connection):
+        """
+        asyncpg's own copy_to_table()/_copy_in() over a protocol that records
+        what would be sent instead of talking to a server.
+        """
+        def __init__(self):
+            self._loop = asyncio.get_running_loop()
+            self._aborted = True  # Nothing to close in __del__
+            self.sent = []
+            sent = self.sent
+
+            class Protocol:
+                async def copy_in(self, copy_stmt, reader, data, *args):
+                    sent.append((copy_stmt, bytes(data)))
+                    return "COPY 1"
+            self._protocol = Protocol()
+
+    driver = StubConnection()
+    raw = MagicMock(driver_connection=driver)
+    conn = MagicMock(get_raw_connection=AsyncMock(return_value=raw))
+    writer = BulkWriter(session=MagicMock(connection=AsyncMock(return_value=conn)))
+    writer.add_document(uuid.uuid4(), "a.py", "hash", {"language": "unknown"})
+    await writer.flush()
+
+    (copy_stmt, payload), = driver.sent
+    assert copy_stmt.startswith('COPY "documents"("id", "project_id"')
+    assert payload.startswith(PGCOPY_HEADER)
+
+@pytest.mark.asyncio
+async def test_stale_job_watchdog_leaves_queued_celery_jobs_to_the_broker(mock_db_session):
+    from sqlalchemy.dialects import postgresql
+    from backend.ingestion import jobs
+
+    session = mock_db_session.return_value.__aenter__.return_value
+    for runner, requeues_queued in (("celery", False), ("inprocess", True)):
+        with patch.object(jobs, "get_db", AsyncMock(return_value=mock_db_session)), \
+             patch.object(jobs.settings, "INGESTION_RUNNER", runner):
+            assert await jobs.resume_stale_jobs() == 0
+        stmt = session.execute.await_args.args[0]
+        sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+        assert ("'queued'" not in sql) == requeues_queued
+
+def test_token_counter_never_goes_to_the_hub_and_is_handed_to_workers():
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from backend.ingestion import chunking
+
+    downloads = []
+    def fake_download(repo_id, filename, **kwargs):
+        downloads.append(kwargs.get("local_files_only"))
+        raise FileNotFoundError(filename)
+
+    with patch("huggingface_hub.hf_hub_download", fake_download):
+        counter = chunking.TokenCounter("org/uncached-model")
+        assert counter.count("def f(x): return x") == 8  # approximated
+        assert counter.max_seq_length == chunking.DEFAULT_MAX_TOKENS
+    assert downloads == [True, True]
+
+    # The parent's tokenizer reaches spawned workers through the pool initializer:
+    # whitespace tokens make "x.y" one token where the approximation sees three
+    tokenizer = Tokenizer(models.WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    spec = chunking.TokenCounter("org/model", tokenizer, 20).spec()
+    text = "x.y\n" * 40
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=chunking.init_token_counter, initargs=spec) as pool:
+        windows = pool.submit(chunking.split_text, text, 0, None, 0).result()
+    assert [(start, end) for _, start, end in windows] == [(0, 17), (18, 35), (36, 39)]
@@ -0,0 +1,365 @@
+import pytest
+import numpy as np
+import os
+import uuid
+import asyncio
+from unittest.mock import MagicMock, AsyncMock, patch
+from backend.rag.embeddings import EmbeddingService
+
+def make_service():
+    """
+    EmbeddingService with a fake model whose vectors encode the text length,
+    so results can be traced back to their inputs.
+    """
+    service = EmbeddingService()
+    model = MagicMock()
+    model.get_sentence_embedding_dimension.return_value = 2
+    def encode(texts, **kwargs):
+        if isinstance(texts, str):
+            return np.array([len(texts), 1.0], dtype=np.float32)
+        return np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+    model.encode.side_effect = encode
+    service._model = model
+    return service
+
+def test_embed_batch_buckets_by_length_and_keeps_order():
+    service = make_service()
+    texts = ["x" * n for n in (50, 1, 30, 2, 40, 3)]
+
+    vectors = service.embed_batch(texts, batch_size=2)
+
+    assert isinstance(vectors, np.ndarray)
+    assert vectors.shape == (6, 2)
+    assert vectors[:, 0].tolist() == [50, 1, 30, 2, 40, 3]
+    # Each forward pass only sees neighbours in length
+    batches = [[len(t) for t in call.args[0]] for call in service.model.encode.call_args_list]
+    assert batches == [[1, 2], [3, 30], [40, 50]]
+
+def test_embed_batch_empty():
+    assert make_service().embed_batch([]).shape == (0, 2)
+
+def test_lru_cache_evicts_and_expires():
+    from backend.core.cache import LRUCache
+
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" is now most recent
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 2, "maxsize": 2}
+
+    with patch("backend.core.cache.time.monotonic", return_value=1000.0):
+        cache.set("short", 4, ttl=5)
+    with patch("backend.core.cache.time.monotonic", return_value=1004.0):
+        assert cache.get("short") == 4
+    with patch("backend.core.cache.time.monotonic", return_value=1006.0):
+        assert cache.get("short") is None
+
+@pytest.mark.asyncio
+async def test_aembed_query_caches_normalized_text():
+    service = make_service()
+
+    first = await service.aembed_query("what does  get_file_list do?")
+    second = await service.aembed_query("  what does get_file_list\ndo? ")
+
+    assert first == second
+    assert service.model.encode.call_count == 1
+    assert service.model.encode.call_args.args[0] == ["what does get_file_list do?"]
+    assert service.query_cache.hits == 1 and service.query_cache.misses == 1
+
+@pytest.mark.asyncio
+async def test_aembed_chunks_reuses_cached_vectors(tmp_path, mock_db_session):
+    from backend.rag import embedding_cache as cache_module
+    from backend.rag.embedding_cache import EmbeddingCache
+
+    service = make_service()
+    cache = EmbeddingCache(directory=str(tmp_path))
+    session = mock_db_session.return_value.__aenter__.return_value
+    # The shared table already knows "bb" (embedded by another project)
+    stored = MagicMock()
+    stored.all.return_value = [(cache.key("bb"), np.array([99.0, 1.0], dtype=np.float32))]
+    session.execute.return_value = stored
+
+    with patch.object(cache_module.settings, "EMBED_CACHE", True), \
+         patch.object(cache_module, "get_db", AsyncMock(return_value=mock_db_session)), \
+         patch("backend.rag.embeddings.embedding_cache", cache):
+        vectors = await service.aembed_chunks(["a", "bb", "ccc", "a"])
+
+        assert vectors[:, 0].tolist() == [1, 99, 3, 1]
+        # Only distinct unseen text is encoded, then written back in bulk
+        assert service.model.encode.call_args.args[0] == ["a", "ccc"]
+        insert = session.execute.await_args_list[-1].args[0]
+        assert insert.table.name == "embedding_cache"
+        assert {p for k, p in insert.compile().params.items() if k.startswith("content_hash")} == {cache.key("a"), cache.key("ccc")}
+        assert session.commit.await_count == 1
+
+        # A second ingestion is served from the disk tier without touching Postgres
+        session.execute.reset_mock()
+        service.model.encode.reset_mock()
+        again = await service.aembed_chunks(["ccc", "bb", "a"])
+
+    assert again[:, 0].tolist() == [3, 99, 1]
+    service.model.encode.assert_not_called()
+    session.execute.assert_not_called()
+    assert cache.stats() == {"hits": 4, "misses": 2}
+
+@pytest.mark.asyncio
+async def test_concurrent_queries_are_micro_batched():
+    import asyncio
+
+    service = make_service()
+    queries = ["a", "bb", "ccc", "bb", "dddd"]
+
+    vectors = await asyncio.gather(*(service.aembed_query(q) for q in queries))
+
+    assert [v[0] for v in vectors] == [1, 2, 3, 2, 4]
+    # One forward pass, duplicate "bb" coalesced
+    assert service.model.encode.call_count == 1
+    assert sorted(service.model.encode.call_args.args[0]) == ["a", "bb", "ccc", "dddd"]
+
+@pytest.mark.asyncio
+async def test_answer_cache_is_scoped_to_index_version():
+    from backend.inference.answer_cache import AnswerCache
+
+    cache = AnswerCache()
+    await cache.set("p1", 3, "What does X do?", "It does Y.", [{"name": "x"}])
+
+    assert (await cache.get("p1", 3, "  what does x  do? "))["answer"] == "It does Y."
+    assert await cache.get("p1", 4, "What does X do?") is None
+    assert await cache.get("p2", 3, "What does X do?") is None
+
+@pytest.mark.asyncio
+async def test_answer_cache_near_duplicate_hit():
+    from backend.inference.answer_cache import AnswerCache
+
+    cache = AnswerCache()
+    cache.similarity_threshold = 0.9
+    await cache.set("p1", 1, "how is ingestion started", "Via POST /projects.", [], query_vector=[1.0, 0.0])
+
+    assert (await cache.get("p1", 1, "how do I start ingestion", [0.99, 0.05]))["answer"] == "Via POST /projects."
+    assert await cache.get("p1", 1, "unrelated", [0.0, 1.0]) is None
+    assert cache.near_hits == 1
+
+    # Question vectors are kept for a bounded number of projects
+    with patch("backend.inference.answer_cache.settings.ANSWER_CACHE_SIMILARITY_PROJECTS", 2):
+        cache = AnswerCache()
+    cache.similarity_threshold = 0.9
+    for pid in ("p1", "p2", "p3"):
+        await cache.set(pid, 1, "how is ingestion started", "Via POST /projects.", [], query_vector=[1.0, 0.0])
+    assert len(cache._vectors) == 2
+    assert await cache.get("p1", 1, "how do I start ingestion", [0.99, 0.05]) is None
+    assert await cache.get("p3", 1, "how do I start ingestion", [0.99, 0.05]) is not None
+
+@pytest.mark.asyncio
+async def test_rag_query_stream_replays_cached_answer(mock_db_session):
+    from backend.inference import rag_flow
+    from backend.inference.answer_cache import AnswerCache
+
+    chunk = MagicMock(chunk_metadata={"name": "f", "content": "def f(): pass"})
+    generated = []
+
+    async def fake_stream(prompt):
+        for token in ["f ", "does nothing"]:
+            generated.append(token)
+            yield token
+
+    async def collect():
+        return [event async for event in rag_flow.rag_query_stream("what is f?", "00000000-0000-0000-0000-000000000001")]
+
+    with patch.object(rag_flow, "answer_cache", AnswerCache()), \
+         patch.object(rag_flow, "get_db", AsyncMock(return_value=mock_db_session)), \
+         patch.object(rag_flow, "get_index_state", AsyncMock(return_value=(7, 2))), \
+         patch.object(rag_flow, "retrieve", AsyncMock(return_value=[chunk])) as mock_search, \
+         patch.object(rag_flow.embedding_service, "aembed_query", AsyncMock(return_value=[1.0, 0.0])), \
+         patch.object(rag_flow.inference_engine, "agenerate_stream", fake_stream):
+        live = await collect()
+        replayed = await collect()
+
+    assert generated == ["f ", "does nothing"]
+    assert mock_search.await_count == 1
+    assert mock_search.await_args.kwargs["generation"] == 2
+    assert replayed[0] == live[0]  # same citations event
+    assert '"data": "f does nothing"' in replayed[1]
+    assert replayed[-1] == "data: [DONE]\n\n"
+
+@pytest.mark.asyncio
+async def test_search_reads_only_the_active_generation():
+    from sqlalchemy.dialects import postgresql
+    from backend.rag.vector_index import search_embeddings
+
+    session = MagicMock(execute=AsyncMock(return_value=MagicMock()))
+    await search_embeddings(session, uuid.uuid4(), [0.0] * 384, limit=5, generation=3)
+
+    stmt = session.execute.await_args_list[-1].args[0]
+    sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    assert "JOIN documents ON documents.id = embeddings.document_id" in sql
+    assert "embeddings.generation <= 3" in sql
+    assert "documents.retired_generation IS NULL OR documents.retired_generation > 3" in sql
+
+def test_lexical_terms_meet_across_identifier_styles():
+    from backend.rag.lexical import chunk_symbol, query_symbols, query_tsquery, text_terms
+
+    assert text_terms("get_file_list(repoPath)") == ["get", "file", "list", "getfilelist", "repo", "path", "repopath"]
+    assert "getfilelist" in text_terms("def getFileList(): ...")
+    assert query_symbols("what does `walk` do, and how is RepoLoader.get_file_list called vs parse()?") == [
+        "walk", "get_file_list", "parse",
+    ]
+    assert query_symbols("How does ingestion work?") == []
+    assert query_tsquery("what does get_file_list do") == "get | list | getfilelist"
+    assert chunk_symbol({"type": "function_definition", "name": "RepoLoader.get_file_list"}) == "get_file_list"
+    assert chunk_symbol({"type": "file_content", "name": "README.md"}) is None
+
+@pytest.mark.asyncio
+async def test_retrieve_symbol_fast_path_and_rank_fusion():
+    from types import SimpleNamespace
+    from backend.rag import retrieval
+
+    a, b, c, d = (SimpleNamespace(id=i) for i in "abcd")
+    pid = uuid.uuid4()
+    with patch.object(retrieval, "search_symbols", AsyncMock(return_value=[d])), \
+         patch.object(retrieval, "search_embeddings", AsyncMock(return_value=[a, b, c])) as vector, \
+         patch.object(retrieval, "search_lexical", AsyncMock(return_value=[b, c])):
+        # A known identifier is answered from its definition, no vector search
+        assert await retrieval.retrieve(None, pid, "what does get_file_list do?", [0.0]) == [d]
+        vector.assert_not_awaited()
+
+        # Otherwise chunks both retrievers found outrank the vector-only top hit
+        assert await retrieval.retrieve(None, pid, "how are repos cloned?", [0.0], limit=3) == [b, c, a]
+
+@pytest.mark.asyncio
+async def test_local_vector_index_matches_exact_l2_and_evicts(tmp_path):
+    from backend.rag import local_index
+    from backend.rag.local_index import LocalIndexCache, LocalVectorIndex, write_index
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 16)).astype(np.float32)
+    ids = [uuid.uuid4() for _ in range(300)]
+    query = rng.normal(size=16).astype(np.float32)
+    expected = np.argsort(((vectors - query) ** 2).sum(axis=1))[:5]
+
+    with patch.object(local_index, "BLOCK_ROWS", 64):
+        for dtype in ("float32", "float16"):
+            path = str(tmp_path / dtype)
+            write_index(path, ids, vectors, [{"name": f"f{i}"} for i in range(300)], dtype)
+            index = LocalVectorIndex(path)
+            mapped = (index.vectors, index.norms, index.ids, index.document_ids, index.offsets)
+            assert index.nbytes == sum(a.nbytes for a in mapped) + len(index.meta)
+            hits = index.search(query, limit=5)
+            assert [h.id for h in hits] == [ids[i] for i in expected]
+            assert hits[0].chunk_metadata == {"name": f"f{expected[0]}"}
+
+    pid_a, pid_b = str(uuid.uuid4()), str(uuid.uuid4())
+    cache = LocalIndexCache(directory=str(tmp_path / "cache"), budget=40_000)
+    export = AsyncMock()
+    with patch.object(local_index.settings, "VECTOR_LOCAL_HOT_QUERIES", 2), \
+         patch.object(cache, "export", export):
+        # Cold projects fall through to Postgres until they are hot enough to export
+        assert await cache.search(pid_a, 1, query) is None
+        assert await cache.search(pid_a, 1, query) is None
+        await asyncio.sleep(0)
+        export.assert_awaited_once_with(pid_a, 1)
+
+    write_index(cache._path(pid_a, 1), ids, vectors, [{}] * 300)
+    write_index(cache._path(pid_b, 1), ids, vectors, [{}] * 300)
+    assert len(await cache.search(pid_a, 1, query)) == 5
+    assert len(await cache.search(pid_b, 1, query)) == 5
+    # Both don't fit the budget, the least recently used one was dropped
+    assert list(cache._resident) == [(pid_b, 1)]
+    # A newer generation is not exported yet, the old one is never served for it
+    assert await cache.search(pid_b, 2, query) is None
+    # Once it is, loading it deletes the superseded export
+    write_index(cache._path(pid_b, 2), ids, vectors, [{}] * 300)
+    assert len(await cache.search(pid_b, 2, query)) == 5
+    assert not os.path.exists(cache._path(pid_b, 1))
+
+    # An export that doesn't fit once loaded is not exported again on every query
+    small = LocalIndexCache(directory=str(tmp_path / "small"), budget=10_000)
+    write_index(small._path(pid_a, 1), ids, vectors, [{}] * 300)
+    export = AsyncMock()
+    with patch.object(local_index.settings, "VECTOR_LOCAL_HOT_QUERIES", 1), \
+         patch.object(small, "export", export):
+        assert await small.search(pid_a, 1, query) is None
+        assert await small.search(pid_a, 1, query) is None
+        await asyncio.sleep(0)
+    export.assert_not_awaited()
+    assert (pid_a, 1) in small._too_large
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("quantization, index_expression", [
+    ("halfvec", "CAST(embeddings.vector AS HALFVEC(384)) <->"),
+    ("bit", "CAST(binary_quantize(embeddings.vector) AS BIT(384)) <~>"),
+])
+async def test_quantized_search_reranks_candidates_at_full_precision(quantization, index_expression):
+    from sqlalchemy.dialects import postgresql
+    from backend.rag.vector_index import hnsw_index_ddl, search_embeddings
+
+    session = MagicMock(execute=AsyncMock(return_value=MagicMock()))
+    await search_embeddings(session, uuid.uuid4(), [0.0] * 384, limit=5, quantization=quantization, candidates=40)
+
+    ef_search, stmt = (call.args[0] for call in session.execute.await_args_list[-2:])
+    assert "hnsw.ef_search = 40" in str(ef_search)
+    compiled = stmt.compile(dialect=postgresql.dialect())
+    inner, outer = str(compiled).split(") AS anon_1")
+    # Candidates come from the quantized index, the final order from the float32 vectors
+    assert index_expression in inner and "LIMIT" in inner
+    assert "ORDER BY embeddings.vector <-> %(vector_1)s" in outer
+    assert {40, 5} <= {v for v in compiled.params.values() if isinstance(v, int)}
+    # The indexed expression is the one the query orders by
+    assert ("binary_quantize(vector)::bit(384)" if quantization == "bit" else "vector::halfvec(384)") in hnsw_index_ddl("ix", quantization=quantization)
+
+@pytest.mark.asyncio
+async def test_chunk_text_is_stored_apart_and_hydrated_on_demand():
+    from sqlalchemy.dialects import postgresql
+    from backend.rag.chunks import citation, load_chunk_texts, split_chunk
+    from backend.rag.vector_index import search_embeddings
+
+    chunk = {"type": "function_definition", "name": "f", "content": "def f(): pass", "start_line": 3, "end_line": 3}
+    metadata, content = split_chunk(chunk, "src/a.py")
+    assert metadata == {"path": "src/a.py", "type": "function_definition", "name": "f", "start_line": 3, "end_line": 3, "part": None}
+
+    new_id, old_id = uuid.uuid4(), uuid.uuid4()
+    rows = MagicMock()
+    rows.all.return_value = [(new_id, content, metadata), (old_id, None, {"name": "g", "content": "def g(): pass"})]
+    session = MagicMock(execute=AsyncMock(return_value=rows))
+    # Rows written before the split still have their text in chunk_metadata
+    assert await load_chunk_texts(session, [new_id, old_id]) == {new_id: "def f(): pass", old_id: "def g(): pass"}
+    assert citation(MagicMock(id=old_id, chunk_metadata={"name": "g", "content": "def g(): pass"})) == {"id": str(old_id), "name": "g"}
+
+    # Retrieval reads neither the vector nor the text
+    session = MagicMock(execute=AsyncMock(return_value=MagicMock()))
+    await search_embeddings(session, uuid.uuid4(), [0.0] * 384, limit=5, quantization="halfvec")
+    stmt = session.execute.await_args_list[-1].args[0]
+    columns = str(stmt.compile(dialect=postgresql.dialect())).split("FROM")[0]
+    assert "embeddings.chunk_metadata" in columns
+    assert "embeddings.vector" not in columns and "embeddings.content" not in columns
+
+@pytest.mark.asyncio
+async def test_small_project_search_is_exact_instead_of_filtering_the_global_index():
+    from sqlalchemy.dialects import postgresql
+    from backend.rag.vector_index import search_embeddings
+
+    small, large = uuid.uuid4(), uuid.uuid4()
+    rows = [MagicMock(id=uuid.uuid4()) for _ in range(5)]
+
+    async def execute(stmt, params=None):
+        result = MagicMock()
+        # Only the large foreign project has its own partial index
+        result.scalar.return_value = params is not None and large.hex in params["name"]
+        result.all.return_value = rows
+        return result
+
+    session = MagicMock(execute=AsyncMock(side_effect=execute))
+    assert await search_embeddings(session, small, [0.0] * 384, limit=5, quantization="halfvec") == rows
+    lookup, stmt = (call.args[0] for call in session.execute.await_args_list)
+    sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    # No HNSW settings, no quantized candidates: every row of the project, sorted exactly
+    assert "to_regclass" in str(lookup)
+    assert f"embeddings.project_id = '{small}'::uuid" in sql
+    assert "ORDER BY (embeddings.vector <-> '[" in sql and "]') + 0 \n LIMIT 5" in sql
+    assert "HALFVEC" not in sql
+
+    session.execute.reset_mock()
+    await search_embeddings(session, large, [0.0] * 384, limit=5, quantization="halfvec")
+    stmt = session.execute.await_args_list[-1].args[0]
+    assert "CAST(embeddings.vector AS HALFVEC(384)) <->" in str(stmt.compile(dialect=postgresql.dialect()))
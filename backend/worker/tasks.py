@@ -1,75 +1,112 @@
 from backend.worker.celery_app import celery_app
-from backend.ingestion.repo_loader import repo_loader
-from backend.ingestion.parser import code_parser
-from backend.rag.embeddings import embedding_service
+from backend.core.config import settings
+from backend.ingestion.jobs import (
+    collect_index_garbage, create_job, fail_sharded_job, finalize_sharded_job,
+    run_ingestion_job, run_ingestion_shard,
+)
+from backend.db import session as db_session
 from backend.db.session import get_db
-from backend.models.document import Document
-from backend.models.analytics import Embedding
-from backend.models.models import Project
+from celery import chord, group
+from celery.signals import worker_process_init
+from typing import List, Optional
 import asyncio
+import uuid
 
-@celery_app.task
-def ingest_repo_task(repo_url: str, project_id: str):
+# One event loop per worker process, reused by every task. The async engine's
+# pooled asyncpg connections are bound to the loop that opened them, so a
+# fresh loop per task (or per file) would mean fresh connections every time.
+_loop = None
+
+def get_worker_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+def run_async(coro):
+    return get_worker_loop().run_until_complete(coro)
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    # A forked child must not reuse connections opened by the parent
+    db_session.engine = None
+    db_session.AsyncSessionLocal = None
+    run_async(get_db())
+
+# acks_late: a worker killed mid-job leaves the message unacknowledged, so the
+# broker redelivers it and the job resumes from its last checkpoint
+@celery_app.task(acks_late=True, reject_on_worker_lost=True)
+def ingest_repo_task(repo_url: Optional[str] = None, project_id: Optional[str] = None, incremental: bool = False, job_id: Optional[str] = None):
     """
     Celery task to clone and parse a repo.
+    Runs the given ingestion job, or queues a new one for `project_id`
+    (the repo URL is read from the project). With incremental=True only files
+    changed since the last run are re-ingested.
+    """
+    if job_id is None:
+        async def queue_job():
+            SessionLocal = await get_db()
+            async with SessionLocal() as session:
+                job = await create_job(session, uuid.UUID(str(project_id)), incremental=incremental)
+                return str(job.id)
+        job_id = run_async(queue_job())
+
+    print(f"Starting ingestion job {job_id}")
+    stats = run_async(run_ingestion_job(job_id, fan_out=_shard_dispatcher(job_id)))
+    if stats is None:
+        return {"status": "failed", "job_id": job_id}
+    if stats.get("shards"):
+        return {"status": "sharded", "job_id": job_id, "files_processed": stats["files"], "shards": stats["shards"]}
+
+    print(f"ingest_repo_task completed. Parsed {stats['parsed']}/{stats['files']} files.")
+    return {"status": "completed", "job_id": job_id, "files_processed": stats["files"], "parsed": stats["parsed"]}
+
+def _shard_dispatcher(job_id: str):
+    def dispatch(project_id: str, repo_url: str, commit: str, shards: List[List[str]]):
+        header = group(
+            ingest_shard_task.s(job_id, project_id, repo_url, commit, shard) for shard in shards
+        )
+        callback = finalize_ingestion_task.s(job_id, project_id).on_error(ingestion_failed_task.s(job_id))
+        chord(header)(callback)
+    return dispatch
+
+@celery_app.task(
+    bind=True,
+    # Ack only after the shard is done, and requeue it if the worker process dies
+    acks_late=True,
+    reject_on_worker_lost=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=settings.INGEST_SHARD_MAX_RETRIES,
+)
+def ingest_shard_task(self, job_id: str, project_id: str, repo_url: str, commit: str, rel_paths: List[str]):
     """
-    print(f"Starting ingestion for {repo_url} (Project: {project_id})")
-    
-    # 1. Clone
-    try:
-        repo_path = repo_loader.clone_repo(repo_url, repo_id=project_id)
-        print(f"Cloned to {repo_path}")
-    except Exception as e:
-        print(f"Clone failed: {e}")
-        return {"status": "failed", "error": str(e)}
+    Parses and embeds one shard of a fanned-out ingestion.
+    """
+    print(f"Ingesting shard of {len(rel_paths)} files for job {job_id} (attempt {self.request.retries + 1})")
+    return run_async(run_ingestion_shard(job_id, project_id, repo_url, commit, rel_paths))
 
-    # 2. Walk and Parse
-    files = repo_loader.get_file_list(repo_path)
-    print(f"Found {len(files)} files")
-    
-    async def save_chunks(chunks, file_path):
-        SessionLocal = await get_db()
-        async with SessionLocal() as session:
-            # Create Document
-            doc = Document(project_id=project_id, type="code", path=file_path, metadata_={"language": "unknown"}) # Detect lang later
-            session.add(doc)
-            await session.flush()
-            
-            for chunk in chunks:
-                # Embed
-                vector = embedding_service.embed_text(chunk['content'])
-                
-                # Create Embedding
-                emb = Embedding(
-                    document_id=doc.id,
-                    vector=vector,
-                    chunk_metadata=chunk # type, name, lines
-                )
-                session.add(emb)
-            await session.commit()
+@celery_app.task
+def finalize_ingestion_task(shard_stats: List[dict], job_id: str, project_id: str):
+    """
+    Chord callback: runs once every shard of the job has completed.
+    """
+    return run_async(finalize_sharded_job(job_id, project_id, shard_stats))
 
-    parsed_count = 0
-    loop = asyncio.get_event_loop()
+@celery_app.task
+def ingestion_failed_task(request, exc, traceback, job_id: str):
+    """
+    Chord error callback: a shard exhausted its retries.
+    """
+    run_async(fail_sharded_job(job_id, str(exc)))
 
-    for file_path in files:
-        root_node, content = code_parser.parse_file(file_path)
-        if root_node:
-            chunks = code_parser.extract_definitions(root_node, content)
-            if not chunks:
-                 # Fallback to generic text chunking if parser found nothing (e.g. scripts, config)
-                 chunks = code_parser.chunk_file_generic(content, file_path)
-            
-            if chunks:
-                # Sync wrapper for async DB
-                loop.run_until_complete(save_chunks(chunks, file_path))
-                parsed_count += 1
-        else:
-             # Try generic chunking for unsupported extensions too if needed?
-             # For now, let's trust the parser filter, but maybe log it
-             pass
-    
-    print(f"ingest_repo_task completed. Parsed {parsed_count}/{len(files)} files.")
-    return {"status": "completed", "files_processed": len(files), "parsed": parsed_count}
+@celery_app.task
+def collect_index_garbage_task(project_id: str):
+    """
+    Deletes rows retired by a project's last index generation flip.
+    """
+    return run_async(collect_index_garbage(project_id))
 
 @celery_app.task
 def test_task(word: str):
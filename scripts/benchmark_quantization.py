@@ -0,0 +1,105 @@
+"""
+Recall / latency / memory of quantized first-stage vector search on one
+ingested project, against an exact full-precision scan.
+
+    python scripts/benchmark_quantization.py --project-id <uuid> --build
+    python scripts/benchmark_quantization.py --project-id <uuid> --questions questions.txt
+
+Queries are stored chunk vectors of the project (or the embedded lines of
+--questions). For every mode ("" = float32 HNSW, halfvec, bit) and rerank
+candidate count it reports recall@k against the exact top k, p50/p95
+latency, and the size of the project's index for that mode.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.append(os.getcwd())
+
+from sqlalchemy import func, select, text
+from backend.db import session as db_session
+from backend.models.analytics import Embedding
+from backend.rag.vector_index import (
+    QUANTIZATIONS, VECTOR_DIM, hnsw_index_ddl, project_index_name, project_literal, search_embeddings,
+)
+
+BYTES_PER_VECTOR = {"": 4 * VECTOR_DIM, "halfvec": 2 * VECTOR_DIM, "bit": VECTOR_DIM // 8}
+
+async def build_indexes(pid: uuid.UUID):
+    async with db_session.engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for mode in QUANTIZATIONS:
+            name = project_index_name(pid, mode)
+            print(f"Building {name}...")
+            started = time.perf_counter()
+            await conn.execute(text(hnsw_index_ddl(name, where=f"project_id = '{pid}'::uuid", concurrently=True, quantization=mode)))
+            print(f"  {time.perf_counter() - started:.1f}s")
+
+async def index_size(session, name: str):
+    return await session.scalar(text("SELECT pg_relation_size(to_regclass(:name))"), {"name": name})
+
+async def load_queries(session, pid: uuid.UUID, count: int, questions: str = None):
+    if questions:
+        from backend.rag.embeddings import embedding_service
+        with open(questions) as f:
+            lines = [line.strip() for line in f if line.strip()][:count]
+        return list(embedding_service.embed_batch(lines))
+    result = await session.execute(
+        select(Embedding.vector).filter(Embedding.project_id == project_literal(pid)).order_by(func.random()).limit(count)
+    )
+    return [row[0] for row in result.all()]
+
+async def exact_top_k(session, pid: uuid.UUID, query, k: int):
+    # No index scan: a sequential scan sorted by true distance
+    await session.execute(text("SET LOCAL enable_indexscan = off"))
+    result = await session.execute(
+        select(Embedding.id).filter(Embedding.project_id == project_literal(pid))
+        .order_by(Embedding.vector.l2_distance(query)).limit(k)
+    )
+    ids = {row[0] for row in result.all()}
+    await session.rollback()
+    return ids
+
+async def run(args):
+    pid = uuid.UUID(args.project_id)
+    await db_session.get_db()
+    if args.build:
+        await build_indexes(pid)
+
+    async with db_session.AsyncSessionLocal() as session:
+        rows = await session.scalar(select(func.count()).select_from(Embedding).filter(Embedding.project_id == pid))
+        queries = await load_queries(session, pid, args.queries, args.questions)
+        print(f"Project {pid}: {rows} vectors, {len(queries)} queries, k={args.k}")
+        truth = [await exact_top_k(session, pid, q, args.k) for q in queries]
+
+        print(f"{'mode':<9}{'cands':>7}{'recall':>9}{'p50 ms':>9}{'p95 ms':>9}{'index MB':>10}{'vector B':>10}")
+        for mode in QUANTIZATIONS:
+            size = await index_size(session, project_index_name(pid, mode))
+            for candidates in (args.candidates if mode else [args.k]):
+                recalls, latencies = [], []
+                for query, expected in zip(queries, truth):
+                    started = time.perf_counter()
+                    hits = await search_embeddings(session, pid, query, limit=args.k, quantization=mode, candidates=candidates)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    await session.rollback()
+                    recalls.append(len({h.id for h in hits} & expected) / max(len(expected), 1))
+                latencies.sort()
+                print(
+                    f"{mode or 'float32':<9}{candidates:>7}{statistics.mean(recalls):>9.3f}"
+                    f"{latencies[len(latencies) // 2]:>9.2f}{latencies[int(len(latencies) * 0.95)]:>9.2f}"
+                    f"{(size or 0) / 1024 ** 2:>10.1f}{BYTES_PER_VECTOR[mode]:>10}"
+                )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--project-id", required=True)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--questions", help="File with one question per line, embedded as queries")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidates", type=lambda s: [int(c) for c in s.split(",")], default=[10, 20, 40, 80])
+    parser.add_argument("--build", action="store_true", help="Build the project's partial index for every mode first")
+    asyncio.run(run(parser.parse_args()))
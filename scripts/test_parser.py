@@ -13,7 +13,7 @@ try:
         print("Failed to parse file")
         exit(1)
 
-    definitions = code_parser.extract_definitions(root, content)
+    definitions = code_parser.extract_definitions(root, content, code_parser.get_language(abs_path))
     print(f"Found {len(definitions)} definitions:")
     
     print("\n--- Top Level Nodes ---")